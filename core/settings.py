@@ -82,3 +82,7 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = 'login'
+
+# PDV: baixar o stock com UPDATE condicional (stock_actual >= n) em vez de
+# bloquear os produtos com SELECT ... FOR UPDATE durante a venda
+PDV_STOCK_CONDICIONAL = os.environ.get('PDV_STOCK_CONDICIONAL', 'False') == 'True'
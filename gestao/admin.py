@@ -1,15 +1,42 @@
 from django.contrib import admin
 from django.utils import timezone
-from datetime import timedelta
 from django.utils.html import format_html
 from django.core.exceptions import ValidationError
 from .models import Produto, Venda, Compra, ItemVenda, ItemCompra, Fornecedor, Despesa, ReceitaExtra, Categoria
+from . import lotes, diario, fechos
 
 # Admin personalizado
 admin.site.site_header = "Universo de Beleza"
 admin.site.site_title = "Universo de Beleza"
 admin.site.index_title = "Painel de Gestão"
 
+class MesFechadoMixin:
+    """Meses fechados no admin: erro no formulário ao gravar e remoção
+    recusada (também em cascata), em vez do erro 500 do PeriodoFechado
+    lançado pelos signals, que ficam só como última defesa."""
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if not hasattr(form._meta.model, 'data'):
+            return form
+
+        class FormMesAberto(form):
+            def clean(self):
+                dados = super().clean()
+                modelo = type(self.instance)
+                # Data guardada (o registo não pode sair de um mês fechado) e a nova
+                datas = [dados.get('data')]
+                if self.instance.pk:
+                    datas.append(modelo.objects.filter(pk=self.instance.pk).values_list('data', flat=True).first())
+                fechos.verificar_aberto(*datas)
+                return dados
+        return FormMesAberto
+
+    def get_deleted_objects(self, objs, request):
+        apagados, contagem, sem_permissao, protegidos = super().get_deleted_objects(objs, request)
+        return apagados, contagem, sem_permissao, list(protegidos) + fechos.registos_fechados(objs)
+
+
 class ItemCompraInline(admin.TabularInline):
     model = ItemCompra
     extra = 1
@@ -36,20 +63,34 @@ class ItemVendaInline(admin.TabularInline):
         return ValidatedFormset
 
 @admin.register(Compra)
-class CompraAdmin(admin.ModelAdmin):
+class CompraAdmin(MesFechadoMixin, admin.ModelAdmin):
     list_display = ('id', 'fornecedor', 'data', 'valor_total')
     inlines = [ItemCompraInline]
 
+    def save_related(self, request, form, formsets, change):
+        # As linhas são gravadas uma a uma: um só lançamento no diário no fim
+        with diario.adiado():
+            super().save_related(request, form, formsets, change)
+
 @admin.register(Venda)
-class VendaAdmin(admin.ModelAdmin):
+class VendaAdmin(MesFechadoMixin, admin.ModelAdmin):
     list_display = ('id', 'data', 'valor_total', 'metodo_pagamento', 'utilizador')
     inlines = [ItemVendaInline]
 
+    def save_related(self, request, form, formsets, change):
+        # As linhas são gravadas uma a uma: um só lançamento no diário no fim
+        with diario.adiado():
+            super().save_related(request, form, formsets, change)
+
 @admin.register(Produto)
-class ProdutoAdmin(admin.ModelAdmin):
+class ProdutoAdmin(MesFechadoMixin, admin.ModelAdmin):
     list_display = ('nome', 'marca', 'exibir_custo_medio', 'exibir_preco_venda', 'exibir_lucro', 'exibir_stock', 'exibir_valor_inventario', 'status_validade')
     search_fields = ('nome', 'marca')
 
+    def get_queryset(self, request):
+        # Próxima validade lida da lista de alertas num JOIN, em vez de uma query por linha
+        return lotes.com_proxima_validade(super().get_queryset(request))
+
     def get_readonly_fields(self, request, obj=None):
         # Depois de criado e com custo, o preço de custo fica só leitura
         if obj and obj.preco_custo > 0:
@@ -86,19 +127,21 @@ class ProdutoAdmin(admin.ModelAdmin):
     exibir_valor_inventario.short_description = "Valor Total"
 
     def status_validade(self, obj):
-        proximo_lote = obj.itemcompra_set.filter(quantidade__gt=0).order_by('validade').first()
-        if not proximo_lote: return "---"
-        hoje = timezone.now().date()
-        prazo_alerta = hoje + timedelta(days=30)
-        if proximo_lote.validade < hoje:
+        if not obj.proxima_validade: return "---"
+        faixa = lotes.faixa_validade(obj.proxima_validade, timezone.now().date())
+        if faixa == 'V':
             return format_html('<b style="color:#ff4d4d;">{}</b>', "VENCIDO")
-        elif proximo_lote.validade <= prazo_alerta:
+        elif faixa == '30':
             return format_html('<b style="color:#ffae42;">{}</b>', "FEFO")
-        return proximo_lote.validade.strftime('%d/%m/%y')
+        return obj.proxima_validade.strftime('%d/%m/%y')
+    status_validade.admin_order_field = 'proxima_validade'
     status_validade.short_description = "Validade"
 
 # REGISTOS SIMPLES
-admin.site.register(Categoria)
+class RegistoSimplesAdmin(MesFechadoMixin, admin.ModelAdmin):
+    pass
+
+admin.site.register(Categoria, RegistoSimplesAdmin)
 admin.site.register(Fornecedor)
-admin.site.register(Despesa)
-admin.site.register(ReceitaExtra)
\ No newline at end of file
+admin.site.register(Despesa, RegistoSimplesAdmin)
+admin.site.register(ReceitaExtra, RegistoSimplesAdmin)
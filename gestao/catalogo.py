@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models import F
+from .models import AlteracaoCatalogo, Produto, VersaoCatalogo
+
+# Ordem das colunas de cada produto no catálogo enviado ao PDV
+CAMPOS = ['id', 'nome', 'marca', 'preco_venda', 'stock_actual']
+
+
+def nova_versao():
+    """Incrementa a versão do catálogo e devolve-a.
+
+    A linha fica bloqueada até a transacção de quem chama terminar: a
+    versão seguinte só é atribuída depois desta ser confirmada.
+    """
+    with transaction.atomic():
+        VersaoCatalogo.objects.get_or_create(id=1)
+        VersaoCatalogo.objects.filter(id=1).update(versao=F('versao') + 1)
+        return VersaoCatalogo.objects.values_list('versao', flat=True).get(id=1)
+
+
+def registar_alteracoes(produto_ids, removido=False):
+    """Marca produtos como alterados (ou removidos) numa versão nova do catálogo.
+
+    A versão é atribuída depois do commit de quem chama, numa transacção
+    curta à parte: um checkout não espera pela linha de VersaoCatalogo. Um
+    produto já confirmado e ainda sem a versão nova recebe-a na mesma, maior
+    do que qualquer versão que um PDV já tenha lido, e vai no delta seguinte.
+    """
+    produto_ids = set(produto_ids)
+    if not produto_ids:
+        return
+    transaction.on_commit(lambda: _publicar(produto_ids, removido))
+
+
+def _publicar(produto_ids, removido):
+    with transaction.atomic():
+        versao = nova_versao()
+        if removido:
+            AlteracaoCatalogo.objects.bulk_create([AlteracaoCatalogo(produto_id=pid, versao=versao) for pid in produto_ids])
+        else:
+            Produto.objects.filter(id__in=produto_ids).update(versao=versao)
+
+
+def versao_actual():
+    return VersaoCatalogo.objects.filter(id=1).values_list('versao', flat=True).first() or 0
+
+
+def _linhas(produtos):
+    return [
+        [p['id'], p['nome'], p['marca'], str(p['preco_venda']), p['stock_actual']]
+        for p in produtos.order_by('nome').values(*CAMPOS)
+    ]
+
+
+def snapshot():
+    """Catálogo completo em formato compacto (uma lista por produto)."""
+    versao = versao_actual()
+    return {'versao': versao, 'completo': True, 'campos': CAMPOS, 'produtos': _linhas(Produto.objects.all())}
+
+
+def diferencas(desde):
+    """Produtos alterados ou removidos depois da versão `desde`.
+
+    A versão é lida primeiro: um produto alterado entretanto pode vir já
+    nesta resposta e voltar na seguinte, mas nenhum fica de fora.
+    """
+    versao = versao_actual()
+    linhas = _linhas(Produto.objects.filter(versao__gt=desde))
+    existentes = {linha[0] for linha in linhas}
+    removidos = set(AlteracaoCatalogo.objects.filter(versao__gt=desde).values_list('produto_id', flat=True))
+    return {
+        'versao': versao,
+        'completo': False,
+        'campos': CAMPOS,
+        'produtos': linhas,
+        'removidos': sorted(removidos - existentes),
+    }
@@ -0,0 +1,117 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Sum, DecimalField
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import EstatisticaProduto, ItemVenda, Produto
+from . import estatisticas
+
+# Janela móvel da classificação (dias até hoje)
+JANELA_DIAS = 90
+# Fatia acumulada da receita: A até 80%, B até 95%, o resto C
+LIMITE_A = 0.80
+LIMITE_B = 0.95
+# Coeficiente de variação das vendas semanais: X até 0.5, Y até 1.0, o resto Z
+LIMITE_X = 0.5
+LIMITE_Y = 1.0
+
+
+def classes_abc(receitas):
+    """Classe Pareto de cada posição de `receitas` (array de receitas por produto).
+
+    Ordena por receita decrescente e acumula a fatia do total *antes* de cada
+    produto: o produto que atravessa os 80% ainda é A. Receita zero é sempre C.
+    """
+    receitas = np.asarray(receitas, dtype=float)
+    classes = np.full(receitas.shape, 'C', dtype='<U1')
+    total = receitas.sum()
+    if total <= 0:
+        return classes
+    ordem = np.argsort(-receitas, kind='stable')
+    anterior = (np.cumsum(receitas[ordem]) - receitas[ordem]) / total
+    ordenadas = np.where(anterior < LIMITE_A, 'A', np.where(anterior < LIMITE_B, 'B', 'C'))
+    classes[ordem] = ordenadas
+    classes[receitas <= 0] = 'C'
+    return classes
+
+
+def classes_xyz(unidades_semanais):
+    """Classe XYZ de cada linha de uma matriz [produto, semana] de unidades.
+
+    Usa o coeficiente de variação (desvio padrão / média); sem vendas é Z.
+    """
+    matriz = np.asarray(unidades_semanais, dtype=float)
+    media = matriz.mean(axis=1) if matriz.size else np.zeros(len(matriz))
+    desvio = matriz.std(axis=1) if matriz.size else np.zeros(len(matriz))
+    cv = np.divide(desvio, media, out=np.full(media.shape, np.inf), where=media > 0)
+    return np.where(cv <= LIMITE_X, 'X', np.where(cv <= LIMITE_Y, 'Y', 'Z'))
+
+
+def vendas_por_dia(produto_ids, inicio, dias):
+    """Vendas da janela [inicio, inicio + dias) como arrays NumPy.
+
+    `produto_ids` é um array ordenado de ids. Uma só query agrupada por
+    produto e dia; devolve (unidades, receitas): a matriz [produto, dia] de
+    unidades vendidas e o vector da receita de cada produto na janela.
+    """
+    fim = inicio + timedelta(days=dias)
+    linhas = list(
+        ItemVenda.objects.filter(venda__data__gte=inicio, venda__data__lt=fim)
+        .values_list('produto_id', TruncDate('venda__data'))
+        .annotate(
+            unidades=Sum('quantidade'),
+            receita=Sum(F('quantidade') * F('preco_unitario'), output_field=DecimalField(max_digits=18, decimal_places=2)),
+        )
+        .order_by()
+    )
+    receitas = np.zeros(len(produto_ids))
+    unidades = np.zeros((len(produto_ids), dias))
+    if linhas:
+        ids, dias_venda, qtd, valor = zip(*linhas)
+        posicao = np.searchsorted(produto_ids, np.array(ids, dtype=np.int64))
+        dia = np.array([(d - inicio.date()).days for d in dias_venda])
+        np.add.at(receitas, posicao, np.array(valor, dtype=float))
+        np.add.at(unidades, (posicao, dia), np.array(qtd, dtype=float))
+    return unidades, receitas
+
+
+def classificar(dias=JANELA_DIAS, agora=None):
+    """Recalcula a classe ABC (receita) e XYZ (regularidade) de todos os produtos.
+
+    Lê as vendas da janela numa query agrupada por produto e dia, monta uma
+    matriz [produto, semana] e classifica o catálogo inteiro de uma vez com
+    NumPy. O resultado fica na EstatisticaProduto, para as vistas filtrarem
+    por classe em SQL. Corre como tarefa agendada (comando classificar_abc).
+    Devolve {'A': n, 'B': n, 'C': n}.
+    """
+    agora = agora or timezone.now()
+    # Semanas completas até ao fim de hoje
+    semanas = max(1, dias // 7)
+    fim = datetime.combine(agora.date() + timedelta(days=1), time.min)
+    inicio = fim - timedelta(weeks=semanas)
+
+    produto_ids = np.array(sorted(Produto.objects.values_list('id', flat=True)), dtype=np.int64)
+    if not len(produto_ids):
+        return {'A': 0, 'B': 0, 'C': 0}
+    diarias, receitas = vendas_por_dia(produto_ids, inicio, semanas * 7)
+    unidades = diarias.reshape(len(produto_ids), semanas, 7).sum(axis=2)
+
+    abc = classes_abc(receitas)
+    xyz = classes_xyz(unidades)
+
+    with transaction.atomic():
+        estatisticas._garantir(produto_ids.tolist())
+        por_produto = {
+            e.produto_id: e for e in EstatisticaProduto.objects.select_for_update().filter(produto_id__in=produto_ids.tolist())
+        }
+        for i, pid in enumerate(produto_ids.tolist()):
+            e = por_produto[pid]
+            e.classe_abc, e.classe_xyz = str(abc[i]), str(xyz[i])
+            e.receita_janela = Decimal(str(round(receitas[i], 2)))
+            e.classificado_em = agora
+        EstatisticaProduto.objects.bulk_update(
+            por_produto.values(), ['classe_abc', 'classe_xyz', 'receita_janela', 'classificado_em'], batch_size=500,
+        )
+    return {c: int((abc == c).sum()) for c in 'ABC'}
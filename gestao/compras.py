@@ -0,0 +1,151 @@
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThan
+from django.utils.dateparse import parse_date
+from .models import Produto, Compra, ItemCompra
+from .utils import ComoDecimal, valor_por_id
+from . import estatisticas, lotes, catalogo, diario
+
+# Linhas por INSERT em lote
+TAMANHO_LOTE = 500
+
+
+class CompraInvalida(Exception):
+    """Uma ou mais linhas da compra são inválidas.
+
+    `erros` é uma lista de dicts com 'linha' (1 = primeira linha) e 'mensagem'.
+    """
+    def __init__(self, erros):
+        super().__init__("; ".join(f"Linha {e['linha']}: {e['mensagem']}" for e in erros))
+        self.erros = erros
+
+
+def aplicar_entradas(itens, data):
+    """Dá entrada de várias linhas de compra (ItemCompra já gravados) de uma vez.
+
+    O custo médio ponderado e o stock de cada produto são calculados pela
+    própria base de dados num único UPDATE para todos os produtos:
+
+        preco_custo  = (stock * preco_custo + valor recebido) / (stock + qtd recebida)
+        stock_actual = stock + qtd recebida
+
+    Como a leitura e a escrita são a mesma instrução, uma venda ou outra
+    compra em simultâneo não perde actualizações e não é preciso bloquear o
+    produto antes. preco_custo vem antes de stock_actual no SET: o MySQL
+    avalia as atribuições pela ordem e tem de usar o stock antigo.
+    """
+    quantidades, valores = {}, {}
+    for item in itens:
+        quantidades[item.produto_id] = quantidades.get(item.produto_id, 0) + item.quantidade
+        valores[item.produto_id] = valores.get(item.produto_id, Decimal('0')) + item.quantidade * Decimal(str(item.preco_custo))
+    if not quantidades:
+        return
+
+    moeda = models.DecimalField(max_digits=18, decimal_places=2)
+    qtd = valor_por_id(quantidades, models.IntegerField(), omissao=Value(0))
+    valor = valor_por_id(valores, moeda, omissao=Value(0))
+    total_unidades = F('stock_actual') + qtd
+    # Numerador decimal explícito: a divisão nunca é inteira
+    custo_total = ComoDecimal(F('stock_actual') * F('preco_custo') + valor, moeda)
+    Produto.objects.filter(id__in=quantidades).update(
+        preco_custo=Case(
+            When(GreaterThan(total_unidades, 0),
+                 then=Round(custo_total / total_unidades, 2, output_field=moeda)),
+            default=F('preco_custo'),
+            output_field=moeda,
+        ),
+        stock_actual=total_unidades,
+    )
+    estatisticas.registar_compras(quantidades, data)
+    lotes.abrir_lotes(itens)
+    # UPDATE em conjunto não dispara o post_save de Produto
+    catalogo.registar_alteracoes(quantidades)
+
+
+def validar_linha(i, produtos):
+    """Converte uma linha {id, quantidade, preco_custo, validade, lote} num
+    ItemCompra por gravar. Devolve (item, None) ou (None, mensagem de erro)."""
+    if not isinstance(i, dict):
+        return None, "Linha inválida."
+    try:
+        produto_id = int(i['id'])
+        quantidade = int(i['quantidade'])
+        preco_custo = Decimal(str(i['preco_custo']))
+    except (KeyError, TypeError, ValueError, InvalidOperation):
+        return None, "Produto, quantidade ou custo inválidos."
+    if produto_id not in produtos:
+        return None, f"Produto #{produto_id} não existe."
+    if quantidade < 1:
+        return None, "A quantidade tem de ser pelo menos 1."
+    if not preco_custo.is_finite() or preco_custo < 0:
+        return None, "O preço de custo não pode ser negativo."
+    try:
+        validade = parse_date(str(i.get('validade') or ''))
+    except ValueError:
+        validade = None
+    if validade is None:
+        return None, "A data de validade é obrigatória (AAAA-MM-DD)."
+    lote = str(i.get('lote') or '').strip()
+    if len(lote) > 50:
+        return None, "O código de lote tem no máximo 50 caracteres."
+    return ItemCompra(
+        produto_id=produto_id, quantidade=quantidade, preco_custo=preco_custo.quantize(Decimal('0.01')),
+        validade=validade, lote=lote,
+    ), None
+
+
+def inserir_itens(compra, itens):
+    """Grava em lote ItemCompra (ainda sem compra) e dá-lhes entrada no stock.
+
+    bulk_create não dispara o post_save de ItemCompra: custo médio, stock,
+    lotes e estatísticas são aplicados aqui para todas as linhas de uma vez.
+    """
+    for item in itens:
+        item.compra = compra
+    ultimo_id = ItemCompra.objects.filter(compra=compra).order_by('-id').values_list('id', flat=True).first() or 0
+    gravados = ItemCompra.objects.bulk_create(itens, batch_size=TAMANHO_LOTE)
+    if any(item.pk is None for item in gravados):
+        # MySQL não devolve os ids de um INSERT em lote
+        gravados = list(ItemCompra.objects.filter(compra=compra, id__gt=ultimo_id).order_by('id'))
+    aplicar_entradas(gravados, compra.data)
+    return gravados
+
+
+def fechar_compra(compra):
+    """Calcula o total da compra uma vez, no fim, e actualiza o resumo do dia."""
+    total = compra.itens.aggregate(
+        t=Sum(F('quantidade') * F('preco_custo'), output_field=models.DecimalField(max_digits=18, decimal_places=2))
+    )['t'] or Decimal('0')
+    compra.valor_total = Decimal(total).quantize(Decimal('0.01'))
+    Compra.objects.filter(id=compra.id).update(valor_total=compra.valor_total)
+    diario.registar(Compra, compra.id)
+
+
+def registar_compra(fornecedor, linhas):
+    """Regista uma compra com todas as linhas de uma vez.
+
+    Os produtos são lidos numa só query, todas as linhas são validadas antes
+    de gravar (CompraInvalida traz a lista completa de erros), as linhas são
+    inseridas em lote e o total é escrito uma única vez.
+    """
+    ids = {int(i['id']) for i in linhas if isinstance(i, dict) and str(i.get('id', '')).isdigit()}
+    produtos = set(Produto.objects.filter(id__in=ids).values_list('id', flat=True))
+    itens, erros = [], []
+    for n, linha in enumerate(linhas, start=1):
+        item, erro = validar_linha(linha, produtos)
+        if erro:
+            erros.append({'linha': n, 'mensagem': erro})
+        else:
+            itens.append(item)
+    if not linhas:
+        erros.append({'linha': 0, 'mensagem': "A compra não tem linhas."})
+    if erros:
+        raise CompraInvalida(erros)
+
+    with transaction.atomic():
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        inserir_itens(compra, itens)
+        fechar_compra(compra)
+    return compra
@@ -0,0 +1,254 @@
+import heapq
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncDate
+from .models import Venda, ReceitaExtra, Compra, Despesa, Movimento, SaldoCaixa, SaldoDiario
+from . import resumos
+
+# modelo -> (origem no diário, sinal do valor)
+ORIGENS = {
+    Venda: ('V', 1),
+    ReceitaExtra: ('R', 1),
+    Despesa: ('D', -1),
+    Compra: ('C', -1),
+}
+ENTRADAS = ['V', 'R']
+SAIDAS = ['D', 'C']
+
+
+def momento_de(modelo, data):
+    """Data/hora de um registo no diário (Despesa e ReceitaExtra só têm o dia)."""
+    if modelo in resumos.COM_HORA:
+        return data
+    return datetime.combine(data, time.min)
+
+
+def _descricao(modelo, registo):
+    if modelo is Venda:
+        return f"Venda #{registo['id']}"
+    if modelo is Compra:
+        return f"Compra #{registo['id']}"
+    return registo['descricao']
+
+
+def _trinco():
+    # Uma escrita de cada vez no diário (as vendas já esperam pela linha do
+    # ResumoDiario do dia, por isso isto não acrescenta contenção)
+    caixa, _ = SaldoCaixa.objects.select_for_update().get_or_create(id=1)
+    return caixa
+
+
+def _acrescentar(modelo, origem_id, momento, valor, descricao):
+    # Só se acrescenta: um movimento com data passada não mexe nas linhas
+    # seguintes, porque o saldo de cada linha é calculado na leitura
+    origem, sinal = ORIGENS[modelo]
+    Movimento.objects.create(
+        momento=momento, origem=origem, origem_id=origem_id,
+        descricao=descricao[:255], valor=valor,
+    )
+    SaldoCaixa.objects.filter(id=1).update(saldo=F('saldo') + valor)
+    _somar_aos_saldos_diarios(momento.date(), valor)
+    # O ResumoDiario recebe a mesma diferença, no dia do movimento
+    resumos.somar(modelo, momento.date(), sinal * valor)
+
+
+def _somar_aos_saldos_diarios(dia, valor):
+    # Pontos de controlo do dia do movimento em diante (para um movimento de
+    # hoje é uma linha); o dia sem linha começa com o saldo do dia anterior
+    if not SaldoDiario.objects.filter(data=dia).exists():
+        SaldoDiario.objects.create(data=dia, saldo=_saldo_no_fim_de(dia - timedelta(days=1)))
+    SaldoDiario.objects.filter(data__gte=dia).update(saldo=F('saldo') + valor)
+
+
+def _saldo_no_fim_de(dia):
+    saldo = SaldoDiario.objects.filter(data__lte=dia).order_by('-data').values_list('saldo', flat=True).first()
+    return saldo or Decimal('0')
+
+
+_adiados = threading.local()
+
+
+@contextmanager
+def adiado():
+    """Junta os registar() feitos dentro do bloco e corre cada um uma vez no fim.
+
+    O admin grava as linhas de uma venda ou compra uma a uma e cada linha
+    muda o total: sem isto o diário ficava com uma correcção por linha.
+    """
+    if getattr(_adiados, 'pendentes', None) is not None:
+        # Já dentro de um bloco: quem o abriu faz o registo
+        yield
+        return
+    _adiados.pendentes = {}
+    try:
+        yield
+        pendentes = _adiados.pendentes
+    finally:
+        _adiados.pendentes = None
+    for modelo, registo_id in pendentes:
+        registar(modelo, registo_id)
+
+
+def registar(modelo, registo_id):
+    """Acerta o diário com o estado actual de um registo de caixa.
+
+    Compara o que já foi lançado para o registo com o seu valor e data
+    actuais (ou nada, se foi apagado) e acrescenta só as linhas que faltam:
+    o lançamento inicial, uma correcção do valor ou a anulação numa data antiga.
+    As mesmas diferenças são somadas ao ResumoDiario.
+    Dentro de adiado() só fica marcado para o fim do bloco.
+    """
+    pendentes = getattr(_adiados, 'pendentes', None)
+    if pendentes is not None:
+        pendentes[(modelo, registo_id)] = True
+        return
+    origem, sinal = ORIGENS[modelo]
+    campo_valor, _ = resumos.ORIGENS[modelo]
+    campos = ['id', 'data', campo_valor] + (['descricao'] if modelo in (Despesa, ReceitaExtra) else [])
+    with transaction.atomic():
+        _trinco()
+        registo = modelo.objects.filter(id=registo_id).values(*campos).first()
+        lancado, descricao_anterior = {}, None
+        for momento, valor, descricao in Movimento.objects.filter(origem=origem, origem_id=registo_id).order_by('id').values_list('momento', 'valor', 'descricao'):
+            lancado[momento] = lancado.get(momento, Decimal('0')) + valor
+            descricao_anterior = descricao_anterior or descricao
+
+        if registo:
+            alvo_momento = momento_de(modelo, registo['data'])
+            alvo = sinal * (registo[campo_valor] or Decimal('0'))
+            descricao = _descricao(modelo, registo)
+        else:
+            alvo_momento, alvo, descricao = None, Decimal('0'), descricao_anterior
+        for momento, total in lancado.items():
+            if momento != alvo_momento and total:
+                _acrescentar(modelo, registo_id, momento, -total, f"Anulação — {descricao}")
+        diferenca = alvo - lancado.get(alvo_momento, Decimal('0'))
+        if diferenca:
+            texto = f"Correcção — {descricao}" if alvo_momento in lancado else descricao
+            _acrescentar(modelo, registo_id, alvo_momento, diferenca, texto)
+
+
+def saldo_actual():
+    return SaldoCaixa.objects.filter(id=1).values_list('saldo', flat=True).first() or Decimal('0')
+
+
+def saldo_em(dia):
+    """Saldo de caixa no fim do dia `dia`.
+
+    Lido do ponto de controlo (SaldoDiario) mais próximo até esse dia: uma
+    query, qualquer que seja a data. Os dias sem movimentos não têm linha e
+    ficam com o saldo do último dia que a tem.
+    """
+    return _saldo_no_fim_de(dia)
+
+
+def _depois_de(linha):
+    return Q(momento__gt=linha['momento']) | Q(momento=linha['momento'], id__gt=linha['id'])
+
+
+def com_saldos(linhas):
+    """Acrescenta 'saldo' (saldo depois do movimento) a linhas do diário
+    ordenadas por (momento, id) decrescente, como as do extrato.
+
+    Duas queries, qualquer que seja o filtro das linhas: os saldos no fim
+    dos dias da página (SaldoDiario) e, em cada um desses dias, os movimentos
+    desde a linha mais antiga da página até ao fim do dia, percorridos para
+    trás a partir do saldo do dia. Nunca se lê para lá dos dias da página.
+    """
+    if not linhas:
+        return linhas
+    mais_antiga = {}
+    for linha in linhas:
+        mais_antiga[linha['momento'].date()] = linha
+    filtro = Q()
+    for dia, linha in mais_antiga.items():
+        fim = datetime.combine(dia + timedelta(days=1), time.min)
+        filtro |= Q(momento__lt=fim) & (_depois_de(linha) | Q(id=linha['id']))
+    with transaction.atomic():
+        fechos = dict(SaldoDiario.objects.filter(data__in=mais_antiga).values_list('data', 'saldo'))
+        mesmos_dias = Movimento.objects.filter(filtro).order_by('-momento', '-id').values_list('id', 'momento', 'valor')
+        saldos, dia = {}, None
+        for movimento_id, momento, valor in mesmos_dias:
+            if momento.date() != dia:
+                dia = momento.date()
+                saldo = fechos.get(dia, Decimal('0'))
+            saldos[movimento_id] = saldo
+            saldo -= valor
+    for linha in linhas:
+        linha['saldo'] = saldos[linha['id']]
+    return linhas
+
+
+def em_sequencia_com_saldo(linhas):
+    """Como com_saldos(), para o diário inteiro lido em sequência (exportações):
+    o saldo de cada linha é o da anterior menos o valor dela."""
+    saldo = None
+    for linha in linhas:
+        if saldo is None:
+            saldo = com_saldos([linha])[0]['saldo']
+        linha['saldo'] = saldo
+        saldo -= linha['valor']
+        yield linha
+
+
+def _fonte(modelo):
+    origem, sinal = ORIGENS[modelo]
+    campo_valor, _ = resumos.ORIGENS[modelo]
+    campos = ['id', 'data', campo_valor] + (['descricao'] if modelo in (Despesa, ReceitaExtra) else [])
+    for r in modelo.objects.order_by('data', 'id').values(*campos).iterator():
+        yield momento_de(modelo, r['data']), origem, r['id'], _descricao(modelo, r), sinal * (r[campo_valor] or Decimal('0'))
+
+
+def _registos():
+    # Os quatro modelos por ordem de data, fundidos em streaming
+    return heapq.merge(*(_fonte(modelo) for modelo in ORIGENS))
+
+
+def reconstruir(tamanho_lote=1000):
+    """Apaga o diário e os saldos diários e volta a gerá-los a partir das quatro tabelas de origem."""
+    Movimento.objects.all().delete()
+    saldo, lote, total, saldos = Decimal('0'), [], 0, {}
+    for momento, origem, origem_id, descricao, valor in _registos():
+        if not valor:
+            continue
+        saldo += valor
+        saldos[momento.date()] = saldo
+        lote.append(Movimento(momento=momento, origem=origem, origem_id=origem_id,
+                              descricao=descricao[:255], valor=valor))
+        if len(lote) >= tamanho_lote:
+            Movimento.objects.bulk_create(lote)
+            total += len(lote)
+            lote = []
+    Movimento.objects.bulk_create(lote)
+    SaldoCaixa.objects.update_or_create(id=1, defaults={'saldo': saldo})
+    SaldoDiario.objects.all().delete()
+    SaldoDiario.objects.bulk_create([SaldoDiario(data=dia, saldo=valor) for dia, valor in saldos.items()], batch_size=500)
+    return total + len(lote)
+
+
+def verificar():
+    """Compara o diário com as tabelas de origem: lista de problemas em texto."""
+    problemas = []
+    lancado = {}
+    for origem, origem_id, valor in Movimento.objects.values_list('origem', 'origem_id', 'valor').iterator():
+        lancado[(origem, origem_id)] = lancado.get((origem, origem_id), Decimal('0')) + valor
+    esperado = {(origem, origem_id): valor for _, origem, origem_id, _, valor in _registos()}
+    for chave in sorted(set(lancado) | set(esperado)):
+        e, a = esperado.get(chave, Decimal('0')), lancado.get(chave, Decimal('0'))
+        if e != a:
+            problemas.append(f"{chave[0]}-{chave[1]}: esperado {e}, no diário {a}")
+    saldo, esperados = Decimal('0'), {}
+    for dia, total in Movimento.objects.annotate(dia=TruncDate('momento')).values_list('dia').annotate(total=Sum('valor')).order_by('dia'):
+        saldo += total
+        esperados[dia] = saldo
+    if saldo != saldo_actual():
+        problemas.append(f"SaldoCaixa {saldo_actual()}, esperado {saldo}")
+    guardados = dict(SaldoDiario.objects.values_list('data', 'saldo'))
+    for dia in sorted(set(esperados) | set(guardados)):
+        if esperados.get(dia) != guardados.get(dia):
+            problemas.append(f"SaldoDiario {dia}: esperado {esperados.get(dia)}, guardado {guardados.get(dia)}")
+    return problemas
@@ -0,0 +1,86 @@
+from datetime import timedelta
+from django.db.models import Count, DecimalField, F, IntegerField, Max, Q, Sum, Value, DateTimeField
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import EstatisticaProduto, ItemCompra, ItemVenda, Produto
+from .utils import valor_por_id
+
+ESTAGNADO = "Estagnado ⚠️"
+
+
+def _garantir(produto_ids):
+    # Cria as linhas que faltam para que os UPDATEs seguintes as encontrem
+    existentes = set(EstatisticaProduto.objects.filter(produto_id__in=produto_ids).values_list('produto_id', flat=True))
+    novos = [EstatisticaProduto(produto_id=pid) for pid in produto_ids if pid not in existentes]
+    if novos:
+        EstatisticaProduto.objects.bulk_create(novos, ignore_conflicts=True)
+
+
+def _mais_recente(campo, data):
+    return Greatest(Coalesce(F(campo), Value(data, output_field=DateTimeField())), Value(data, output_field=DateTimeField()))
+
+
+def registar_vendas(linhas, data):
+    """Soma as linhas [(produto_id, quantidade)] de uma venda feita em `data`."""
+    unidades, contagem = {}, {}
+    for produto_id, quantidade in linhas:
+        unidades[produto_id] = unidades.get(produto_id, 0) + quantidade
+        contagem[produto_id] = contagem.get(produto_id, 0) + 1
+    if not unidades:
+        return
+    _garantir(unidades)
+    EstatisticaProduto.objects.filter(produto_id__in=unidades).update(
+        unidades_vendidas=F('unidades_vendidas') + valor_por_id(unidades, IntegerField(), 'produto_id', Value(0)),
+        num_vendas=F('num_vendas') + valor_por_id(contagem, IntegerField(), 'produto_id', Value(0)),
+        ultima_venda=_mais_recente('ultima_venda', data),
+    )
+
+
+def registar_compras(produto_ids, data):
+    """Marca `data` como a última compra dos produtos recebidos."""
+    produto_ids = set(produto_ids)
+    if not produto_ids:
+        return
+    _garantir(produto_ids)
+    EstatisticaProduto.objects.filter(produto_id__in=produto_ids).update(
+        ultima_compra=_mais_recente('ultima_compra', data),
+    )
+
+
+def filtro_estagnados(agora=None):
+    """Q equivalente a status_giro() == ESTAGNADO, para filtrar Produto em SQL."""
+    # status_giro considera recente uma compra com (agora - data).days <= 7
+    limite = (agora or timezone.now()) - timedelta(days=8)
+    sem_vendas = Q(estatistica__isnull=True) | Q(estatistica__num_vendas=0)
+    sem_compra_recente = Q(estatistica__ultima_compra__isnull=True) | Q(estatistica__ultima_compra__lte=limite)
+    return sem_vendas & sem_compra_recente
+
+
+def capital_estagnado():
+    """Valor em stock (a custo) dos produtos estagnados, numa só query."""
+    return Produto.objects.filter(filtro_estagnados()).aggregate(
+        total=Sum(F('stock_actual') * F('preco_custo'), output_field=DecimalField())
+    )['total'] or 0
+
+
+def reconstruir():
+    """Volta a calcular todas as estatísticas a partir de ItemVenda e ItemCompra."""
+    vendas = {
+        l['produto_id']: l for l in ItemVenda.objects.values('produto_id').annotate(
+            unidades=Sum('quantidade'), linhas=Count('id'), ultima=Max('venda__data')
+        ).order_by()
+    }
+    compras = dict(
+        ItemCompra.objects.values('produto_id').annotate(ultima=Max('compra__data')).values_list('produto_id', 'ultima').order_by()
+    )
+    EstatisticaProduto.objects.all().delete()
+    EstatisticaProduto.objects.bulk_create([
+        EstatisticaProduto(
+            produto_id=pid,
+            unidades_vendidas=vendas[pid]['unidades'] if pid in vendas else 0,
+            num_vendas=vendas[pid]['linhas'] if pid in vendas else 0,
+            ultima_venda=vendas[pid]['ultima'] if pid in vendas else None,
+            ultima_compra=compras.get(pid),
+        )
+        for pid in set(vendas) | set(compras)
+    ], batch_size=500)
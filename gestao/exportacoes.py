@@ -0,0 +1,216 @@
+import io
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from docx import Document
+from .models import TarefaExportacao, Venda, ItemCompra
+from .utils import em_lotes
+from . import extrato, diario, relatorios
+
+# Tarefa em curso há mais do que isto: o worker parou e ela é dada como falhada
+TEMPO_MAXIMO = timedelta(minutes=30)
+# Ficheiros prontos (ou erros) ficam disponíveis durante
+VALIDADE_FICHEIRO = timedelta(days=1)
+# Linhas lidas entre duas actualizações do progresso
+PASSO_PROGRESSO = 500
+LOTE_LEITURA = 2000
+TIPOS = {
+    'pdf': ('application/pdf', 'pdf'),
+    'word': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx'),
+}
+
+
+# --- TABELAS (lidas aos blocos, uma query por bloco) ---
+
+def _vendas():
+    metodos = dict(Venda.METODOS_PAGAMENTO)
+    vendas = Venda.objects.all()
+    linhas = (
+        [f"#{v['id']}", v['data'].strftime('%d/%m/%Y %H:%M'), v['utilizador__username'],
+         metodos.get(v['metodo_pagamento'], v['metodo_pagamento']), f"{v['valor_total']:,.2f}"]
+        for v in em_lotes(vendas, ['-data', '-id'], ['utilizador__username', 'metodo_pagamento', 'valor_total'], LOTE_LEITURA)
+    )
+    return vendas.count(), linhas
+
+
+def _compras():
+    itens = ItemCompra.objects.all()
+    linhas = (
+        [f"#{i['compra_id']}", i['compra__data'].strftime('%d/%m/%Y'), i['compra__fornecedor__nome'] or '—', i['produto__nome'],
+         str(i['quantidade']), f"{i['preco_custo']:,.2f}", i['validade'].strftime('%d/%m/%Y')]
+        for i in em_lotes(itens, ['-compra_id', '-id'],
+                          ['compra__data', 'compra__fornecedor__nome', 'produto__nome', 'quantidade', 'preco_custo', 'validade'], LOTE_LEITURA)
+    )
+    return itens.count(), linhas
+
+
+def _extrato():
+    movimentos = extrato.movimentos()
+    linhas = (
+        [m['momento'].strftime('%d/%m/%Y'), m['descricao'], 'Entrada' if m['origem'] in diario.ENTRADAS else 'Saída',
+         f'{m["valor"]:,.2f}', f'{m["saldo"]:,.2f}']
+        for m in diario.em_sequencia_com_saldo(em_lotes(movimentos, ['-momento', '-id'], extrato.CAMPOS, LOTE_LEITURA))
+    )
+    return movimentos.count(), linhas
+
+
+def _relatorio():
+    # Série mensal partilhada com o separador financeiro (uma query, em cache)
+    meses = relatorios.mensal()
+    linhas = (
+        [m['mes'].strftime('%B %Y').upper(), f'{m["vendas"]:,.2f}', f'{m["saidas"]:,.2f}', f'{m["lucro"]:,.2f}', f'{m["margem"]:.1f}%']
+        for m in meses
+    )
+    return len(meses), linhas
+
+
+# documento -> (título, nome do ficheiro, colunas, larguras no PDF (cm), colunas em Kz no Word, tabela)
+DOCUMENTOS = {
+    'vendas': ('Histórico de Vendas', 'historico_vendas', ['ID', 'Data', 'Utilizador', 'Método', 'Total (Kz)'],
+               [2, 4, 3, 3, 4], [4], _vendas),
+    'compras': ('Histórico de Compras', 'historico_compras', ['ID', 'Data', 'Fornecedor', 'Produto', 'Qtd', 'Custo Unit.', 'Validade'],
+                [1.5, 2.5, 3, 3.5, 1.5, 2.5, 2.5], [5], _compras),
+    'extrato': ('Extrato de Caixa', 'extrato_caixa', ['Data', 'Descrição', 'Tipo', 'Valor (Kz)', 'Saldo (Kz)'],
+                [2.5, 6, 2.5, 3, 3], [3, 4], _extrato),
+    'relatorio': ('Relatórios Mensais', 'relatorios_mensais', ['Mês / Ano', 'Receitas (Kz)', 'Custos (Kz)', 'Resultado (Kz)', 'Margem %'],
+                  [4, 3.5, 3.5, 3.5, 2.5], [1, 2, 3], _relatorio),
+}
+
+
+# --- FORMATOS ---
+
+def estilo_tabela_pdf():
+    return TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#4b0082')),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,0), 9),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.white, colors.HexColor('#faf5ff')]),
+        ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#e0d0f0')),
+        ('FONTSIZE', (0,1), (-1,-1), 8),
+        ('TOPPADDING', (0,0), (-1,-1), 6),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+    ])
+
+
+def cabecalho_word(doc, titulo):
+    from docx.shared import RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    p = doc.add_heading(titulo, 0)
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = p.runs[0]
+    run.font.color.rgb = RGBColor(0x4b, 0x00, 0x82)
+    doc.add_paragraph(f"Universo de Beleza — Exportado em {timezone.now().strftime('%d/%m/%Y %H:%M')}")
+    doc.add_paragraph()
+
+
+def _pdf(titulo, colunas, larguras, linhas):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
+    styles = getSampleStyleSheet()
+    tabela = Table([colunas, *linhas], colWidths=[l * cm for l in larguras])
+    tabela.setStyle(estilo_tabela_pdf())
+    doc.build([
+        Paragraph(titulo, styles['Title']),
+        Paragraph(f'Universo de Beleza — {timezone.now().strftime("%d/%m/%Y %H:%M")}', styles['Normal']),
+        Spacer(1, 0.5*cm),
+        tabela,
+    ])
+    return buffer.getvalue()
+
+
+def _word(titulo, colunas, moeda, linhas):
+    doc = Document()
+    cabecalho_word(doc, titulo)
+    tabela = doc.add_table(rows=1, cols=len(colunas))
+    tabela.style = 'Table Grid'
+    for i, h in enumerate(colunas):
+        cell = tabela.rows[0].cells[i]
+        cell.text = h
+        cell.paragraphs[0].runs[0].bold = True
+    for linha in linhas:
+        row = tabela.add_row().cells
+        for i, valor in enumerate(linha):
+            row[i].text = f'{valor} Kz' if i in moeda else valor
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+# --- FILA ---
+
+def pedir(documento, formato, utilizador=None):
+    """Põe uma exportação na fila e devolve a tarefa.
+
+    Um pedido igual a outro ainda pendente (mesmo documento e formato) não
+    cria tarefa nova: devolve a que já está na fila.
+    """
+    chave = f"{documento}:{formato}"
+    tarefa = TarefaExportacao.objects.defer('conteudo').filter(chave_pendente=chave).first()
+    if tarefa:
+        return tarefa
+    try:
+        with transaction.atomic():
+            return TarefaExportacao.objects.create(documento=documento, formato=formato, chave_pendente=chave, pedido_por=utilizador)
+    except IntegrityError:
+        # Um pedido igual entrou entretanto
+        return pedir(documento, formato, utilizador)
+
+
+def reservar():
+    """Passa a tarefa pendente mais antiga a 'em curso' e devolve-a (None se não há).
+
+    A linha é lida com SELECT ... FOR UPDATE SKIP LOCKED: vários workers não
+    pegam na mesma tarefa. A partir daqui um pedido igual já cria outra
+    tarefa, com os dados que existirem quando for gerada.
+    """
+    agora = timezone.now()
+    with transaction.atomic():
+        TarefaExportacao.objects.filter(estado='E', iniciado_em__lt=agora - TEMPO_MAXIMO).update(
+            estado='F', erro="O worker parou antes de terminar.", concluido_em=agora,
+        )
+        tarefa = (
+            TarefaExportacao.objects.select_for_update(skip_locked=True).defer('conteudo')
+            .filter(estado='P').order_by('id').first()
+        )
+        if tarefa is None:
+            return None
+        tarefa.estado, tarefa.chave_pendente, tarefa.iniciado_em = 'E', None, agora
+        tarefa.save(update_fields=['estado', 'chave_pendente', 'iniciado_em'])
+    return tarefa
+
+
+def _com_progresso(tarefa, linhas, total):
+    # Leitura das linhas até 90%; o resto é a montagem do ficheiro
+    for n, linha in enumerate(linhas, start=1):
+        if n % PASSO_PROGRESSO == 0:
+            TarefaExportacao.objects.filter(id=tarefa.id).update(progresso=min(90, 90 * n // max(total, 1)))
+        yield linha
+
+
+def executar(tarefa):
+    """Gera o ficheiro de uma tarefa reservada e guarda-o. Devolve True se correu bem."""
+    titulo, nome, colunas, larguras, moeda, tabela = DOCUMENTOS[tarefa.documento]
+    tipo, extensao = TIPOS[tarefa.formato]
+    try:
+        total, linhas = tabela()
+        linhas = _com_progresso(tarefa, linhas, total)
+        conteudo = _pdf(titulo, colunas, larguras, linhas) if tarefa.formato == 'pdf' else _word(titulo, colunas, moeda, linhas)
+    except Exception as e:
+        TarefaExportacao.objects.filter(id=tarefa.id).update(estado='F', erro=str(e)[:1000], concluido_em=timezone.now())
+        return False
+    TarefaExportacao.objects.filter(id=tarefa.id).update(
+        estado='C', progresso=100, conteudo=conteudo, nome_ficheiro=f"{nome}.{extensao}", concluido_em=timezone.now(),
+    )
+    return True
+
+
+def limpar():
+    """Apaga as tarefas terminadas há mais de VALIDADE_FICHEIRO."""
+    return TarefaExportacao.objects.filter(estado__in=['C', 'F'], concluido_em__lt=timezone.now() - VALIDADE_FICHEIRO).delete()[0]
@@ -0,0 +1,96 @@
+from datetime import datetime, time, timedelta
+from django.db.models import Q
+from .models import Movimento
+from . import resumos, diario
+
+POR_PAGINA = 25
+CAMPOS = ['id', 'momento', 'origem', 'origem_id', 'descricao', 'valor']
+
+
+class Cursor:
+    """Posição no extrato: (momento, id) de uma linha do diário.
+
+    O extrato é ordenado por (momento, id) decrescente; em texto fica
+    "AAAA-MM-DDTHH:MM:SS_id", para ir no URL.
+    """
+    def __init__(self, momento, movimento_id):
+        self.momento, self.movimento_id = momento, movimento_id
+
+    @classmethod
+    def de_texto(cls, texto):
+        try:
+            momento, movimento_id = (texto or '').rsplit('_', 1)
+            return cls(datetime.fromisoformat(momento), int(movimento_id))
+        except ValueError:
+            return None
+
+    @classmethod
+    def da_linha(cls, linha):
+        return cls(linha['momento'], linha['id'])
+
+    def __str__(self):
+        return f"{self.momento.isoformat()}_{self.movimento_id}"
+
+
+def movimentos(tipo='', inicio=None, fim=None):
+    """Linhas do diário dos dias [inicio, fim], só entradas ou saídas se `tipo`."""
+    qs = Movimento.objects.all()
+    if inicio:
+        qs = qs.filter(momento__gte=datetime.combine(inicio, time.min))
+    if fim:
+        qs = qs.filter(momento__lt=datetime.combine(fim + timedelta(days=1), time.min))
+    if tipo == 'entrada':
+        qs = qs.filter(origem__in=diario.ENTRADAS)
+    elif tipo == 'saida':
+        qs = qs.filter(origem__in=diario.SAIDAS)
+    return qs
+
+
+def pagina(tipo='', inicio=None, fim=None, depois=None, antes=None, por_pagina=POR_PAGINA):
+    """Uma página do extrato de caixa, mais recente primeiro.
+
+    Lê só o diário (Movimento) pelo índice (momento, id), com paginação por
+    cursor (keyset): `depois` dá a página seguinte à linha indicada e `antes`
+    a anterior. O custo de uma página não depende do número de movimentos.
+    Devolve (linhas, cursor_anterior, cursor_seguinte); os cursores são None
+    quando não há mais páginas nesse sentido. Cada linha traz o 'saldo'
+    depois do movimento (diario.com_saldos).
+    """
+    cursor = antes or depois
+    ascendente = antes is not None
+    qs = movimentos(tipo, inicio, fim)
+    if cursor:
+        if ascendente:
+            qs = qs.filter(Q(momento__gt=cursor.momento) | Q(momento=cursor.momento, id__gt=cursor.movimento_id))
+        else:
+            qs = qs.filter(Q(momento__lt=cursor.momento) | Q(momento=cursor.momento, id__lt=cursor.movimento_id))
+    ordem = ['momento', 'id'] if ascendente else ['-momento', '-id']
+    linhas = list(qs.order_by(*ordem).values(*CAMPOS)[:por_pagina + 1])
+    mais = len(linhas) > por_pagina
+    linhas = linhas[:por_pagina]
+    if ascendente:
+        linhas.reverse()
+    if not linhas:
+        return [], None, None
+    diario.com_saldos(linhas)
+
+    tem_anteriores = mais if ascendente else cursor is not None
+    tem_seguintes = cursor is not None if ascendente else mais
+    return (
+        linhas,
+        Cursor.da_linha(linhas[0]) if tem_anteriores else None,
+        Cursor.da_linha(linhas[-1]) if tem_seguintes else None,
+    )
+
+
+def totais(tipo='', inicio=None, fim=None):
+    """Totais de entradas e saídas do período, lidos do ResumoDiario."""
+    filtros = {}
+    if inicio:
+        filtros['data__gte'] = inicio
+    if fim:
+        filtros['data__lte'] = fim
+    t = resumos.totais(**filtros)
+    entradas = t['entradas'] if tipo in ('', 'entrada') else 0
+    saidas = t['saidas'] if tipo in ('', 'saida') else 0
+    return entradas, saidas
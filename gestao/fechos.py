@@ -0,0 +1,123 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.contrib.admin.utils import NestedObjects
+from django.db import router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Compra, FechoMes, ItemCompra, ItemVenda, Produto, ResumoDiario, Venda
+from . import resumos
+
+
+class PeriodoFechado(ValidationError):
+    """Alteração que mudaria os valores de um mês já fechado."""
+
+
+def primeiro_dia(dia):
+    return resumos.dia_de(dia).replace(day=1)
+
+
+def mes_seguinte(mes):
+    return date(mes.year + (mes.month == 12), mes.month % 12 + 1, 1)
+
+
+def ultimo_fecho():
+    """Mês (dia 1) do último fecho, ou None. Os meses fecham-se por ordem,
+    por isso qualquer mês até este está fechado."""
+    return FechoMes.objects.order_by('-mes').values_list('mes', flat=True).first()
+
+
+def verificar_aberto(*datas):
+    """Lança PeriodoFechado se alguma das datas (date ou datetime) for de um mês fechado."""
+    datas = [d for d in datas if d is not None]
+    if not datas:
+        return
+    fecho = ultimo_fecho()
+    for d in datas:
+        if fecho and primeiro_dia(d) <= fecho:
+            raise PeriodoFechado(
+                f"O mês {primeiro_dia(d):%m/%Y} está fechado: vendas, compras, despesas e receitas desse mês não podem ser alteradas."
+            )
+
+
+def registos_fechados(objs):
+    """Registos de meses fechados que apagar `objs` removeria, também em
+    cascata (ex.: as linhas de venda de um produto). Lista de textos, vazia
+    se a remoção é possível."""
+    fecho = ultimo_fecho()
+    objs = list(objs)
+    if not fecho or not objs:
+        return []
+    limite = mes_seguinte(fecho)
+    recolha = NestedObjects(using=router.db_for_write(type(objs[0])))
+    recolha.collect(objs)
+    registos, pais = set(), {Venda: set(), Compra: set()}
+    for modelo, instancias in recolha.data.items():
+        for obj in instancias:
+            if modelo is ItemVenda:
+                pais[Venda].add(obj.venda_id)
+            elif modelo is ItemCompra:
+                pais[Compra].add(obj.compra_id)
+            elif modelo in resumos.ORIGENS and resumos.dia_do_registo(obj) < limite:
+                registos.add(obj)
+    for modelo, ids in pais.items():
+        if ids:
+            registos.update(modelo.objects.filter(id__in=ids, data__lt=datetime.combine(limite, time.min)))
+    return [f"{r} — mês {primeiro_dia(resumos.dia_do_registo(r)):%m/%Y} fechado" for r in registos]
+
+
+def _top_produtos(mes):
+    inicio = datetime.combine(mes, time.min)
+    linhas = (
+        ItemVenda.objects.filter(venda__data__gte=inicio, venda__data__lt=datetime.combine(mes_seguinte(mes), time.min))
+        .values('produto__nome', 'produto__marca')
+        .annotate(unidades=Sum('quantidade'), receita=Sum(F('quantidade') * F('preco_unitario')))
+        .order_by('-receita')[:10]
+    )
+    return [
+        {'nome': l['produto__nome'], 'marca': l['produto__marca'], 'quantidade': l['unidades'], 'receita': str(Decimal(l['receita']).quantize(Decimal('0.01')))}
+        for l in linhas
+    ]
+
+
+def proximo_a_fechar():
+    """Próximo mês que pode ser fechado (o seguinte ao último fecho, ou o
+    primeiro com movimentos), ou None se for já o mês corrente."""
+    fecho = ultimo_fecho()
+    if fecho:
+        mes = mes_seguinte(fecho)
+    else:
+        primeiro = ResumoDiario.objects.order_by('data').values_list('data', flat=True).first()
+        if primeiro is None:
+            return None
+        mes = primeiro_dia(primeiro)
+    return mes if mes < primeiro_dia(timezone.now().date()) else None
+
+
+def fechar_mes(mes, utilizador=None):
+    """Fecha o mês de `mes` e grava a sua fotografia (FechoMes): os totais do
+    mês, os produtos mais vendidos e o valor do stock no momento em que o
+    fecho é feito.
+
+    Só se fecha um mês já terminado e pela ordem dos meses, para que
+    "fechado" seja sempre "até ao último fecho". Lança ValidationError se o
+    mês não puder ser fechado.
+    """
+    mes = primeiro_dia(mes)
+    with transaction.atomic():
+        # Bloqueia o último fecho para dois fechos em simultâneo não saltarem um mês
+        fecho = FechoMes.objects.select_for_update().order_by('-mes').values_list('mes', flat=True).first()
+        if fecho and mes <= fecho:
+            raise ValidationError(f"O mês {mes:%m/%Y} já está fechado.")
+        if mes != proximo_a_fechar():
+            raise ValidationError(f"O mês {mes:%m/%Y} não pode ser fechado: feche os meses por ordem e só depois de terminarem.")
+        totais = resumos.totais(data__gte=mes, data__lt=mes_seguinte(mes))
+        inventario = Produto.objects.aggregate(t=Sum(F('stock_actual') * F('preco_custo')))['t'] or Decimal('0')
+        return FechoMes.objects.create(
+            mes=mes,
+            vendas=totais['vendas'], receitas_extra=totais['receitas_extra'],
+            compras=totais['compras'], despesas=totais['despesas'],
+            inventario_no_fecho=inventario,
+            top_produtos=_top_produtos(mes),
+            fechado_por=utilizador,
+        )
@@ -0,0 +1,294 @@
+import csv
+import io
+import unicodedata
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .models import Categoria, Produto, Compra
+from . import compras, catalogo
+
+# Máximo de erros devolvidos ao utilizador (a contagem total é sempre dada)
+MAX_ERROS = 200
+
+# Nomes de coluna aceites -> campo
+COLUNAS_COMPRA = {
+    'nome': 'nome', 'produto': 'nome',
+    'marca': 'marca',
+    'quantidade': 'quantidade', 'qtd': 'quantidade',
+    'preco_custo': 'preco_custo', 'custo': 'preco_custo', 'preco': 'preco_custo',
+    'validade': 'validade',
+    'lote': 'lote',
+}
+
+COLUNAS_PRODUTO = {
+    'nome': 'nome', 'produto': 'nome',
+    'marca': 'marca',
+    'categoria': 'categoria',
+    'preco_venda': 'preco_venda', 'preco': 'preco_venda', 'pvp': 'preco_venda',
+    'stock_minimo': 'stock_minimo', 'minimo': 'stock_minimo',
+}
+
+
+class ImportacaoInvalida(Exception):
+    """O ficheiro não pôde ser importado.
+
+    `erros` é uma lista de dicts {'linha', 'mensagem'} (no máximo MAX_ERROS) e
+    `total_erros` o número total de linhas com erro.
+    """
+    def __init__(self, erros, total_erros=None):
+        super().__init__(f"{total_erros or len(erros)} erro(s) no ficheiro.")
+        self.erros = erros
+        self.total_erros = total_erros or len(erros)
+
+
+def _normalizar(texto):
+    # "Preço Custo" -> "preco_custo"
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return '_'.join(texto.strip().lower().split())
+
+
+def _linhas_csv(ficheiro):
+    # UploadedFile: o TextIOWrapper precisa do ficheiro binário subjacente
+    texto = io.TextIOWrapper(getattr(ficheiro, 'file', ficheiro), encoding='utf-8-sig', newline='')
+    amostra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialecto = csv.Sniffer().sniff(amostra, delimiters=';,\t')
+    except csv.Error:
+        dialecto = csv.excel
+    try:
+        yield from csv.reader(texto, dialecto)
+    finally:
+        # Não fechar o ficheiro enviado junto com o wrapper
+        texto.detach()
+
+
+def _linhas_xlsx(ficheiro):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportacaoInvalida([{'linha': 0, 'mensagem': "O suporte a Excel (openpyxl) não está instalado. Exporta o ficheiro em CSV."}])
+    # read_only lê a folha em streaming, sem a carregar toda para memória
+    livro = openpyxl.load_workbook(ficheiro, read_only=True, data_only=True)
+    try:
+        yield from livro.active.iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+
+def ler_ficheiro(ficheiro, colunas):
+    """Lê um CSV ou XLSX linha a linha: gera (número da linha, {campo: valor}).
+
+    A primeira linha tem os nomes das colunas; `colunas` mapeia os nomes
+    aceites (normalizados) para os campos. Linhas vazias são ignoradas.
+    """
+    ficheiro.seek(0)
+    nome = (getattr(ficheiro, 'name', '') or '').lower()
+    linhas = _linhas_xlsx(ficheiro) if nome.endswith('.xlsx') else _linhas_csv(ficheiro)
+    cabecalho = None
+    for n, valores in enumerate(linhas, start=1):
+        if cabecalho is None:
+            cabecalho = [colunas.get(_normalizar(v)) for v in valores]
+            if not any(cabecalho):
+                raise ImportacaoInvalida([{'linha': 1, 'mensagem': "Cabeçalho não reconhecido."}])
+            continue
+        if not any(v not in (None, '') for v in valores):
+            continue
+        yield n, {campo: valor for campo, valor in zip(cabecalho, valores) if campo}
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def _numero(valor):
+    # Aceita 1234,50 (vírgula decimal) além de 1234.50
+    texto = _texto(valor)
+    if ',' in texto and '.' not in texto:
+        texto = texto.replace(',', '.')
+    return texto
+
+
+def _data(valor):
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    texto = _texto(valor)
+    if len(texto) == 10 and texto[2] == '/' and texto[5] == '/':
+        # DD/MM/AAAA
+        return f"{texto[6:]}-{texto[3:5]}-{texto[:2]}"
+    return texto
+
+
+def indice_produtos():
+    """{(nome, marca) em minúsculas: id} de todo o catálogo, numa query."""
+    return {
+        (nome.strip().lower(), marca.strip().lower()): produto_id
+        for produto_id, nome, marca in Produto.objects.values_list('id', 'nome', 'marca')
+    }
+
+
+def _linhas_compra(ficheiro, indice, produtos):
+    # Gera (número da linha, ItemCompra por gravar ou None, erro ou None)
+    for n, linha in ler_ficheiro(ficheiro, COLUNAS_COMPRA):
+        chave = (_texto(linha.get('nome')).lower(), _texto(linha.get('marca')).lower())
+        produto_id = indice.get(chave)
+        if produto_id is None:
+            yield n, None, f"Produto '{_texto(linha.get('nome'))}' ({_texto(linha.get('marca'))}) não existe."
+            continue
+        item, erro = compras.validar_linha({
+            'id': produto_id,
+            'quantidade': _numero(linha.get('quantidade')),
+            'preco_custo': _numero(linha.get('preco_custo')),
+            'validade': _data(linha.get('validade')),
+            'lote': _texto(linha.get('lote')),
+        }, produtos)
+        yield n, item, erro
+
+
+def importar_compra(fornecedor, ficheiro):
+    """Importa uma factura de fornecedor (CSV/XLSX) para uma nova Compra.
+
+    O ficheiro é lido duas vezes em streaming: a primeira passagem valida
+    todas as linhas e junta os erros (nada é gravado se houver algum); a
+    segunda insere as linhas em lotes de compras.TAMANHO_LOTE, com o mesmo
+    custo médio ponderado das compras manuais. A memória usada depende do
+    catálogo e do tamanho do lote, não do número de linhas do ficheiro.
+    """
+    indice = indice_produtos()
+    produtos = set(indice.values())
+
+    erros, total_erros, total_linhas = [], 0, 0
+    for n, item, erro in _linhas_compra(ficheiro, indice, produtos):
+        total_linhas += 1
+        if erro:
+            total_erros += 1
+            if len(erros) < MAX_ERROS:
+                erros.append({'linha': n, 'mensagem': erro})
+    if not total_linhas:
+        raise ImportacaoInvalida([{'linha': 0, 'mensagem': "O ficheiro não tem linhas."}])
+    if total_erros:
+        raise ImportacaoInvalida(erros, total_erros)
+
+    with transaction.atomic():
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        lote = []
+        for n, item, erro in _linhas_compra(ficheiro, indice, produtos):
+            if erro:
+                # O catálogo mudou entre as duas passagens
+                raise ImportacaoInvalida([{'linha': n, 'mensagem': erro}])
+            lote.append(item)
+            if len(lote) >= compras.TAMANHO_LOTE:
+                compras.inserir_itens(compra, lote)
+                lote = []
+        if lote:
+            compras.inserir_itens(compra, lote)
+        compras.fechar_compra(compra)
+    compra.num_linhas = total_linhas
+    return compra
+
+
+def _validar_produto(linha):
+    # Devolve (chave, valores, None) ou (None, None, erro)
+    nome, marca = _texto(linha.get('nome')), _texto(linha.get('marca'))
+    nome_categoria = _texto(linha.get('categoria'))
+    if not nome or not marca:
+        return None, None, "O nome e a marca são obrigatórios."
+    if len(nome) > 200 or len(marca) > 100:
+        return None, None, "Nome (200) ou marca (100) demasiado longos."
+    try:
+        preco_venda = Decimal(_numero(linha.get('preco_venda')))
+        stock_minimo = int(_numero(linha.get('stock_minimo')) or 5)
+    except (InvalidOperation, ValueError):
+        return None, None, "Preço de venda ou stock mínimo inválidos."
+    if not preco_venda.is_finite() or preco_venda <= 0 or preco_venda >= Decimal('1e8'):
+        return None, None, "O preço de venda tem de ser positivo (máx. 99 999 999,99)."
+    if stock_minimo < 0:
+        return None, None, "O stock mínimo não pode ser negativo."
+    if not nome_categoria or len(nome_categoria) > 100:
+        return None, None, "A categoria é obrigatória (máx. 100 caracteres)."
+    return (nome.lower(), marca.lower()), {
+        'nome': nome, 'marca': marca, 'categoria': nome_categoria,
+        'preco_venda': preco_venda.quantize(Decimal('0.01')), 'stock_minimo': stock_minimo,
+    }, None
+
+
+def _gravar_produtos(novos, alterados):
+    # Escritas em lote: bulk_create/bulk_update não chamam Produto.save() (a
+    # validação já foi feita) nem o post_save, daí o registo no catálogo
+    if novos:
+        Produto.objects.bulk_create(novos, batch_size=compras.TAMANHO_LOTE)
+        if any(p.pk is None for p in novos):
+            # MySQL não devolve os ids de um INSERT em lote
+            nomes = {p.nome for p in novos}
+            chaves = {(p.nome.lower(), p.marca.lower()) for p in novos}
+            ids = [pid for pid, nome, marca in Produto.objects.filter(nome__in=nomes).values_list('id', 'nome', 'marca')
+                   if (nome.lower(), marca.lower()) in chaves]
+        else:
+            ids = [p.pk for p in novos]
+        catalogo.registar_alteracoes(ids)
+    if alterados:
+        Produto.objects.bulk_update(alterados, ['nome', 'marca', 'categoria', 'preco_venda', 'stock_minimo'],
+                                    batch_size=compras.TAMANHO_LOTE)
+        catalogo.registar_alteracoes([p.pk for p in alterados])
+
+
+def importar_produtos(ficheiro):
+    """Cria ou actualiza produtos a partir de uma tabela de preços (CSV/XLSX).
+
+    A chave é (nome, marca), sem distinguir maiúsculas, como no add_produto.
+    Cada linha é validada em memória com as regras do formulário e do
+    Produto.clean (preço de venda >= custo actual); as linhas com erro são
+    listadas e as restantes gravadas em lotes de INSERT/UPDATE. As categorias
+    são resolvidas uma vez por ficheiro (e criadas se ainda não existirem).
+    Devolve {'criados', 'actualizados', 'erros', 'total_erros'}.
+    """
+    existentes = {
+        (nome.lower(), marca.lower()): (produto_id, preco_custo)
+        for produto_id, nome, marca, preco_custo in Produto.objects.values_list('id', 'nome', 'marca', 'preco_custo')
+    }
+    categorias = {nome.lower(): categoria_id for categoria_id, nome in Categoria.objects.values_list('id', 'nome')}
+    vistas = {}
+    resultado = {'criados': 0, 'actualizados': 0, 'erros': [], 'total_erros': 0}
+
+    def erro(n, mensagem):
+        resultado['total_erros'] += 1
+        if len(resultado['erros']) < MAX_ERROS:
+            resultado['erros'].append({'linha': n, 'mensagem': mensagem})
+
+    with transaction.atomic():
+        novos, alterados = [], []
+        for n, linha in ler_ficheiro(ficheiro, COLUNAS_PRODUTO):
+            chave, valores, mensagem = _validar_produto(linha)
+            if mensagem:
+                erro(n, mensagem)
+                continue
+            if chave in vistas:
+                erro(n, f"Produto repetido no ficheiro (já na linha {vistas[chave]}).")
+                continue
+            produto_id, preco_custo = existentes.get(chave, (None, Decimal('0')))
+            if preco_custo > 0 and valores['preco_venda'] < preco_custo:
+                erro(n, f"O preço de venda não pode ser menor que o custo ({preco_custo} Kz)!")
+                continue
+            vistas[chave] = n
+
+            nome_categoria = valores.pop('categoria')
+            if nome_categoria.lower() not in categorias:
+                categoria, _ = Categoria.objects.get_or_create(nome=nome_categoria)
+                categorias[nome_categoria.lower()] = categoria.id
+            valores['categoria_id'] = categorias[nome_categoria.lower()]
+
+            if produto_id is None:
+                novos.append(Produto(**valores))
+            else:
+                alterados.append(Produto(id=produto_id, **valores))
+            if len(novos) + len(alterados) >= compras.TAMANHO_LOTE:
+                resultado['criados'] += len(novos)
+                resultado['actualizados'] += len(alterados)
+                _gravar_produtos(novos, alterados)
+                novos, alterados = [], []
+        resultado['criados'] += len(novos)
+        resultado['actualizados'] += len(alterados)
+        _gravar_produtos(novos, alterados)
+    return resultado
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .models import AlertaValidade, LoteStock
+from .utils import valor_por_id
+
+
+def abrir_lotes(itens_compra):
+    """Cria o saldo de lote de cada ItemCompra recebido (já gravado, com id)."""
+    LoteStock.objects.bulk_create([
+        LoteStock(
+            item_compra_id=item.id, produto_id=item.produto_id,
+            validade=item.validade, lote=item.lote, quantidade=item.quantidade,
+        )
+        for item in itens_compra if item.quantidade > 0
+    ])
+
+
+def alocar_fefo(pedidos):
+    """Motor FEFO: desconta {produto_id: quantidade} dos lotes abertos, primeiro
+    os que vencem mais cedo, para todos os produtos de uma só vez.
+
+    Uma query lê (e bloqueia) os lotes abertos pelo índice (produto, validade);
+    os lotes esgotados são apagados num DELETE e os restantes actualizados num
+    UPDATE. Devolve a lista de alocações [(item_compra_id, produto_id, quantidade)].
+    """
+    pedidos = {pid: qtd for pid, qtd in pedidos.items() if qtd > 0}
+    if not pedidos:
+        return []
+    lotes = (
+        LoteStock.objects.select_for_update()
+        .filter(produto_id__in=pedidos)
+        .order_by('produto_id', 'validade', 'id')
+        .values_list('id', 'item_compra_id', 'produto_id', 'quantidade')
+    )
+    por_baixar = dict(pedidos)
+    alocacoes, esgotados, parciais = [], [], {}
+    for lote_id, item_compra_id, produto_id, quantidade in lotes:
+        falta = por_baixar[produto_id]
+        if falta <= 0:
+            continue
+        retirado = min(quantidade, falta)
+        alocacoes.append((item_compra_id, produto_id, retirado))
+        por_baixar[produto_id] = falta - retirado
+        if retirado == quantidade:
+            esgotados.append(lote_id)
+        else:
+            parciais[lote_id] = quantidade - retirado
+    if esgotados:
+        LoteStock.objects.filter(id__in=esgotados).delete()
+    if parciais:
+        LoteStock.objects.filter(id__in=parciais).update(
+            quantidade=valor_por_id(parciais, models.IntegerField())
+        )
+    return alocacoes
+
+
+# --- VIGILÂNCIA DE VALIDADES ---
+
+# Dias até ao vencimento de cada faixa (a faixa 'V' é o que já venceu)
+FAIXAS_DIAS = {'30': 30, '60': 60}
+
+
+def faixa_validade(validade, hoje):
+    """'V', '30' ou '60' conforme a validade; None se vence depois de 60 dias."""
+    if validade < hoje:
+        return 'V'
+    for faixa, dias in FAIXAS_DIAS.items():
+        if validade <= hoje + timedelta(days=dias):
+            return faixa
+    return None
+
+
+def varrer_validades(hoje=None):
+    """Reclassifica os lotes abertos a vencer e substitui a lista de alertas.
+
+    Uma query lê os lotes até 60 dias pelo índice da validade; a lista é
+    reescrita numa transacção (DELETE + INSERT em lote). Corre uma vez por
+    dia (comando vigiar_validades). Devolve {faixa: número de lotes}.
+    """
+    agora = timezone.now()
+    hoje = hoje or agora.date()
+    limite = hoje + timedelta(days=max(FAIXAS_DIAS.values()))
+    alertas = [
+        AlertaValidade(lote_id=lote_id, produto_id=produto_id, validade=validade,
+                       faixa=faixa_validade(validade, hoje), calculado_em=agora)
+        for lote_id, produto_id, validade in
+        LoteStock.objects.filter(validade__lte=limite).values_list('id', 'produto_id', 'validade')
+    ]
+    with transaction.atomic():
+        AlertaValidade.objects.all().delete()
+        AlertaValidade.objects.bulk_create(alertas, batch_size=500)
+    contagem = {faixa: 0 for faixa, _ in AlertaValidade.FAIXAS}
+    for alerta in alertas:
+        contagem[alerta.faixa] += 1
+    return contagem
+
+
+def com_proxima_validade(produtos):
+    """Anota em cada produto a `proxima_validade` do lote aberto que vence
+    primeiro; fica None só quando o produto não tem lotes com stock.
+
+    Uma subquery por produto pelo índice (produto, validade): lê o primeiro
+    lote e pára, sem GROUP BY sobre todos os lotes.
+    """
+    proximo = (
+        LoteStock.objects.filter(produto=OuterRef('pk'), quantidade__gt=0)
+        .order_by('validade').values('validade')[:1]
+    )
+    return produtos.annotate(proxima_validade=Subquery(proximo))
+
@@ -0,0 +1,141 @@
+import threading
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction, DatabaseError
+from gestao import vendas, compras
+from gestao.models import Categoria, Fornecedor, Produto, Compra, ItemCompra, Venda, ItemVenda, LoteStock
+
+
+class Command(BaseCommand):
+    help = ("Simula muitos compradores em paralelo do mesmo produto e compara a baixa de stock com "
+            "bloqueio (SELECT ... FOR UPDATE) com o UPDATE condicional. Em paralelo correm compras do "
+            "mesmo produto e vendas pelo admin de outro, que escrevem nas mesmas tabelas globais: um "
+            "deadlock entre os caminhos aparece em 'erros BD'. Cria e apaga os seus próprios dados "
+            "(e escreve mesmo na base de dados): usar numa base de testes, não em produção.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compradores', type=int, default=20, help="Threads em paralelo.")
+        parser.add_argument('--vendas', type=int, default=10, help="Vendas de 1 unidade por comprador.")
+        parser.add_argument('--stock', type=int, default=None,
+                            help="Stock inicial (por omissão metade das vendas, para haver recusas).")
+        parser.add_argument('--mistura', type=int, default=2,
+                            help="Threads de compras e de vendas pelo admin ao mesmo tempo (0 = só compradores).")
+
+    def _preparar(self, stock, stock_outro):
+        categoria = Categoria.objects.create(nome="__benchmark__")
+        fornecedor = Fornecedor.objects.create(nome="__benchmark__")
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        produto = Produto.objects.create(nome="Produto em promoção", marca="__benchmark__",
+                                         categoria=categoria, preco_venda=Decimal('1000'))
+        outro = Produto.objects.create(nome="Produto ao balcão", marca="__benchmark__",
+                                       categoria=categoria, preco_venda=Decimal('1000'))
+        ItemCompra.objects.create(compra=compra, produto=produto, quantidade=stock,
+                                  preco_custo=Decimal('500'), validade='2030-01-01')
+        ItemCompra.objects.create(compra=compra, produto=outro, quantidade=stock_outro,
+                                  preco_custo=Decimal('500'), validade='2030-01-01')
+        return categoria, fornecedor, compra, produto, outro
+
+    def _correr(self, produto, outro, fornecedor, utilizador, condicional, compradores, n_vendas, mistura):
+        contagem = {'ok': 0, 'recusadas': 0, 'erros_bd': 0, 'repostas': 0, 'balcao': 0}
+        trinco = threading.Lock()
+        venda_ids, compra_ids = [], []
+
+        def contar(resultado, venda=None, compra=None):
+            with trinco:
+                contagem[resultado] += 1
+                if venda is not None:
+                    venda_ids.append(venda.id)
+                if compra is not None:
+                    compra_ids.append(compra.id)
+
+        def comprador():
+            try:
+                for _ in range(n_vendas):
+                    try:
+                        venda = vendas.finalizar_venda(utilizador, 'DIN', [{'id': produto.id, 'quantidade': 1}],
+                                                       condicional=condicional)
+                        contar('ok', venda=venda)
+                    except vendas.StockInsuficiente:
+                        contar('recusadas')
+                    except DatabaseError:
+                        # deadlock / lock wait timeout
+                        contar('erros_bd')
+            finally:
+                connections.close_all()
+
+        def reposicao():
+            # Entrada de stock do produto em promoção (produto, lotes, estatísticas, catálogo, diário)
+            try:
+                for _ in range(n_vendas):
+                    try:
+                        compra = compras.registar_compra(fornecedor, [
+                            {'id': produto.id, 'quantidade': 1, 'preco_custo': '500', 'validade': '2030-01-01'},
+                        ])
+                        contar('repostas', compra=compra)
+                    except DatabaseError:
+                        contar('erros_bd')
+            finally:
+                connections.close_all()
+
+        def balcao():
+            # Venda pelo admin: linha a linha, pelos signals de ItemVenda
+            try:
+                for _ in range(n_vendas):
+                    try:
+                        with transaction.atomic():
+                            venda = Venda.objects.create(utilizador=utilizador, metodo_pagamento='DIN')
+                            ItemVenda.objects.create(venda=venda, produto=outro, quantidade=1, preco_unitario=outro.preco_venda)
+                        contar('balcao', venda=venda)
+                    except DatabaseError:
+                        contar('erros_bd')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=comprador) for _ in range(compradores)]
+        threads += [threading.Thread(target=alvo) for _ in range(mistura) for alvo in (reposicao, balcao)]
+        inicio = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return contagem, time.perf_counter() - inicio, venda_ids, compra_ids
+
+    def handle(self, *args, **options):
+        if not connection.features.has_select_for_update or connection.vendor == 'sqlite':
+            raise CommandError("Este benchmark precisa de uma base de dados com escrita concorrente (MySQL/PostgreSQL).")
+        compradores, n_vendas, mistura = options['compradores'], options['vendas'], options['mistura']
+        stock = options['stock'] if options['stock'] is not None else compradores * n_vendas // 2
+
+        utilizador = User.objects.create_user(username="__benchmark__")
+        self.stdout.write(f"{compradores} compradores x {n_vendas} vendas, stock inicial {stock}, "
+                          f"{mistura} thread(s) de compras e {mistura} de vendas pelo admin")
+        self.stdout.write(f"{'modo':>12} {'ok':>6} {'recusadas':>10} {'erros BD':>9} {'vendas/s':>9} "
+                          f"{'compras':>8} {'balcão':>7} {'stock':>6} {'lotes':>6}")
+        try:
+            for modo, condicional in (('bloqueio', False), ('condicional', True)):
+                categoria, fornecedor, compra, produto, outro = self._preparar(stock, mistura * n_vendas)
+                contagem, duracao, venda_ids, compra_ids = self._correr(
+                    produto, outro, fornecedor, utilizador, condicional, compradores, n_vendas, mistura,
+                )
+                produto.refresh_from_db()
+                em_lotes = sum(LoteStock.objects.filter(produto=produto).values_list('quantidade', flat=True))
+                total = contagem['ok'] + contagem['recusadas'] + contagem['erros_bd']
+                self.stdout.write(
+                    f"{modo:>12} {contagem['ok']:>6} {contagem['recusadas']:>10} {contagem['erros_bd']:>9} "
+                    f"{total / duracao:>9.1f} {contagem['repostas']:>8} {contagem['balcao']:>7} "
+                    f"{produto.stock_actual:>6} {em_lotes:>6}"
+                )
+                esperado = stock + contagem['repostas'] - contagem['ok']
+                if produto.stock_actual != esperado or em_lotes != produto.stock_actual:
+                    self.stderr.write(self.style.ERROR(f"Stock inconsistente no modo {modo}!"))
+                Venda.objects.filter(id__in=venda_ids).delete()
+                Compra.objects.filter(id__in=compra_ids).delete()
+                produto.delete()
+                outro.delete()
+                compra.delete()
+                fornecedor.delete()
+                categoria.delete()
+        finally:
+            utilizador.delete()
@@ -0,0 +1,56 @@
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from gestao import vendas
+from gestao.models import Categoria, Fornecedor, Produto, Compra, ItemCompra, Venda, ItemVenda
+
+
+class Command(BaseCommand):
+    help = ("Compara as idas à base de dados (queries) do checkout em lote com o registo linha a linha "
+            "para carrinhos de N linhas. Os dados de teste são criados numa transacção revertida no fim.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, nargs='+', default=[1, 10, 30])
+
+    def _preparar(self, n):
+        categoria = Categoria.objects.create(nome="__benchmark__")
+        fornecedor = Fornecedor.objects.create(nome="__benchmark__")
+        utilizador = User.objects.create_user(username="__benchmark__")
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        produtos = []
+        for i in range(n):
+            p = Produto.objects.create(nome=f"Produto {i}", marca="__benchmark__", categoria=categoria, preco_venda=Decimal('1000'))
+            # Dois lotes por produto para o FEFO ter de atravessar lotes
+            for validade in ('2030-01-01', '2031-01-01'):
+                ItemCompra.objects.create(compra=compra, produto=p, quantidade=5, preco_custo=Decimal('500'), validade=validade)
+            produtos.append(p)
+        return utilizador, [{'id': p.id, 'quantidade': 7} for p in produtos]
+
+    def _legado(self, utilizador, carrinho):
+        # Fluxo anterior: um SELECT ... FOR UPDATE e um ItemVenda.create (com signals) por linha
+        linhas = [(Produto.objects.select_for_update().get(id=i['id']), i['quantidade']) for i in carrinho]
+        venda = Venda.objects.create(utilizador=utilizador, metodo_pagamento='DIN')
+        for prod, qtd in linhas:
+            ItemVenda.objects.create(venda=venda, produto=prod, quantidade=qtd, preco_unitario=prod.preco_venda)
+
+    def _medir(self, funcao, *args):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                funcao(*args)
+                duracao = time.perf_counter() - inicio
+            transaction.set_rollback(True)
+        return len(ctx.captured_queries), duracao
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'linhas':>6} {'queries lote':>13} {'queries legado':>15} {'ms lote':>9} {'ms legado':>10}")
+        for n in options['linhas']:
+            with transaction.atomic():
+                utilizador, carrinho = self._preparar(n)
+                q_lote, t_lote = self._medir(vendas.finalizar_venda, utilizador, 'DIN', carrinho)
+                q_legado, t_legado = self._medir(self._legado, utilizador, carrinho)
+                transaction.set_rollback(True)
+            self.stdout.write(f"{n:>6} {q_lote:>13} {q_legado:>15} {t_lote * 1000:>9.1f} {t_legado * 1000:>10.1f}")
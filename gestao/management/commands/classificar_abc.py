@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from gestao import classificacao
+
+
+class Command(BaseCommand):
+    help = ("Classifica todos os produtos em A/B/C (Pareto da receita) e X/Y/Z (regularidade das vendas) "
+            "na janela móvel e guarda o resultado na EstatisticaProduto. Agendar uma vez por dia (cron).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=classificacao.JANELA_DIAS,
+                            help="Dias da janela móvel (por omissão %(default)s).")
+
+    def handle(self, *args, **options):
+        if options['dias'] < 7:
+            raise CommandError("A janela tem de ter pelo menos 7 dias.")
+        contagem = classificacao.classificar(options['dias'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Produtos classificados ({options['dias']} dias): A={contagem['A']} B={contagem['B']} C={contagem['C']}"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from gestao import previsao
+
+
+class Command(BaseCommand):
+    help = ("Recalcula a previsão de procura, o stock de segurança, o ponto de encomenda e a quantidade "
+            "sugerida por fornecedor de todos os produtos. Agendar uma vez por dia (cron).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=previsao.JANELA_DIAS,
+                            help="Dias de histórico (por omissão %(default)s).")
+        parser.add_argument('--metodo', choices=previsao.METODOS, default='exponencial',
+                            help="Suavização exponencial ou média móvel (por omissão %(default)s).")
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1:
+            raise CommandError("A janela tem de ter pelo menos 1 dia.")
+        sugeridos = previsao.prever(options['dias'], options['metodo'])
+        self.stdout.write(self.style.SUCCESS(f"Previsão recalculada: {sugeridos} produtos a encomendar."))
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from gestao import exportacoes
+
+
+class Command(BaseCommand):
+    help = ("Worker da fila de exportações PDF/Word: gera as tarefas pendentes pela ordem de chegada. "
+            "Corre como processo próprio (linha worker do Procfile).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=2,
+                            help="Segundos de espera quando a fila está vazia (por omissão %(default)s).")
+        parser.add_argument('--uma-vez', action='store_true',
+                            help="Esvazia a fila e termina, em vez de ficar à espera de novas tarefas.")
+
+    def handle(self, *args, **options):
+        exportacoes.limpar()
+        while True:
+            # Processo longo: não reutilizar ligações fechadas pelo servidor
+            close_old_connections()
+            tarefa = exportacoes.reservar()
+            if tarefa is None:
+                if options['uma_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+            if exportacoes.executar(tarefa):
+                self.stdout.write(f"Exportação #{tarefa.id} ({tarefa.documento}, {tarefa.formato}) concluída.")
+            else:
+                self.stderr.write(f"Exportação #{tarefa.id} ({tarefa.documento}, {tarefa.formato}) falhou.")
+            exportacoes.limpar()
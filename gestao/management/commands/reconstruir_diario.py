@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from gestao import diario
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o diário de caixa (Movimento) a partir de Vendas, Receitas Extra, Compras e Despesas e verifica-o."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help="Só compara o diário com as tabelas de origem, sem o reconstruir.",
+        )
+        parser.add_argument('--lote', type=int, default=1000, help="Linhas por INSERT em lote.")
+
+    def handle(self, *args, **options):
+        if not options['verificar']:
+            with transaction.atomic():
+                diario._trinco()
+                linhas = diario.reconstruir(options['lote'])
+            self.stdout.write(f"Diário de caixa reconstruído: {linhas} movimentos.")
+
+        problemas = diario.verificar()
+        for problema in problemas:
+            self.stderr.write(problema)
+        if problemas:
+            raise CommandError(f"{len(problemas)} diferença(s) entre o diário e as tabelas de origem.")
+        self.stdout.write(self.style.SUCCESS("Diário de caixa coincide com as tabelas de origem."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from gestao import estatisticas, classificacao
+from gestao.models import EstatisticaProduto
+
+
+class Command(BaseCommand):
+    help = "Recalcula a EstatisticaProduto (unidades vendidas, nº de vendas, última venda/compra) de todos os produtos."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            estatisticas.reconstruir()
+            # As linhas são recriadas: repor também a classificação ABC/XYZ
+            classificacao.classificar()
+        self.stdout.write(self.style.SUCCESS(f"Estatísticas recalculadas: {EstatisticaProduto.objects.count()} produtos."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from gestao import resumos
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o ResumoDiario a partir de Vendas, Receitas Extra, Compras e Despesas e verifica-o."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help="Só compara o ResumoDiario com as tabelas de origem, sem o reconstruir.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['verificar']:
+            with transaction.atomic():
+                dias = resumos.reconstruir()
+            self.stdout.write(f"ResumoDiario reconstruído: {dias} dias.")
+
+        diferencas = resumos.verificar()
+        for dia, coluna, esperado, actual in diferencas:
+            self.stderr.write(f"{dia:%d/%m/%Y} {coluna}: esperado {esperado}, no resumo {actual}")
+        if diferencas:
+            raise CommandError(f"{len(diferencas)} diferença(s) entre o ResumoDiario e as tabelas de origem.")
+        self.stdout.write(self.style.SUCCESS("ResumoDiario coincide com as tabelas de origem."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from gestao import lotes
+
+
+class Command(BaseCommand):
+    help = ("Classifica os lotes abertos em vencidos, a vencer em 30 e em 60 dias e reescreve a lista "
+            "de alertas de validade lida pelo painel, relatórios e admin. Agendar uma vez por dia (cron).")
+
+    def handle(self, *args, **options):
+        contagem = lotes.varrer_validades()
+        self.stdout.write(self.style.SUCCESS(
+            f"Alertas de validade: {contagem['V']} vencidos, {contagem['30']} até 30 dias, {contagem['60']} até 60 dias."
+        ))
@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:07
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+
+
+def preencher_resumos(apps, schema_editor):
+    ResumoDiario = apps.get_model('gestao', 'ResumoDiario')
+    origens = [
+        ('Venda', 'valor_total', 'vendas', True),
+        ('ReceitaExtra', 'valor', 'receitas_extra', False),
+        ('Compra', 'valor_total', 'compras', True),
+        ('Despesa', 'valor', 'despesas', False),
+    ]
+    por_dia = {}
+    for nome, campo_valor, coluna, com_hora in origens:
+        modelo = apps.get_model('gestao', nome)
+        dia = TruncDate('data') if com_hora else F('data')
+        for linha in modelo.objects.annotate(dia=dia).values('dia').annotate(total=Sum(campo_valor)).order_by():
+            if linha['total']:
+                por_dia.setdefault(linha['dia'], {})[coluna] = linha['total'] or Decimal('0')
+    ResumoDiario.objects.bulk_create(
+        [ResumoDiario(data=dia, **valores) for dia, valores in sorted(por_dia.items())],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0006_alter_compra_valor_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(unique=True)),
+                ('vendas', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('receitas_extra', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('compras', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('despesas', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+            options={
+                'verbose_name_plural': '8. Resumos Diários',
+                'ordering': ['-data'],
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def preencher_estatisticas(apps, schema_editor):
+    EstatisticaProduto = apps.get_model('gestao', 'EstatisticaProduto')
+    ItemVenda = apps.get_model('gestao', 'ItemVenda')
+    ItemCompra = apps.get_model('gestao', 'ItemCompra')
+    vendas = {
+        l['produto_id']: l for l in ItemVenda.objects.values('produto_id').annotate(
+            unidades=Sum('quantidade'), linhas=Count('id'), ultima=Max('venda__data')
+        ).order_by()
+    }
+    compras = dict(ItemCompra.objects.values('produto_id').annotate(ultima=Max('compra__data')).values_list('produto_id', 'ultima').order_by())
+    EstatisticaProduto.objects.bulk_create([
+        EstatisticaProduto(
+            produto_id=pid,
+            unidades_vendidas=vendas[pid]['unidades'] if pid in vendas else 0,
+            num_vendas=vendas[pid]['linhas'] if pid in vendas else 0,
+            ultima_venda=vendas[pid]['ultima'] if pid in vendas else None,
+            ultima_compra=compras.get(pid),
+        )
+        for pid in set(vendas) | set(compras)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0007_resumodiario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaProduto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unidades_vendidas', models.IntegerField(default=0)),
+                ('num_vendas', models.IntegerField(default=0)),
+                ('ultima_venda', models.DateTimeField(blank=True, null=True)),
+                ('ultima_compra', models.DateTimeField(blank=True, null=True)),
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='estatistica', to='gestao.produto')),
+            ],
+        ),
+        migrations.RunPython(preencher_estatisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def abrir_lotes_existentes(apps, schema_editor):
+    # Até aqui o ItemCompra.quantidade era o saldo vivo do lote
+    ItemCompra = apps.get_model('gestao', 'ItemCompra')
+    LoteStock = apps.get_model('gestao', 'LoteStock')
+    LoteStock.objects.bulk_create([
+        LoteStock(item_compra_id=i.id, produto_id=i.produto_id, validade=i.validade, lote=i.lote, quantidade=i.quantidade)
+        for i in ItemCompra.objects.filter(quantidade__gt=0).iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0008_estatisticaproduto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('validade', models.DateField()),
+                ('lote', models.CharField(blank=True, max_length=50, null=True)),
+                ('quantidade', models.IntegerField()),
+                ('item_compra', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saldo_lote', to='gestao.itemcompra')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lotes', to='gestao.produto')),
+            ],
+            options={
+                'verbose_name_plural': 'Lotes em stock',
+                'indexes': [models.Index(fields=['produto', 'validade'], name='lotestock_produto_validade')],
+            },
+        ),
+        migrations.RunPython(abrir_lotes_existentes, migrations.RunPython.noop),
+    ]
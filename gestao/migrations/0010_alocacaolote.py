@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0009_lotestock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itemcompra',
+            name='lote',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.CreateModel(
+            name='AlocacaoLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField()),
+                ('item_compra', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alocacoes', to='gestao.itemcompra')),
+                ('item_venda', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alocacoes', to='gestao.itemvenda')),
+            ],
+            options={
+                'verbose_name_plural': 'Alocações de lotes',
+                'indexes': [models.Index(fields=['item_compra', 'item_venda'], name='alocacao_lote_venda'), models.Index(fields=['item_venda', 'item_compra'], name='alocacao_venda_lote')],
+            },
+        ),
+    ]
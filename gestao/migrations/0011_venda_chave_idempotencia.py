@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0010_alocacaolote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venda',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
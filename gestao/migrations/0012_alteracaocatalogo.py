@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0011_venda_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlteracaoCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produto_id', models.BigIntegerField(db_index=True)),
+                ('removido', models.BooleanField(default=False)),
+                ('data', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:40
+
+import heapq
+from datetime import datetime, time
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def preencher_diario(apps, schema_editor):
+    Movimento = apps.get_model('gestao', 'Movimento')
+    SaldoCaixa = apps.get_model('gestao', 'SaldoCaixa')
+    origens = [
+        ('Venda', 'valor_total', 'V', 1, True),
+        ('ReceitaExtra', 'valor', 'R', 1, False),
+        ('Despesa', 'valor', 'D', -1, False),
+        ('Compra', 'valor_total', 'C', -1, True),
+    ]
+
+    def registos(nome, campo_valor, origem, sinal, com_hora):
+        modelo = apps.get_model('gestao', nome)
+        campos = ['id', 'data', campo_valor] + ([] if com_hora else ['descricao'])
+        for r in modelo.objects.order_by('data', 'id').values(*campos).iterator():
+            momento = r['data'] if com_hora else datetime.combine(r['data'], time.min)
+            descricao = f"{nome} #{r['id']}" if com_hora else r['descricao']
+            yield momento, origem, r['id'], descricao, sinal * r[campo_valor]
+
+    saldo, lote = Decimal('0'), []
+    for momento, origem, origem_id, descricao, valor in heapq.merge(*[registos(*o) for o in origens]):
+        if not valor:
+            continue
+        saldo += valor
+        lote.append(Movimento(momento=momento, origem=origem, origem_id=origem_id,
+                              descricao=descricao[:255], valor=valor, saldo=saldo))
+        if len(lote) >= 1000:
+            Movimento.objects.bulk_create(lote)
+            lote = []
+    Movimento.objects.bulk_create(lote)
+    SaldoCaixa.objects.create(id=1, saldo=saldo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0012_alteracaocatalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoCaixa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Movimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('momento', models.DateTimeField()),
+                ('origem', models.CharField(choices=[('V', 'Venda'), ('R', 'Receita Extra'), ('D', 'Despesa'), ('C', 'Compra')], max_length=1)),
+                ('origem_id', models.BigIntegerField()),
+                ('descricao', models.CharField(max_length=255)),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('registado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': '9. Diário de Caixa',
+                'ordering': ['-momento', '-id'],
+                'indexes': [models.Index(fields=['momento', 'id'], name='movimento_momento'), models.Index(fields=['origem', 'origem_id'], name='movimento_origem')],
+            },
+        ),
+        migrations.RunPython(preencher_diario, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0013_movimento_saldocaixa'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechoMes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField(unique=True)),
+                ('vendas', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('receitas_extra', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('compras', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('despesas', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('valor_inventario', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('top_produtos', models.JSONField(default=list)),
+                ('fechado_em', models.DateTimeField(auto_now_add=True)),
+                ('fechado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': '10. Fechos de Mês',
+                'ordering': ['-mes'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0014_fechomes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['data'], name='compra_data'),
+        ),
+        migrations.AddIndex(
+            model_name='despesa',
+            index=models.Index(fields=['data'], name='despesa_data'),
+        ),
+        migrations.AddIndex(
+            model_name='itemcompra',
+            index=models.Index(fields=['produto', 'validade'], name='itemcompra_produto_validade'),
+        ),
+        migrations.AddIndex(
+            model_name='lotestock',
+            index=models.Index(fields=['produto', 'quantidade'], name='lotestock_produto_quantidade'),
+        ),
+        migrations.AddIndex(
+            model_name='lotestock',
+            index=models.Index(fields=['validade'], name='lotestock_validade'),
+        ),
+        migrations.AddIndex(
+            model_name='receitaextra',
+            index=models.Index(fields=['data'], name='receitaextra_data'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['data'], name='venda_data'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0015_indices_datas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estatisticaproduto',
+            name='classe_abc',
+            field=models.CharField(default='C', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='estatisticaproduto',
+            name='classe_xyz',
+            field=models.CharField(default='Z', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='estatisticaproduto',
+            name='classificado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='estatisticaproduto',
+            name='receita_janela',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=18),
+        ),
+        migrations.AddIndex(
+            model_name='estatisticaproduto',
+            index=models.Index(fields=['classe_abc'], name='estatistica_classe_abc'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0016_classificacao_abc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fornecedor',
+            name='prazo_entrega',
+            field=models.PositiveIntegerField(default=7, verbose_name='Prazo de Entrega (dias)'),
+        ),
+        migrations.CreateModel(
+            name='PrevisaoProduto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('procura_diaria', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('desvio_diario', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('stock_seguranca', models.IntegerField(default=0)),
+                ('ponto_encomenda', models.IntegerField(default=0)),
+                ('quantidade_sugerida', models.IntegerField(default=0)),
+                ('calculado_em', models.DateTimeField()),
+                ('fornecedor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gestao.fornecedor')),
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='previsao', to='gestao.produto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fornecedor', 'quantidade_sugerida'], name='previsao_fornecedor_sugestao')],
+            },
+        ),
+    ]
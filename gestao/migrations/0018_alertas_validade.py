@@ -0,0 +1,45 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:05
+
+import django.db.models.deletion
+from datetime import timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def primeira_varredura(apps, schema_editor):
+    # Mesma regra de lotes.faixa_validade, para o painel não ficar vazio até ao primeiro cron
+    LoteStock = apps.get_model('gestao', 'LoteStock')
+    AlertaValidade = apps.get_model('gestao', 'AlertaValidade')
+    agora = timezone.now()
+    hoje = agora.date()
+    alertas = []
+    for lote_id, produto_id, validade in LoteStock.objects.filter(validade__lte=hoje + timedelta(days=60)).values_list('id', 'produto_id', 'validade'):
+        faixa = 'V' if validade < hoje else '30' if validade <= hoje + timedelta(days=30) else '60'
+        alertas.append(AlertaValidade(lote_id=lote_id, produto_id=produto_id, validade=validade, faixa=faixa, calculado_em=agora))
+    AlertaValidade.objects.bulk_create(alertas, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0017_previsao_procura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertaValidade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('validade', models.DateField()),
+                ('faixa', models.CharField(choices=[('V', 'Vencido'), ('30', 'Até 30 dias'), ('60', 'Até 60 dias')], max_length=2)),
+                ('calculado_em', models.DateTimeField()),
+                ('lote', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='alerta', to='gestao.lotestock')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas_validade', to='gestao.produto')),
+            ],
+            options={
+                'verbose_name_plural': 'Alertas de validade',
+                'indexes': [models.Index(fields=['faixa', 'validade'], name='alertavalidade_faixa'), models.Index(fields=['produto', 'validade'], name='alertavalidade_produto')],
+            },
+        ),
+        migrations.RunPython(primeira_varredura, migrations.RunPython.noop),
+    ]
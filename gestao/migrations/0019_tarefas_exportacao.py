@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0018_alertas_validade'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaExportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('documento', models.CharField(max_length=20)),
+                ('formato', models.CharField(choices=[('pdf', 'PDF'), ('word', 'Word')], max_length=4)),
+                ('estado', models.CharField(choices=[('P', 'Pendente'), ('E', 'Em curso'), ('C', 'Concluída'), ('F', 'Falhou')], default='P', max_length=1)),
+                ('chave_pendente', models.CharField(blank=True, max_length=30, null=True, unique=True)),
+                ('progresso', models.PositiveSmallIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('nome_ficheiro', models.CharField(blank=True, max_length=100)),
+                ('conteudo', models.BinaryField(blank=True, null=True)),
+                ('erro', models.TextField(blank=True)),
+                ('pedido_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Exportações',
+                'indexes': [models.Index(fields=['estado', 'id'], name='tarefaexportacao_estado')],
+            },
+        ),
+    ]
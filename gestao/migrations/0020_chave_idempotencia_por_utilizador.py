@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-17 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0019_tarefas_exportacao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='venda',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='venda',
+            constraint=models.UniqueConstraint(fields=('utilizador', 'chave_idempotencia'), name='venda_chave_por_utilizador'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:20
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def converter_versoes(apps, schema_editor):
+    # A versão corrente passa a ser o último id do registo antigo; todos os
+    # produtos ficam nessa versão e só as remoções continuam registadas
+    AlteracaoCatalogo = apps.get_model('gestao', 'AlteracaoCatalogo')
+    VersaoCatalogo = apps.get_model('gestao', 'VersaoCatalogo')
+    Produto = apps.get_model('gestao', 'Produto')
+    versao = AlteracaoCatalogo.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+    AlteracaoCatalogo.objects.filter(removido=False).delete()
+    AlteracaoCatalogo.objects.update(versao=F('id'))
+    Produto.objects.update(versao=versao)
+    VersaoCatalogo.objects.create(id=1, versao=versao)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0020_chave_idempotencia_por_utilizador'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versao', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alteracaocatalogo',
+            name='versao',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='versao',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(converter_versoes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='alteracaocatalogo',
+            name='removido',
+        ),
+    ]
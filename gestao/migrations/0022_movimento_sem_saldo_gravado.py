@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0021_versao_catalogo_por_confirmacao'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='movimento',
+            name='saldo',
+        ),
+    ]
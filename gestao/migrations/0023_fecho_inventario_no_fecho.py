@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0022_movimento_sem_saldo_gravado'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='fechomes',
+            old_name='valor_inventario',
+            new_name='inventario_no_fecho',
+        ),
+        migrations.RemoveField(
+            model_name='fechomes',
+            name='top_produtos',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:30
+
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def preencher_top_produtos(apps, schema_editor):
+    # Meses fechados enquanto o campo não existia: recalculados das linhas de venda
+    FechoMes = apps.get_model('gestao', 'FechoMes')
+    ItemVenda = apps.get_model('gestao', 'ItemVenda')
+    for fecho in FechoMes.objects.all():
+        mes = fecho.mes
+        seguinte = date(mes.year + (mes.month == 12), mes.month % 12 + 1, 1)
+        linhas = (
+            ItemVenda.objects.filter(venda__data__gte=datetime.combine(mes, time.min), venda__data__lt=datetime.combine(seguinte, time.min))
+            .values('produto__nome', 'produto__marca')
+            .annotate(unidades=Sum('quantidade'), receita=Sum(F('quantidade') * F('preco_unitario')))
+            .order_by('-receita')[:10]
+        )
+        fecho.top_produtos = [
+            {'nome': l['produto__nome'], 'marca': l['produto__marca'], 'quantidade': l['unidades'], 'receita': str(Decimal(l['receita']).quantize(Decimal('0.01')))}
+            for l in linhas
+        ]
+        fecho.save(update_fields=['top_produtos'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0023_fecho_inventario_no_fecho'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fechomes',
+            name='top_produtos',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(preencher_top_produtos, migrations.RunPython.noop),
+    ]
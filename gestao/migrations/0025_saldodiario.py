@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:10
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def preencher_saldos(apps, schema_editor):
+    # Saldo no fim de cada dia, acumulado pela ordem do diário
+    Movimento = apps.get_model('gestao', 'Movimento')
+    SaldoDiario = apps.get_model('gestao', 'SaldoDiario')
+    saldos, saldo = {}, Decimal('0')
+    for momento, valor in Movimento.objects.order_by('momento', 'id').values_list('momento', 'valor').iterator():
+        saldo += valor
+        saldos[momento.date()] = saldo
+    SaldoDiario.objects.bulk_create(
+        [SaldoDiario(data=dia, saldo=valor) for dia, valor in saldos.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao', '0024_fechomes_top_produtos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(unique=True)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+        ),
+        migrations.RunPython(preencher_saldos, migrations.RunPython.noop),
+    ]
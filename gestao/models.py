@@ -10,6 +10,7 @@ class Categoria(models.Model):
 class Fornecedor(models.Model):
     nome = models.CharField(max_length=200)
     contacto = models.CharField(max_length=100, blank=True, null=True)
+    prazo_entrega = models.PositiveIntegerField(default=7, verbose_name="Prazo de Entrega (dias)")
     def __str__(self): return self.nome
     class Meta: verbose_name_plural = "2. Fornecedores"
 
@@ -22,6 +23,8 @@ class Produto(models.Model):
     preco_venda = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Preço de Venda (Kz)")
     stock_actual = models.IntegerField(default=0, verbose_name="Stock Actual")
     stock_minimo = models.IntegerField(default=5, verbose_name="Stock Mínimo")
+    # Versão do catálogo em que o produto mudou pela última vez (ver VersaoCatalogo)
+    versao = models.BigIntegerField(default=0, editable=False, db_index=True)
     
     def __str__(self): return f"{self.nome} - {self.marca}"
 
@@ -36,19 +39,20 @@ class Produto(models.Model):
         return self.stock_actual * self.preco_custo
 
     def classe_abc(self):
-        v = float(self.preco_venda or 0)
-        if v >= 5000: return 'A'
-        if v >= 2000: return 'B'
-        return 'C'
+        # Classe Pareto guardada pela classificação periódica (usar select_related('estatistica'))
+        estatistica = getattr(self, 'estatistica', None)
+        return estatistica.classe_abc if estatistica else 'C'
 
     def status_giro(self):
-        vendas_count = self.itemvenda_set.count()
-        ultima_compra = self.itemcompra_set.order_by('-compra__data').first()
+        # Lê a EstatisticaProduto (usar select_related('estatistica') nas listas)
+        estatistica = getattr(self, 'estatistica', None)
+        vendas_count = estatistica.num_vendas if estatistica else 0
+        ultima_compra = estatistica.ultima_compra if estatistica else None
         if vendas_count > 10: return "Rápido ⚡"
         if vendas_count > 0: return "Normal"
         if ultima_compra:
             from django.utils import timezone
-            dias_na_loja = (timezone.now() - ultima_compra.compra.data).days
+            dias_na_loja = (timezone.now() - ultima_compra).days
             if dias_na_loja <= 7: return "Novo / Recente ✨"
         return "Estagnado ⚠️"
 
@@ -76,7 +80,9 @@ class Compra(models.Model):
     def __str__(self):
         data_fmt = self.data.strftime('%d/%m/%Y') if self.data else ''
         return f"Compra #{self.id} — {self.fornecedor} ({data_fmt})"
-    class Meta: verbose_name_plural = "4. Compras"
+    class Meta:
+        verbose_name_plural = "4. Compras"
+        indexes = [models.Index(fields=['data'], name='compra_data')]
 
 class ItemCompra(models.Model):
     compra = models.ForeignKey(Compra, on_delete=models.CASCADE, related_name='itens')
@@ -84,8 +90,45 @@ class ItemCompra(models.Model):
     quantidade = models.IntegerField()
     preco_custo = models.DecimalField(max_digits=15, decimal_places=2)
     validade = models.DateField()
-    lote = models.CharField(max_length=50, blank=True, null=True)
+    lote = models.CharField(max_length=50, blank=True, null=True, db_index=True)
     def __str__(self): return f"{self.produto.nome} × {self.quantidade} un."
+    class Meta:
+        indexes = [models.Index(fields=['produto', 'validade'], name='itemcompra_produto_validade')]
+
+class LoteStock(models.Model):
+    """Saldo vivo de um lote comprado. Só existem lotes abertos: a linha é
+    apagada quando o lote esgota, e o ItemCompra fica como histórico da compra."""
+    item_compra = models.OneToOneField(ItemCompra, on_delete=models.CASCADE, related_name='saldo_lote')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='lotes')
+    validade = models.DateField()
+    lote = models.CharField(max_length=50, blank=True, null=True)
+    quantidade = models.IntegerField()
+    def __str__(self): return f"{self.produto.nome} — lote {self.lote or '—'} ({self.quantidade} un.)"
+    class Meta:
+        verbose_name_plural = "Lotes em stock"
+        indexes = [
+            models.Index(fields=['produto', 'validade'], name='lotestock_produto_validade'),
+            models.Index(fields=['produto', 'quantidade'], name='lotestock_produto_quantidade'),
+            models.Index(fields=['validade'], name='lotestock_validade'),
+        ]
+
+
+class AlertaValidade(models.Model):
+    """Lote aberto a vencer, com a faixa calculada pela varredura diária
+    (comando vigiar_validades). Sai sozinho quando o lote esgota."""
+    FAIXAS = [('V', 'Vencido'), ('30', 'Até 30 dias'), ('60', 'Até 60 dias')]
+    lote = models.OneToOneField(LoteStock, on_delete=models.CASCADE, related_name='alerta')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='alertas_validade')
+    validade = models.DateField()
+    faixa = models.CharField(max_length=2, choices=FAIXAS)
+    calculado_em = models.DateTimeField()
+    def __str__(self): return f"{self.lote} — {self.get_faixa_display()}"
+    class Meta:
+        verbose_name_plural = "Alertas de validade"
+        indexes = [
+            models.Index(fields=['faixa', 'validade'], name='alertavalidade_faixa'),
+            models.Index(fields=['produto', 'validade'], name='alertavalidade_produto'),
+        ]
 
 class Venda(models.Model):
     METODOS_PAGAMENTO = [('DIN', 'Dinheiro'), ('TPA', 'TPA'), ('TRANS', 'Transferência')]
@@ -93,8 +136,15 @@ class Venda(models.Model):
     utilizador = models.ForeignKey(User, on_delete=models.PROTECT)
     valor_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     metodo_pagamento = models.CharField(max_length=10, choices=METODOS_PAGAMENTO)
+    # Chave enviada pelo PDV: repetir o pedido devolve a mesma venda (por utilizador)
+    chave_idempotencia = models.CharField(max_length=64, null=True, blank=True, editable=False)
     def __str__(self): return f"Venda #{self.id} — {self.valor_total} Kz"
-    class Meta: verbose_name_plural = "5. Vendas"
+    class Meta:
+        verbose_name_plural = "5. Vendas"
+        indexes = [models.Index(fields=['data'], name='venda_data')]
+        constraints = [
+            models.UniqueConstraint(fields=['utilizador', 'chave_idempotencia'], name='venda_chave_por_utilizador'),
+        ]
 
 class ItemVenda(models.Model):
     venda = models.ForeignKey(Venda, on_delete=models.CASCADE, related_name='itens')
@@ -104,17 +154,212 @@ class ItemVenda(models.Model):
     def total_item(self): return self.quantidade * self.preco_unitario
     def __str__(self): return f"{self.produto.nome} × {self.quantidade} un."
 
+class AlocacaoLote(models.Model):
+    """Quantas unidades de cada lote (ItemCompra) saíram em cada linha de venda."""
+    item_venda = models.ForeignKey(ItemVenda, on_delete=models.CASCADE, related_name='alocacoes')
+    item_compra = models.ForeignKey(ItemCompra, on_delete=models.CASCADE, related_name='alocacoes')
+    quantidade = models.IntegerField()
+    def __str__(self): return f"Lote #{self.item_compra_id} → venda (linha #{self.item_venda_id}): {self.quantidade} un."
+    class Meta:
+        verbose_name_plural = "Alocações de lotes"
+        indexes = [
+            models.Index(fields=['item_compra', 'item_venda'], name='alocacao_lote_venda'),
+            models.Index(fields=['item_venda', 'item_compra'], name='alocacao_venda_lote'),
+        ]
+
 # --- 4. FINANCEIRO ---
 class Despesa(models.Model):
     descricao = models.CharField(max_length=255)
     valor = models.DecimalField(max_digits=10, decimal_places=2)
     data = models.DateField()
     def __str__(self): return f"{self.descricao} — {self.valor} Kz"
-    class Meta: verbose_name_plural = "6. Despesas"
+    class Meta:
+        verbose_name_plural = "6. Despesas"
+        indexes = [models.Index(fields=['data'], name='despesa_data')]
 
 class ReceitaExtra(models.Model):
     descricao = models.CharField(max_length=255)
     valor = models.DecimalField(max_digits=10, decimal_places=2)
     data = models.DateField()
     def __str__(self): return f"{self.descricao} — {self.valor} Kz"
-    class Meta: verbose_name_plural = "7. Receitas Extras"
\ No newline at end of file
+    class Meta:
+        verbose_name_plural = "7. Receitas Extras"
+        indexes = [models.Index(fields=['data'], name='receitaextra_data')]
+
+# --- 5. AGREGADOS (MANTIDOS PELOS SIGNALS) ---
+class VersaoCatalogo(models.Model):
+    """Versão corrente do catálogo do PDV (uma só linha).
+
+    Incrementada depois do commit de quem altera produtos, numa transacção
+    curta com a linha bloqueada: as versões ficam pela ordem de confirmação
+    e o PDV, ao pedir as diferenças desde a versão N, nunca perde uma
+    alteração confirmada mais tarde com número mais baixo."""
+    versao = models.BigIntegerField(default=0)
+    def __str__(self): return f"Catálogo v{self.versao}"
+
+
+class AlteracaoCatalogo(models.Model):
+    """Produto removido do catálogo, com a versão em que saiu.
+    As alterações dos produtos que existem ficam em Produto.versao."""
+    produto_id = models.BigIntegerField(db_index=True)
+    versao = models.BigIntegerField(default=0, db_index=True)
+    data = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return f"Catálogo v{self.versao} — produto #{self.produto_id} removido"
+
+
+class EstatisticaProduto(models.Model):
+    """Contadores de rotação de um produto, actualizados a cada venda/compra."""
+    produto = models.OneToOneField(Produto, on_delete=models.CASCADE, related_name='estatistica')
+    unidades_vendidas = models.IntegerField(default=0)
+    num_vendas = models.IntegerField(default=0)
+    ultima_venda = models.DateTimeField(null=True, blank=True)
+    ultima_compra = models.DateTimeField(null=True, blank=True)
+    # Classificação periódica (comando classificar_abc): Pareto da receita na
+    # janela móvel e regularidade das vendas semanais
+    classe_abc = models.CharField(max_length=1, default='C')
+    classe_xyz = models.CharField(max_length=1, default='Z')
+    receita_janela = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    classificado_em = models.DateTimeField(null=True, blank=True)
+    def __str__(self): return f"Estatística — {self.produto}"
+    class Meta:
+        indexes = [models.Index(fields=['classe_abc'], name='estatistica_classe_abc')]
+
+
+class PrevisaoProduto(models.Model):
+    """Previsão de procura e ponto de encomenda de um produto, recalculada
+    periodicamente (comando prever_procura) para todo o catálogo de uma vez."""
+    produto = models.OneToOneField(Produto, on_delete=models.CASCADE, related_name='previsao')
+    # Fornecedor da última compra do produto: a quem se encomenda
+    fornecedor = models.ForeignKey(Fornecedor, on_delete=models.SET_NULL, null=True, blank=True)
+    procura_diaria = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    desvio_diario = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    stock_seguranca = models.IntegerField(default=0)
+    ponto_encomenda = models.IntegerField(default=0)
+    quantidade_sugerida = models.IntegerField(default=0)
+    calculado_em = models.DateTimeField()
+    def __str__(self): return f"Previsão — {self.produto}"
+    class Meta:
+        indexes = [models.Index(fields=['fornecedor', 'quantidade_sugerida'], name='previsao_fornecedor_sugestao')]
+
+
+class ResumoDiario(models.Model):
+    """Totais de caixa por dia, um valor por origem de movimento."""
+    data = models.DateField(unique=True)
+    vendas = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    receitas_extra = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    compras = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    despesas = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    @property
+    def entradas(self): return self.vendas + self.receitas_extra
+
+    @property
+    def saidas(self): return self.compras + self.despesas
+
+    def __str__(self): return f"Resumo {self.data:%d/%m/%Y}"
+    class Meta:
+        verbose_name_plural = "8. Resumos Diários"
+        ordering = ['-data']
+
+
+class SaldoCaixa(models.Model):
+    """Saldo corrente da caixa (uma só linha). Quem escreve no diário bloqueia
+    esta linha: os lançamentos de um mesmo registo não se cruzam."""
+    saldo = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    def __str__(self): return f"Saldo em caixa: {self.saldo} Kz"
+
+
+class SaldoDiario(models.Model):
+    """Saldo de caixa no fim de cada dia com movimentos (pontos de controlo do diário).
+
+    Um movimento com data passada soma o seu valor à linha do seu dia e às
+    seguintes; o saldo numa data lê-se da linha mais próxima, sem somar o diário.
+    """
+    data = models.DateField(unique=True)
+    saldo = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    def __str__(self): return f"Saldo em {self.data:%d/%m/%Y}: {self.saldo} Kz"
+
+
+class Movimento(models.Model):
+    """Diário de caixa: uma linha por movimento, só se acrescentam linhas.
+
+    Uma alteração ou remoção de uma venda/compra/despesa/receita gera uma
+    linha de correcção ou anulação. As linhas nunca são alteradas: o saldo
+    depois de cada uma é calculado na leitura a partir do SaldoDiario do
+    seu dia (ver diario.com_saldos).
+    """
+    ORIGENS = [('V', 'Venda'), ('R', 'Receita Extra'), ('D', 'Despesa'), ('C', 'Compra')]
+    momento = models.DateTimeField()
+    origem = models.CharField(max_length=1, choices=ORIGENS)
+    origem_id = models.BigIntegerField()
+    descricao = models.CharField(max_length=255)
+    valor = models.DecimalField(max_digits=18, decimal_places=2)
+    registado = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return f"{self.get_origem_display()} #{self.origem_id}: {self.valor} Kz"
+    class Meta:
+        verbose_name_plural = "9. Diário de Caixa"
+        ordering = ['-momento', '-id']
+        indexes = [
+            models.Index(fields=['momento', 'id'], name='movimento_momento'),
+            models.Index(fields=['origem', 'origem_id'], name='movimento_origem'),
+        ]
+
+
+class FechoMes(models.Model):
+    """Fotografia de um mês fechado: os valores ficam congelados e os
+    relatórios passam a lê-los daqui em vez de voltar a somar os movimentos."""
+    mes = models.DateField(unique=True)  # dia 1 do mês
+    vendas = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    receitas_extra = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    compras = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    despesas = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    # Valor do stock ao preço de custo quando o fecho foi feito (fechado_em),
+    # não no último dia do mês: o stock não tem histórico por data
+    inventario_no_fecho = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    # [{'nome', 'marca', 'quantidade', 'receita'}, ...] dos 10 produtos mais vendidos no mês
+    top_produtos = models.JSONField(default=list)
+    fechado_em = models.DateTimeField(auto_now_add=True)
+    fechado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    @property
+    def receitas(self): return self.vendas + self.receitas_extra
+
+    @property
+    def custos(self): return self.compras + self.despesas
+
+    @property
+    def lucro(self): return self.receitas - self.custos
+
+    @property
+    def margem(self): return (self.lucro / self.receitas * 100) if self.receitas > 0 else 0
+
+    def __str__(self): return f"Fecho de {self.mes:%m/%Y}"
+    class Meta:
+        verbose_name_plural = "10. Fechos de Mês"
+        ordering = ['-mes']
+
+
+class TarefaExportacao(models.Model):
+    """Exportação PDF/Word pedida pela interface e gerada pelo worker
+    (comando processar_exportacoes). O ficheiro fica na própria tabela, para
+    o worker e o servidor web não precisarem de partilhar disco."""
+    ESTADOS = [('P', 'Pendente'), ('E', 'Em curso'), ('C', 'Concluída'), ('F', 'Falhou')]
+    FORMATOS = [('pdf', 'PDF'), ('word', 'Word')]
+    documento = models.CharField(max_length=20)
+    formato = models.CharField(max_length=4, choices=FORMATOS)
+    estado = models.CharField(max_length=1, choices=ESTADOS, default='P')
+    # "documento:formato" enquanto pendente ou em curso, None depois: o índice
+    # único junta pedidos iguais numa só tarefa
+    chave_pendente = models.CharField(max_length=30, unique=True, null=True, blank=True)
+    progresso = models.PositiveSmallIntegerField(default=0)  # %
+    pedido_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+    nome_ficheiro = models.CharField(max_length=100, blank=True)
+    conteudo = models.BinaryField(null=True, blank=True, editable=False)
+    erro = models.TextField(blank=True)
+    def __str__(self): return f"Exportação #{self.id} — {self.documento} ({self.get_formato_display()})"
+    class Meta:
+        verbose_name_plural = "Exportações"
+        indexes = [models.Index(fields=['estado', 'id'], name='tarefaexportacao_estado')]
@@ -0,0 +1,103 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Fornecedor, ItemCompra, PrevisaoProduto, Produto
+from .classificacao import vendas_por_dia
+
+# Dias de histórico usados na previsão
+JANELA_DIAS = 56
+# Peso do dia mais recente na suavização exponencial
+ALFA = 0.3
+# Nível de serviço de 95% (factor da distribuição normal)
+FACTOR_SERVICO = 1.65
+# Dias de venda que uma encomenda deve cobrir além do prazo de entrega
+COBERTURA_DIAS = 30
+# Prazo de entrega quando o produto ainda não tem fornecedor
+PRAZO_OMISSAO = 7
+METODOS = ('exponencial', 'media')
+
+
+def procura(unidades, metodo='exponencial', alfa=ALFA):
+    """Procura diária prevista de cada linha de uma matriz [produto, dia].
+
+    'media' é a média móvel da janela; 'exponencial' é a suavização
+    exponencial simples, escrita como uma média ponderada das colunas
+    (pesos alfa·(1-alfa)^idade, partindo da média da janela), para todo o
+    catálogo numa só operação.
+    """
+    matriz = np.asarray(unidades, dtype=float)
+    media = matriz.mean(axis=1) if matriz.shape[1] else np.zeros(len(matriz))
+    if metodo == 'media':
+        return media
+    dias = matriz.shape[1]
+    pesos = alfa * (1 - alfa) ** np.arange(dias - 1, -1, -1)
+    return matriz @ pesos + (1 - alfa) ** dias * media
+
+
+def pontos_encomenda(procura_diaria, desvio, prazo, stock, minimo):
+    """Stock de segurança, ponto de encomenda e quantidade a encomendar (arrays).
+
+        seguranca = factor · desvio · √prazo
+        ponto     = max(procura · prazo + seguranca, stock mínimo)
+        sugerida  = procura · (prazo + cobertura) + seguranca - stock, se stock <= ponto
+    """
+    seguranca = np.ceil(FACTOR_SERVICO * desvio * np.sqrt(prazo))
+    ponto = np.maximum(np.ceil(procura_diaria * prazo + seguranca), minimo)
+    alvo = np.maximum(np.ceil(procura_diaria * (prazo + COBERTURA_DIAS) + seguranca), ponto)
+    sugerida = np.where(stock <= ponto, np.maximum(alvo - stock, 0), 0)
+    return seguranca.astype(int), ponto.astype(int), sugerida.astype(int)
+
+
+def _ultimo_fornecedor(produto_ids):
+    # Fornecedor da compra mais recente de cada produto: duas queries
+    ultimos = ItemCompra.objects.filter(produto_id__in=produto_ids).values('produto_id').annotate(ultimo=Max('id')).order_by()
+    return dict(
+        ItemCompra.objects.filter(id__in=[l['ultimo'] for l in ultimos], compra__fornecedor__isnull=False)
+        .values_list('produto_id', 'compra__fornecedor_id')
+    )
+
+
+def prever(dias=JANELA_DIAS, metodo='exponencial', agora=None):
+    """Recalcula a previsão e o ponto de encomenda de todos os produtos.
+
+    As vendas diárias entram como uma matriz [produto, dia] e todo o
+    catálogo é calculado numa só passagem vectorizada. O prazo de entrega é
+    o do fornecedor da última compra, a quem fica atribuída a sugestão.
+    Substitui as linhas de PrevisaoProduto; devolve o número de produtos
+    com encomenda sugerida.
+    """
+    agora = agora or timezone.now()
+    fim = datetime.combine(agora.date() + timedelta(days=1), time.min)
+    inicio = fim - timedelta(days=dias)
+
+    produtos = list(Produto.objects.order_by('id').values_list('id', 'stock_actual', 'stock_minimo'))
+    if not produtos:
+        PrevisaoProduto.objects.all().delete()
+        return 0
+    ids, stock, minimo = (np.array(coluna, dtype=np.int64) for coluna in zip(*produtos))
+    unidades, _ = vendas_por_dia(ids, inicio, dias)
+
+    fornecedores = _ultimo_fornecedor(ids.tolist())
+    prazos = dict(Fornecedor.objects.filter(id__in=set(fornecedores.values())).values_list('id', 'prazo_entrega'))
+    prazo = np.array([prazos.get(fornecedores.get(pid), PRAZO_OMISSAO) for pid in ids.tolist()], dtype=float)
+
+    procura_diaria = procura(unidades, metodo)
+    desvio = unidades.std(axis=1)
+    seguranca, ponto, sugerida = pontos_encomenda(procura_diaria, desvio, prazo, stock, minimo)
+
+    previsoes = [
+        PrevisaoProduto(
+            produto_id=pid, fornecedor_id=fornecedores.get(pid),
+            procura_diaria=Decimal(str(round(procura_diaria[i], 3))), desvio_diario=Decimal(str(round(desvio[i], 3))),
+            stock_seguranca=int(seguranca[i]), ponto_encomenda=int(ponto[i]), quantidade_sugerida=int(sugerida[i]),
+            calculado_em=agora,
+        )
+        for i, pid in enumerate(ids.tolist())
+    ]
+    with transaction.atomic():
+        PrevisaoProduto.objects.all().delete()
+        PrevisaoProduto.objects.bulk_create(previsoes, batch_size=500)
+    return int((sugerida > 0).sum())
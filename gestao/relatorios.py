@@ -0,0 +1,199 @@
+import hashlib
+from datetime import date
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+from .models import Venda, Compra, ItemVenda, ItemCompra, Fornecedor, Produto, AlertaValidade, ResumoDiario, Movimento, FechoMes
+from . import catalogo, fechos
+from .utils import periodo
+
+# Segundos em cache; a versão dos dados já invalida o que mudou, isto só
+# limita o tempo de vida de alterações sem movimento de caixa nem de stock
+# (ex.: mudar o nome de um fornecedor)
+DURACAO_CACHE = 300
+
+
+def versao():
+    """Versão dos dados dos relatórios: muda com cada movimento de caixa
+    (diário) e com cada alteração de produto ou stock (catálogo).
+
+    Fica na base de dados, por isso vale para todos os processos do servidor
+    mesmo com uma cache local a cada um.
+    """
+    ultimo_movimento = Movimento.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    return f"{ultimo_movimento}.{catalogo.versao_actual()}.{fechos.ultimo_fecho() or ''}"
+
+
+def _em_cache(chave, calcular):
+    # A versão dos dados entra na chave: o que mudou deixa de ser encontrado
+    chave = f"{chave}:{versao()}"
+    dados = cache.get(chave)
+    if dados is None:
+        dados = calcular()
+        cache.set(chave, dados, DURACAO_CACHE)
+    return dados
+
+
+def _linha_mes(mes, receitas, custos, fecho=None):
+    receitas, custos = float(receitas), float(custos)
+    lucro = receitas - custos
+    margem = (lucro / receitas * 100) if receitas > 0 else 0
+    linha = {'mes': mes, 'vendas': receitas, 'saidas': custos, 'lucro': lucro, 'margem': margem, 'fechado': fecho is not None}
+    if fecho is not None:
+        linha['fechado_em'] = fecho.fechado_em
+        linha['inventario_no_fecho'] = float(fecho.inventario_no_fecho)
+        linha['top_produtos'] = fecho.top_produtos
+    return linha
+
+
+def _por_mes(ano):
+    # Meses fechados: lidos da fotografia, sem voltar às linhas de movimento
+    fechados = FechoMes.objects.filter(**periodo(FechoMes, ano=ano, campo='mes'))
+    meses = [_linha_mes(f.mes, f.receitas, f.custos, f) for f in fechados]
+    # Meses abertos: um GROUP BY sobre o ResumoDiario (uma linha por dia) a
+    # partir do mês seguinte ao último fecho
+    fecho = fechos.ultimo_fecho()
+    abertos = ResumoDiario.objects.filter(**periodo(ResumoDiario, ano=ano))
+    if fecho:
+        abertos = abertos.filter(data__gte=fechos.mes_seguinte(fecho))
+    linhas = (
+        abertos.values('data__year', 'data__month')
+        .annotate(vendas=Sum('vendas'), extras=Sum('receitas_extra'), compras=Sum('compras'), despesas=Sum('despesas'))
+        .order_by('-data__year', '-data__month')
+    )
+    for linha in linhas:
+        meses.append(_linha_mes(date(linha['data__year'], linha['data__month'], 1),
+                                linha['vendas'] + linha['extras'], linha['despesas'] + linha['compras']))
+    return sorted((m for m in meses if m['vendas'] or m['saidas']), key=lambda m: m['mes'], reverse=True)
+
+
+def mensal(ano=''):
+    """Resultado mês a mês (mais recente primeiro), numa só query agrupada.
+
+    Cada mês é um dict com 'mes' (dia 1), 'vendas' (receitas: vendas e
+    receitas extra), 'saidas' (compras e despesas), 'lucro' e 'margem' (%).
+    Usado pelo separador financeiro e pelas três exportações mensais.
+    """
+    return _em_cache(f"relatorios:mensal:{ano}", lambda: _por_mes(ano))
+
+
+# --- PROVEDORES (um por separador) ---
+
+def financeiro(ano=''):
+    # Primeiro e último dia com movimentos, pelo índice do ResumoDiario
+    limites = ResumoDiario.objects.aggregate(primeiro=Min('data'), ultimo=Max('data'))
+    anos_disponiveis = list(range(limites['ultimo'].year, limites['primeiro'].year - 1, -1)) if limites['ultimo'] else []
+    relatorio_final = mensal(ano)
+
+    total_receitas = sum(r['vendas'] for r in relatorio_final)
+    total_custos = sum(r['saidas'] for r in relatorio_final)
+    total_lucro = total_receitas - total_custos
+    return {
+        'relatorio_final': relatorio_final,
+        'total_receitas': total_receitas, 'total_custos': total_custos,
+        'total_lucro': total_lucro,
+        'margem_media': (total_lucro / total_receitas * 100) if total_receitas > 0 else 0,
+        'anos_disponiveis': anos_disponiveis, 'ano_selecionado': ano,
+        'proximo_fecho': fechos.proximo_a_fechar(),
+    }
+
+
+def vendas(v_data_inicio='', v_data_fim='', v_metodo=''):
+    vendas_qs = Venda.objects.all()
+    vendas_qs = vendas_qs.filter(**periodo(Venda, v_data_inicio, v_data_fim))
+    if v_metodo:
+        vendas_qs = vendas_qs.filter(metodo_pagamento=v_metodo)
+
+    total = vendas_qs.aggregate(total=Sum('valor_total'), n=Count('id'))
+    num_vendas = total['n']
+    total_vendas_filtrado = total['total'] or 0
+    return {
+        'vendas_lista': list(vendas_qs.order_by('-data')[:50]),
+        'total_vendas_filtrado': total_vendas_filtrado,
+        'num_vendas': num_vendas,
+        'ticket_medio': float(total_vendas_filtrado) / num_vendas if num_vendas > 0 else 0,
+        'top_produtos': list(
+            ItemVenda.objects.filter(venda__in=vendas_qs)
+            .values('produto__nome', 'produto__marca')
+            .annotate(total_vendido=Sum('quantidade'), receita=Sum(F('quantidade') * F('preco_unitario')))
+            .order_by('-receita')[:10]
+        ),
+        'por_metodo': list(
+            vendas_qs.values('metodo_pagamento').annotate(total=Sum('valor_total')).order_by('-total')
+        ),
+    }
+
+
+def compras(c_data_inicio='', c_data_fim='', c_fornecedor=''):
+    compras_qs = Compra.objects.all()
+    compras_qs = compras_qs.filter(**periodo(Compra, c_data_inicio, c_data_fim))
+    if c_fornecedor:
+        compras_qs = compras_qs.filter(fornecedor__id=c_fornecedor)
+
+    total = compras_qs.aggregate(total=Sum('valor_total'), n=Count('id'))
+    return {
+        'compras_lista': list(
+            compras_qs.select_related('fornecedor').annotate(num_itens=Count('itens')).order_by('-data')[:50]
+        ),
+        'total_compras_filtrado': total['total'] or 0,
+        'num_compras': total['n'],
+        'top_fornecedores': list(
+            compras_qs.values('fornecedor__nome').annotate(total_gasto=Sum('valor_total')).order_by('-total_gasto')[:10]
+        ),
+        'produtos_comprados': list(
+            ItemCompra.objects.filter(compra__in=compras_qs)
+            .values('produto__nome', 'produto__marca')
+            .annotate(total_qty=Sum('quantidade'), total_custo=Sum(F('quantidade') * F('preco_custo')))
+            .order_by('-total_custo')[:10]
+        ),
+        'fornecedores': list(Fornecedor.objects.order_by('nome').values('id', 'nome')),
+    }
+
+
+def inventario():
+    hoje = timezone.now().date()
+    valor_stock = F('stock_actual') * F('preco_custo')
+    # "Nunca vendidos" lido da EstatisticaProduto em vez de um DISTINCT sobre ItemVenda
+    produtos_estagnados = list(
+        Produto.objects.filter(Q(estatistica__isnull=True) | Q(estatistica__num_vendas=0), stock_actual__gt=0)
+        .annotate(valor_parado=valor_stock).values('nome', 'marca', 'stock_actual', 'valor_parado')
+    )
+    return {
+        'valor_total_stock': float(Produto.objects.aggregate(t=Sum(valor_stock))['t'] or 0),
+        'produtos_estagnados': produtos_estagnados,
+        'valor_estagnado': sum(float(p['valor_parado']) for p in produtos_estagnados),
+        # Lista de alertas da varredura diária (lotes.varrer_validades)
+        'alertas_validade': list(
+            AlertaValidade.objects.order_by('validade')
+            .values('produto__nome', 'validade', 'faixa', quantidade=F('lote__quantidade'))
+        ),
+        'stock_critico': list(
+            Produto.objects.filter(stock_actual__lte=F('stock_minimo')).order_by('stock_actual')
+            .values('nome', 'marca', 'stock_actual', 'stock_minimo')
+        ),
+        'hoje': hoje,
+    }
+
+
+# separador -> (provedor, parâmetros GET que aceita, exportações)
+SEPARADORES = {
+    'financeiro': (financeiro, ['ano'], 'relatorio'),
+    'vendas': (vendas, ['v_data_inicio', 'v_data_fim', 'v_metodo'], 'vendas'),
+    'compras': (compras, ['c_data_inicio', 'c_data_fim', 'c_fornecedor'], 'compras'),
+    'inventario': (inventario, [], 'relatorio'),
+}
+
+
+def contexto(tab, parametros):
+    """Dados de um só separador, calculados só quando não estão em cache.
+
+    A chave junta o separador, os filtros e a versão dos dados: uma venda,
+    compra, despesa, receita ou alteração de stock muda a versão e os
+    relatórios seguintes são recalculados.
+    """
+    provedor, campos, _ = SEPARADORES[tab]
+    filtros = {campo: parametros.get(campo, '') for campo in campos}
+    assinatura = hashlib.md5(urlencode(sorted(filtros.items())).encode()).hexdigest()
+    dados = _em_cache(f"relatorios:{tab}:{assinatura}", lambda: provedor(**filtros))
+    return {**filtros, **dados}
@@ -0,0 +1,94 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from .models import Venda, ReceitaExtra, Compra, Despesa, ResumoDiario
+
+# Origens de caixa: modelo -> (campo do valor, coluna no ResumoDiario)
+ORIGENS = {
+    Venda: ('valor_total', 'vendas'),
+    ReceitaExtra: ('valor', 'receitas_extra'),
+    Compra: ('valor_total', 'compras'),
+    Despesa: ('valor', 'despesas'),
+}
+CAMPOS = [coluna for _, coluna in ORIGENS.values()]
+
+# Venda e Compra guardam data e hora (DateTimeField)
+COM_HORA = (Venda, Compra)
+
+
+def dia_de(valor):
+    """Devolve só a data de um valor de DateField ou DateTimeField."""
+    return valor.date() if isinstance(valor, datetime) else valor
+
+
+def dia_do_registo(instance):
+    # As views criam Despesa/ReceitaExtra com a data ainda em texto
+    return dia_de(instance._meta.get_field('data').to_python(instance.data))
+
+
+def _filtro_dia(modelo, dia):
+    if modelo in COM_HORA:
+        inicio = datetime.combine(dia, time.min)
+        return {'data__gte': inicio, 'data__lt': inicio + timedelta(days=1)}
+    return {'data': dia}
+
+
+def somar(modelo, dia, valor):
+    """Soma `valor` (negativo numa correcção ou anulação) à coluna de uma origem num dia.
+
+    Um UPDATE com F() em vez de voltar a somar o dia: duas escritas
+    concorrentes no mesmo dia somam-se as duas, nenhuma se perde.
+    """
+    _, coluna = ORIGENS[modelo]
+    if not valor or ResumoDiario.objects.filter(data=dia).update(**{coluna: F(coluna) + valor}):
+        return
+    resumo, criado = ResumoDiario.objects.get_or_create(data=dia, defaults={coluna: valor})
+    if not criado:
+        ResumoDiario.objects.filter(data=dia).update(**{coluna: F(coluna) + valor})
+
+
+def totais(**filtros):
+    """Soma as colunas do ResumoDiario, ex.: totais(data__gte=inicio_mes)."""
+    somas = ResumoDiario.objects.filter(**filtros).aggregate(**{c: Sum(c) for c in CAMPOS})
+    resultado = {c: somas[c] or Decimal('0') for c in CAMPOS}
+    resultado['entradas'] = resultado['vendas'] + resultado['receitas_extra']
+    resultado['saidas'] = resultado['compras'] + resultado['despesas']
+    return resultado
+
+
+def agregar_tabelas():
+    """Agrega as tabelas de origem por dia: {data: {coluna: total}}."""
+    por_dia = {}
+    for modelo, (campo_valor, coluna) in ORIGENS.items():
+        dia = TruncDate('data') if modelo in COM_HORA else F('data')
+        linhas = modelo.objects.annotate(dia=dia).values('dia').annotate(total=Sum(campo_valor)).order_by()
+        for linha in linhas:
+            if linha['total']:
+                por_dia.setdefault(linha['dia'], dict.fromkeys(CAMPOS, Decimal('0')))[coluna] = linha['total']
+    return por_dia
+
+
+def reconstruir():
+    """Apaga o ResumoDiario e volta a gerá-lo a partir das tabelas de origem."""
+    por_dia = agregar_tabelas()
+    ResumoDiario.objects.all().delete()
+    ResumoDiario.objects.bulk_create(
+        [ResumoDiario(data=dia, **valores) for dia, valores in sorted(por_dia.items())],
+        batch_size=500,
+    )
+    return len(por_dia)
+
+
+def verificar():
+    """Compara o ResumoDiario com as tabelas de origem: [(dia, coluna, esperado, actual)]."""
+    esperado = agregar_tabelas()
+    actual = {r.pop('data'): r for r in ResumoDiario.objects.values('data', *CAMPOS)}
+    diferencas = []
+    for dia in sorted(set(esperado) | set(actual)):
+        for coluna in CAMPOS:
+            e = esperado.get(dia, {}).get(coluna, Decimal('0'))
+            a = actual.get(dia, {}).get(coluna, Decimal('0'))
+            if e != a:
+                diferencas.append((dia, coluna, e, a))
+    return diferencas
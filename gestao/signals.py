@@ -1,8 +1,9 @@
 from django.db import models, transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.db.models import F, Sum
-from .models import ItemVenda, ItemCompra, Produto
+from .models import ItemVenda, ItemCompra, Produto, Venda, Compra, Despesa, ReceitaExtra
+from . import resumos, vendas, compras, catalogo, diario, fechos
 from django.core.exceptions import ValidationError
 from decimal import Decimal
 
@@ -10,32 +11,16 @@ from decimal import Decimal
 def atualizar_entrada_stock(sender, instance, created, **kwargs):
     if created:
         with transaction.atomic():
-            produto = instance.produto
-            
             # --- CÁLCULO DE CUSTO MÉDIO PONDERADO ---
-            qtd_antiga = Decimal(str(produto.stock_actual))
-            preco_antigo = Decimal(str(produto.preco_custo))
-            
-            nova_quantidade = Decimal(str(instance.quantidade))
-            novo_preco_compra = Decimal(str(instance.preco_custo))
-            
-            total_unidades = qtd_antiga + nova_quantidade
-            
-            if total_unidades > 0:
-                valor_total = (qtd_antiga * preco_antigo) + (nova_quantidade * novo_preco_compra)
-                custo_medio = (valor_total / total_unidades).quantize(Decimal('0.01'))
-                produto.preco_custo = custo_medio
-            
-            produto.stock_actual += instance.quantidade
-            # skip_clean=True porque os signals não devem ser bloqueados
-            # pela validação de preço de venda vs custo
-            produto.save(skip_clean=True)
+            # Feito num UPDATE atómico, partilhado com a entrada em lote
+            compras.aplicar_entradas([instance], instance.compra.data)
 
     # --- RECALCULAR TOTAL DA COMPRA ---
     compra = instance.compra
     total_calculado = sum(item.quantidade * item.preco_custo for item in compra.itens.all())
     compra.valor_total = Decimal(str(total_calculado)).quantize(Decimal('0.01'))
     type(compra).objects.filter(id=compra.id).update(valor_total=compra.valor_total)
+    diario.registar(Compra, compra.id)
 
     
 # --- SAÍDA DE STOCK (VENDAS) ---
@@ -43,25 +28,8 @@ def atualizar_entrada_stock(sender, instance, created, **kwargs):
 def atualizar_saida_stock(sender, instance, created, **kwargs):
     if created:
         with transaction.atomic():
-            produto = instance.produto
-            
-            # Lógica FEFO: baixa as quantidades dos lotes por ordem de validade
-            quantidade_a_baixar = instance.quantidade
-            lotes = ItemCompra.objects.filter(produto=produto, quantidade__gt=0).order_by('validade')
-            
-            for lote in lotes:
-                if quantidade_a_baixar <= 0: break
-                if lote.quantidade >= quantidade_a_baixar:
-                    lote.quantidade -= quantidade_a_baixar
-                    quantidade_a_baixar = 0
-                else:
-                    quantidade_a_baixar -= lote.quantidade
-                    lote.quantidade = 0
-                lote.save()
-
-            produto.stock_actual -= instance.quantidade
-            # skip_clean=True pelo mesmo motivo — operação interna do sistema
-            produto.save(skip_clean=True)
+            # Lógica FEFO e baixa de stock partilhadas com o checkout em lote
+            vendas.aplicar_saidas([instance], instance.venda.data)
 
     # RECALCULAR TOTAL DA VENDA
     venda = instance.venda
@@ -70,3 +38,62 @@ def atualizar_saida_stock(sender, instance, created, **kwargs):
     )['total'] or 0
     
     type(venda).objects.filter(id=venda.id).update(valor_total=total_calculado)
+    diario.registar(Venda, venda.id)
+
+
+# --- RESUMO DIÁRIO DE CAIXA ---
+@receiver(pre_save, sender=Despesa)
+@receiver(pre_save, sender=ReceitaExtra)
+def guardar_data_anterior(sender, instance, **kwargs):
+    # Se a data for alterada, o mês antigo também tem de estar aberto
+    if instance.pk:
+        instance._data_anterior = sender.objects.filter(pk=instance.pk).values_list('data', flat=True).first()
+
+
+# --- MESES FECHADOS ---
+@receiver(pre_save, sender=Venda)
+@receiver(pre_save, sender=Compra)
+@receiver(pre_save, sender=Despesa)
+@receiver(pre_save, sender=ReceitaExtra)
+@receiver(pre_save, sender=ItemVenda)
+@receiver(pre_save, sender=ItemCompra)
+@receiver(pre_delete, sender=Venda)
+@receiver(pre_delete, sender=Compra)
+@receiver(pre_delete, sender=Despesa)
+@receiver(pre_delete, sender=ReceitaExtra)
+@receiver(pre_delete, sender=ItemVenda)
+@receiver(pre_delete, sender=ItemCompra)
+def proteger_mes_fechado(sender, instance, **kwargs):
+    # Uma venda ou compra nova ainda não tem data (auto_now_add): é do mês corrente
+    if sender is ItemVenda:
+        datas = [instance.venda.data]
+    elif sender is ItemCompra:
+        datas = [instance.compra.data]
+    else:
+        datas = [resumos.dia_do_registo(instance), getattr(instance, '_data_anterior', None)]
+    fechos.verificar_aberto(*datas)
+
+
+@receiver(post_save, sender=Venda)
+@receiver(post_save, sender=Compra)
+@receiver(post_save, sender=Despesa)
+@receiver(post_save, sender=ReceitaExtra)
+@receiver(post_delete, sender=Venda)
+@receiver(post_delete, sender=Compra)
+@receiver(post_delete, sender=Despesa)
+@receiver(post_delete, sender=ReceitaExtra)
+def actualizar_resumo_diario(sender, instance, **kwargs):
+    # Diário de caixa e ResumoDiario: lançamento, correcção ou anulação do
+    # registo (numa mudança de data, sai do dia antigo e entra no novo)
+    diario.registar(sender, instance.id)
+
+
+# --- CATÁLOGO DO PDV ---
+@receiver(post_save, sender=Produto)
+def registar_alteracao_catalogo(sender, instance, **kwargs):
+    catalogo.registar_alteracoes([instance.id])
+
+
+@receiver(post_delete, sender=Produto)
+def registar_remocao_catalogo(sender, instance, **kwargs):
+    catalogo.registar_alteracoes([instance.id], removido=True)
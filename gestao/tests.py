@@ -1,7 +1,14 @@
-from django.test import TestCase
+import importlib.util
+import io
+import csv
+from unittest import skipUnless
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from .models import Categoria, Fornecedor, Produto, Compra, ItemCompra, Venda, ItemVenda
+from django.db.models import F
+from .models import Categoria, Fornecedor, Produto, Compra, ItemCompra, Venda, ItemVenda, LoteStock
 
 
 class TestCustoMedioPonderado(TestCase):
@@ -42,6 +49,185 @@ class TestCustoMedioPonderado(TestCase):
         self.assertEqual(self.produto.preco_custo, Decimal('1500.00'))
         self.assertEqual(self.produto.stock_actual, 20)
 
+    def test_entrada_usa_valores_actuais_da_bd(self):
+        # Objeto em memória desactualizado: outra operação mudou o stock entretanto
+        compra = Compra.objects.create(fornecedor=self.fornecedor)
+        ItemCompra.objects.create(compra=compra, produto=self.produto, quantidade=10, preco_custo=Decimal('1000.00'), validade='2027-01-01')
+        Produto.objects.filter(id=self.produto.id).update(stock_actual=F('stock_actual') - 5)
+        ItemCompra.objects.create(compra=compra, produto=self.produto, quantidade=5, preco_custo=Decimal('4000.00'), validade='2027-06-01')
+        self.produto.refresh_from_db()
+        # (5*1000 + 5*4000) / 10 = 2500
+        self.assertEqual(self.produto.stock_actual, 10)
+        self.assertEqual(self.produto.preco_custo, Decimal('2500.00'))
+
+    def test_custo_medio_com_parte_decimal(self):
+        compra = Compra.objects.create(fornecedor=self.fornecedor)
+        ItemCompra.objects.create(compra=compra, produto=self.produto, quantidade=1, preco_custo=Decimal('100.00'), validade='2027-01-01')
+        ItemCompra.objects.create(compra=compra, produto=self.produto, quantidade=2, preco_custo=Decimal('101.00'), validade='2027-01-01')
+        self.produto.refresh_from_db()
+        # (100 + 2*101) / 3 = 100.666…: a divisão não pode ser inteira
+        self.assertEqual(self.produto.preco_custo, Decimal('100.67'))
+
+    def test_entradas_em_lote_por_produto(self):
+        from . import compras
+        outro = Produto.objects.create(nome="Tónico", marca="Marca X", categoria=self.categoria, preco_venda=Decimal('5000.00'))
+        compra = Compra.objects.create(fornecedor=self.fornecedor)
+        itens = ItemCompra.objects.bulk_create([
+            ItemCompra(compra=compra, produto=self.produto, quantidade=2, preco_custo=Decimal('1000.00'), validade='2027-01-01'),
+            ItemCompra(compra=compra, produto=self.produto, quantidade=1, preco_custo=Decimal('2500.00'), validade='2027-03-01'),
+            ItemCompra(compra=compra, produto=outro, quantidade=4, preco_custo=Decimal('750.00'), validade='2027-01-01'),
+        ])
+        compras.aplicar_entradas(itens, compra.data)
+        self.produto.refresh_from_db()
+        outro.refresh_from_db()
+        self.assertEqual((self.produto.stock_actual, self.produto.preco_custo), (3, Decimal('1500.00')))
+        self.assertEqual((outro.stock_actual, outro.preco_custo), (4, Decimal('750.00')))
+        self.assertEqual(LoteStock.objects.filter(produto=self.produto).count(), 2)
+
+
+class TestCompraEmLote(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Cabelo")
+        self.fornecedor = Fornecedor.objects.create(nome="Fornecedor Lote")
+        self.produtos = [
+            Produto.objects.create(nome=f"Champô {i}", marca="Marca L", categoria=self.categoria, preco_venda=Decimal('5000.00'))
+            for i in range(20)
+        ]
+
+    def linhas(self, n):
+        return [{'id': p.id, 'quantidade': 2, 'preco_custo': '1000.00', 'validade': '2027-01-01', 'lote': f"L{p.id}"}
+                for p in self.produtos[:n]]
+
+    def test_total_stock_e_custo(self):
+        from . import compras
+        compra = compras.registar_compra(self.fornecedor, self.linhas(3) + [
+            {'id': self.produtos[0].id, 'quantidade': 2, 'preco_custo': '2000.00', 'validade': '2027-06-01'},
+        ])
+        self.assertEqual(Compra.objects.get(id=compra.id).valor_total, Decimal('10000.00'))
+        p = Produto.objects.get(id=self.produtos[0].id)
+        self.assertEqual((p.stock_actual, p.preco_custo), (4, Decimal('1500.00')))
+        self.assertEqual(LoteStock.objects.filter(produto=p).count(), 2)
+
+    def test_numero_de_queries_nao_depende_das_linhas(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import compras
+        # A primeira compra do dia ainda cria a linha do ResumoDiario
+        compras.registar_compra(self.fornecedor, self.linhas(1))
+        with CaptureQueriesContext(connection) as pequena:
+            compras.registar_compra(self.fornecedor, self.linhas(2))
+        with CaptureQueriesContext(connection) as grande:
+            compras.registar_compra(self.fornecedor, self.linhas(20))
+        self.assertEqual(len(pequena), len(grande))
+
+    def test_todos_os_erros_sem_gravar(self):
+        from . import compras
+        linhas = self.linhas(2)
+        linhas[0]['quantidade'] = 0
+        linhas[1]['validade'] = ''
+        with self.assertRaises(compras.CompraInvalida) as ctx:
+            compras.registar_compra(self.fornecedor, linhas)
+        self.assertEqual([e['linha'] for e in ctx.exception.erros], [1, 2])
+        self.assertFalse(Compra.objects.exists())
+
+
+class TestImportacaoCompra(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Maquilhagem")
+        self.fornecedor = Fornecedor.objects.create(nome="Fornecedor Import")
+        self.base = Produto.objects.create(nome="Base Líquida", marca="Marca M", categoria=self.categoria, preco_venda=Decimal('6000.00'))
+        self.rimel = Produto.objects.create(nome="Rímel", marca="Marca M", categoria=self.categoria, preco_venda=Decimal('3000.00'))
+        self.user = User.objects.create_superuser(username='admin', password='teste123')
+        self.client.login(username='admin', password='teste123')
+
+    def ficheiro(self, texto, nome='factura.csv'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile(nome, texto.encode('utf-8'))
+
+    def test_importa_csv_por_nome_e_marca(self):
+        from . import importacao
+        ficheiro = self.ficheiro(
+            "Produto;Marca;Qtd;Preço Custo;Validade;Lote\n"
+            "base líquida;MARCA M;10;2000,50;30/06/2027;L1\n"
+            "Rímel;Marca M;4;1000;2027-01-31;\n"
+        )
+        compra = importacao.importar_compra(self.fornecedor, ficheiro)
+        self.assertEqual(compra.num_linhas, 2)
+        self.assertEqual(Compra.objects.get(id=compra.id).valor_total, Decimal('24005.00'))
+        self.base.refresh_from_db()
+        self.assertEqual((self.base.stock_actual, self.base.preco_custo), (10, Decimal('2000.50')))
+        self.assertEqual(LoteStock.objects.get(produto=self.base).validade, date(2027, 6, 30))
+
+    def test_erros_de_todas_as_linhas_sem_gravar(self):
+        ficheiro = self.ficheiro(
+            "nome,marca,quantidade,preco_custo,validade\n"
+            "Base Líquida,Marca M,10,2000,2027-06-30\n"
+            "Pó Compacto,Marca M,5,900,2027-06-30\n"
+            "Rímel,Marca M,-1,1000,2027-01-31\n"
+        )
+        resposta = self.client.post('/compras/importar/', {'fornecedor': self.fornecedor.id, 'ficheiro': ficheiro})
+        self.assertEqual([e['linha'] for e in resposta.context['erros']], [3, 4])
+        self.assertFalse(Compra.objects.exists())
+        self.base.refresh_from_db()
+        self.assertEqual(self.base.stock_actual, 0)
+
+    @skipUnless(importlib.util.find_spec('openpyxl'), "openpyxl não instalado")
+    def test_importa_xlsx(self):
+        import io
+        import openpyxl
+        from . import importacao
+        livro = openpyxl.Workbook()
+        folha = livro.active
+        folha.append(['nome', 'marca', 'quantidade', 'preco_custo', 'validade'])
+        folha.append(['Rímel', 'Marca M', 3, 1200, datetime(2027, 3, 1)])
+        conteudo = io.BytesIO()
+        livro.save(conteudo)
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        compra = importacao.importar_compra(self.fornecedor, SimpleUploadedFile('factura.xlsx', conteudo.getvalue()))
+        self.assertEqual(Compra.objects.get(id=compra.id).valor_total, Decimal('3600.00'))
+        self.rimel.refresh_from_db()
+        self.assertEqual(self.rimel.stock_actual, 3)
+
+
+class TestImportacaoProdutos(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Perfumes")
+        self.existente = Produto.objects.create(nome="Eau Fraîche", marca="Marca F", categoria=self.categoria,
+                                                preco_custo=Decimal('3000.00'), preco_venda=Decimal('5000.00'))
+
+    def ficheiro(self, texto):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile('precos.csv', texto.encode('utf-8'))
+
+    def test_cria_e_actualiza_por_nome_e_marca(self):
+        from . import importacao
+        resultado = importacao.importar_produtos(self.ficheiro(
+            "nome;marca;categoria;preco_venda;stock_minimo\n"
+            "EAU FRAÎCHE;marca f;Perfumes;5500;3\n"
+            "Body Mist;Marca F;Corpo;2500,50;\n"
+            "Loção Corporal;Marca F;corpo;3000;\n"
+        ))
+        self.assertEqual((resultado['criados'], resultado['actualizados'], resultado['total_erros']), (2, 1, 0))
+        self.existente.refresh_from_db()
+        self.assertEqual((self.existente.preco_venda, self.existente.stock_minimo), (Decimal('5500.00'), 3))
+        self.assertEqual(Categoria.objects.filter(nome__iexact='corpo').count(), 1)
+        self.assertEqual(Produto.objects.get(nome="Body Mist").preco_venda, Decimal('2500.50'))
+
+    def test_erros_por_linha_e_restantes_gravados(self):
+        from . import importacao
+        resultado = importacao.importar_produtos(self.ficheiro(
+            "nome,marca,categoria,preco_venda\n"
+            "Eau Fraîche,Marca F,Perfumes,2000\n"
+            "Body Mist,Marca F,Perfumes,2500\n"
+            "body mist,Marca F,Perfumes,2600\n"
+            "Sem Preço,Marca F,Perfumes,\n"
+        ))
+        self.assertEqual([e['linha'] for e in resultado['erros']], [2, 4, 5])
+        self.assertIn("custo", resultado['erros'][0]['mensagem'])
+        self.assertEqual(resultado['criados'], 1)
+        self.existente.refresh_from_db()
+        self.assertEqual(self.existente.preco_venda, Decimal('5000.00'))
+
 
 class TestFEFO(TestCase):
     def setUp(self):
@@ -77,11 +263,13 @@ class TestFEFO(TestCase):
             venda=venda, produto=self.produto,
             quantidade=3, preco_unitario=Decimal('3000.00')
         )
-        lote_antigo = ItemCompra.objects.get(validade='2026-06-01')
-        lote_novo = ItemCompra.objects.get(validade='2027-01-01')
+        lote_antigo = LoteStock.objects.get(validade='2026-06-01')
+        lote_novo = LoteStock.objects.get(validade='2027-01-01')
         # Lote antigo deve ter sido consumido primeiro
         self.assertEqual(lote_antigo.quantidade, 2)
         self.assertEqual(lote_novo.quantidade, 5)
+        # O ItemCompra guarda a quantidade comprada, não o saldo
+        self.assertEqual(ItemCompra.objects.get(validade='2026-06-01').quantidade, 5)
 
     def test_fefo_consome_dois_lotes_se_necessario(self):
         venda = Venda.objects.create(
@@ -92,12 +280,22 @@ class TestFEFO(TestCase):
             venda=venda, produto=self.produto,
             quantidade=7, preco_unitario=Decimal('3000.00')
         )
-        lote_antigo = ItemCompra.objects.get(validade='2026-06-01')
-        lote_novo = ItemCompra.objects.get(validade='2027-01-01')
-        # Lote antigo esgotado, lote novo consumiu 2
-        self.assertEqual(lote_antigo.quantidade, 0)
+        lote_novo = LoteStock.objects.get(validade='2027-01-01')
+        # Lote antigo esgotado (sai da tabela de lotes abertos), lote novo consumiu 2
+        self.assertFalse(LoteStock.objects.filter(validade='2026-06-01').exists())
         self.assertEqual(lote_novo.quantidade, 3)
 
+    def test_ajuste_stock_usa_o_mesmo_motor_fefo(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser(username='gestor', password='teste123')
+        self.client.login(username='gestor', password='teste123')
+        self.client.post('/planeamento/ajuste/', {
+            'produto_id': self.produto.id, 'tipo': 'remover', 'quantidade': 6, 'motivo': 'quebra'
+        })
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 4)
+        self.assertEqual(list(LoteStock.objects.values_list('validade', 'quantidade')), [(date(2027, 1, 1), 4)])
+
 
 class TestValidacaoStock(TestCase):
     def setUp(self):
@@ -121,4 +319,1048 @@ class TestValidacaoStock(TestCase):
             'metodo_pagamento': 'DIN'
         })
         self.produto.refresh_from_db()
-        self.assertGreaterEqual(self.produto.stock_actual, 0)
\ No newline at end of file
+        self.assertGreaterEqual(self.produto.stock_actual, 0)
+
+class TestResumoDiario(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Maquilhagem")
+        self.produto = Produto.objects.create(
+            nome="Batom Teste", marca="Marca R",
+            categoria=self.categoria, preco_venda=Decimal('2500.00')
+        )
+        self.fornecedor = Fornecedor.objects.create(nome="Fornecedor Resumo")
+        self.user = User.objects.create_user(username='caixa', password='teste123')
+        compra = Compra.objects.create(fornecedor=self.fornecedor)
+        ItemCompra.objects.create(
+            compra=compra, produto=self.produto,
+            quantidade=10, preco_custo=Decimal('1000.00'),
+            validade='2027-01-01'
+        )
+
+    def test_resumo_acompanha_movimentos(self):
+        from django.utils import timezone
+        from .models import Despesa, ResumoDiario
+        hoje = timezone.now().date()
+        self.assertEqual(ResumoDiario.objects.get(data=hoje).compras, Decimal('10000.00'))
+
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(
+            venda=venda, produto=self.produto,
+            quantidade=2, preco_unitario=Decimal('2500.00')
+        )
+        despesa = Despesa.objects.create(descricao="Renda", valor=Decimal('300.00'), data=hoje.isoformat())
+
+        resumo = ResumoDiario.objects.get(data=hoje)
+        self.assertEqual(resumo.vendas, Decimal('5000.00'))
+        self.assertEqual(resumo.despesas, Decimal('300.00'))
+
+        despesa.delete()
+        resumo.refresh_from_db()
+        self.assertEqual(resumo.despesas, Decimal('0'))
+
+    def test_resumo_soma_so_a_diferenca(self):
+        from datetime import date
+        from .models import Despesa, ResumoDiario
+        despesa = Despesa.objects.create(descricao="Água", valor=Decimal('100.00'), data=date(2026, 3, 10))
+        # Escrita concorrente simulada: outro pedido já somou ao mesmo dia
+        ResumoDiario.objects.filter(data=date(2026, 3, 10)).update(despesas=Decimal('150.00'))
+        despesa.valor = Decimal('120.00')
+        despesa.save()
+        self.assertEqual(ResumoDiario.objects.get(data=date(2026, 3, 10)).despesas, Decimal('170.00'))
+
+        # Mudança de data: sai do dia antigo e entra no novo
+        despesa.data = date(2026, 3, 11)
+        despesa.save()
+        self.assertEqual(ResumoDiario.objects.get(data=date(2026, 3, 10)).despesas, Decimal('50.00'))
+        self.assertEqual(ResumoDiario.objects.get(data=date(2026, 3, 11)).despesas, Decimal('120.00'))
+
+    def test_reconstruir_coincide_com_tabelas(self):
+        from django.core.management import call_command
+        from .models import ResumoDiario
+        from . import resumos
+        ResumoDiario.objects.update(compras=0)
+        self.assertTrue(resumos.verificar())
+        call_command('reconstruir_resumos', stdout=open('/dev/null', 'w'))
+        self.assertEqual(resumos.verificar(), [])
+
+
+class TestEstatisticaProduto(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Cabelo")
+        self.fornecedor = Fornecedor.objects.create(nome="Fornecedor Giro")
+        self.user = User.objects.create_user(username='giro', password='teste123')
+        self.vendido = Produto.objects.create(
+            nome="Champô", marca="Marca G", categoria=self.categoria, preco_venda=Decimal('2000.00')
+        )
+        self.parado = Produto.objects.create(
+            nome="Máscara", marca="Marca G", categoria=self.categoria, preco_venda=Decimal('2000.00'),
+            preco_custo=Decimal('500.00'), stock_actual=4
+        )
+        compra = Compra.objects.create(fornecedor=self.fornecedor)
+        ItemCompra.objects.create(
+            compra=compra, produto=self.vendido,
+            quantidade=10, preco_custo=Decimal('1000.00'), validade='2027-01-01'
+        )
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=self.vendido, quantidade=3, preco_unitario=Decimal('2000.00'))
+
+    def test_contadores_actualizados_pelos_signals(self):
+        est = self.vendido.estatistica
+        self.assertEqual(est.unidades_vendidas, 3)
+        self.assertEqual(est.num_vendas, 1)
+        self.assertIsNotNone(est.ultima_venda)
+        self.assertIsNotNone(est.ultima_compra)
+
+    def test_status_giro_sem_queries_por_produto(self):
+        produtos = list(Produto.objects.select_related('estatistica').order_by('nome'))
+        with self.assertNumQueries(0):
+            estados = {p.nome: p.status_giro() for p in produtos}
+        self.assertEqual(estados, {"Champô": "Normal", "Máscara": "Estagnado ⚠️"})
+
+    def test_capital_estagnado_coincide_com_status_giro(self):
+        from . import estatisticas
+        esperado = sum(p.valor_total_stock() for p in Produto.objects.all() if p.status_giro() == estatisticas.ESTAGNADO)
+        self.assertEqual(esperado, Decimal('2000.00'))
+        self.assertEqual(estatisticas.capital_estagnado(), esperado)
+
+
+class TestCheckoutEmLote(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Corpo")
+        self.fornecedor = Fornecedor.objects.create(nome="Fornecedor Checkout")
+        self.user = User.objects.create_user(username='checkout', password='teste123')
+        self.produtos = []
+        for i in range(30):
+            p = Produto.objects.create(
+                nome=f"Loção {i}", marca="Marca C", categoria=self.categoria, preco_venda=Decimal('1500.00')
+            )
+            compra = Compra.objects.create(fornecedor=self.fornecedor)
+            ItemCompra.objects.create(compra=compra, produto=p, quantidade=5, preco_custo=Decimal('500.00'), validade='2026-06-01')
+            ItemCompra.objects.create(compra=compra, produto=p, quantidade=5, preco_custo=Decimal('500.00'), validade='2027-01-01')
+            self.produtos.append(p)
+
+    def carrinho(self, n, quantidade=7):
+        return [{'id': p.id, 'quantidade': quantidade} for p in self.produtos[:n]]
+
+    def test_mesmo_resultado_fefo_e_stock(self):
+        from . import vendas
+        venda = vendas.finalizar_venda(self.user, 'DIN', self.carrinho(2))
+        self.assertEqual(venda.valor_total, Decimal('21000.00'))
+        self.assertEqual(Venda.objects.get(id=venda.id).valor_total, Decimal('21000.00'))
+        for p in self.produtos[:2]:
+            p.refresh_from_db()
+            self.assertEqual(p.stock_actual, 3)
+            lotes = list(LoteStock.objects.filter(produto=p).values_list('quantidade', flat=True))
+            self.assertEqual(lotes, [3])
+
+    def test_numero_de_queries_nao_depende_do_carrinho(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import vendas
+        with CaptureQueriesContext(connection) as pequeno:
+            vendas.finalizar_venda(self.user, 'DIN', self.carrinho(3, 1))
+        with CaptureQueriesContext(connection) as grande:
+            vendas.finalizar_venda(self.user, 'DIN', self.carrinho(30, 1))
+        self.assertEqual(len(pequeno), len(grande))
+
+    def test_stock_insuficiente_nao_cria_venda(self):
+        from . import vendas
+        with self.assertRaises(vendas.StockInsuficiente) as ctx:
+            vendas.finalizar_venda(self.user, 'DIN', self.carrinho(1, 11))
+        self.assertEqual(len(ctx.exception.erros), 1)
+        self.assertFalse(Venda.objects.exists())
+
+
+class TestRastreabilidadeLotes(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Solares")
+        self.produto = Produto.objects.create(
+            nome="Protector", marca="Marca S", categoria=self.categoria, preco_venda=Decimal('4000.00')
+        )
+        self.user = User.objects.create_user(username='rastreio', password='teste123')
+        compra = Compra.objects.create(fornecedor=Fornecedor.objects.create(nome="Fornecedor Lotes"))
+        self.lote_a = ItemCompra.objects.create(
+            compra=compra, produto=self.produto, quantidade=4,
+            preco_custo=Decimal('2000.00'), validade='2026-09-01', lote='LA'
+        )
+        self.lote_b = ItemCompra.objects.create(
+            compra=compra, produto=self.produto, quantidade=10,
+            preco_custo=Decimal('2000.00'), validade='2027-03-01', lote='LB'
+        )
+
+    def test_alocacoes_registadas_por_linha(self):
+        from .models import AlocacaoLote
+        from . import vendas
+        venda = vendas.finalizar_venda(self.user, 'DIN', [
+            {'id': self.produto.id, 'quantidade': 3},
+            {'id': self.produto.id, 'quantidade': 3},
+        ])
+        alocacoes = list(
+            AlocacaoLote.objects.filter(item_venda__venda=venda)
+            .order_by('item_venda_id', 'item_compra__validade')
+            .values_list('item_compra__lote', 'quantidade')
+        )
+        self.assertEqual(alocacoes, [('LA', 3), ('LA', 1), ('LB', 2)])
+
+    def test_relatorio_de_recolha(self):
+        from . import vendas
+        venda = vendas.finalizar_venda(self.user, 'DIN', [{'id': self.produto.id, 'quantidade': 5}])
+        self.client.login(username='rastreio', password='teste123')
+        resposta = self.client.get('/rastreabilidade/', {'lote': 'LB', 'venda': venda.id})
+        self.assertEqual([a.item_venda.venda_id for a in resposta.context['vendas_do_lote']], [venda.id])
+        self.assertEqual(len(resposta.context['lotes_da_venda']), 2)
+
+
+class TestApiVenda(TestCase):
+    def setUp(self):
+        import json
+        self.json = json
+        self.categoria = Categoria.objects.create(nome="Unhas")
+        self.produto = Produto.objects.create(
+            nome="Verniz", marca="Marca V", categoria=self.categoria,
+            preco_venda=Decimal('1200.00'), stock_actual=5
+        )
+        User.objects.create_user(username='pdv', password='teste123')
+        self.client.login(username='pdv', password='teste123')
+
+    def post(self, quantidade, chave='abc-123'):
+        return self.client.post('/api/vendas/', self.json.dumps({
+            'chave': chave, 'metodo_pagamento': 'TPA',
+            'itens': [{'id': self.produto.id, 'quantidade': quantidade}],
+        }), content_type='application/json')
+
+    def test_pedido_repetido_devolve_a_mesma_venda(self):
+        primeira = self.post(2)
+        repetida = self.post(2)
+        self.assertEqual(primeira.status_code, 201)
+        self.assertEqual(repetida.status_code, 200)
+        self.assertEqual(primeira.json()['venda_id'], repetida.json()['venda_id'])
+        self.assertTrue(repetida.json()['repetida'])
+        self.assertEqual(primeira.json()['valor_total'], '2400.00')
+        self.assertEqual(Venda.objects.count(), 1)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 3)
+
+    def test_corpo_que_nao_e_objecto_e_recusado(self):
+        for corpo in ('[]', '"x"', '3'):
+            with self.subTest(corpo=corpo):
+                resposta = self.client.post('/api/vendas/', corpo, content_type='application/json')
+                self.assertEqual(resposta.status_code, 400)
+
+    def test_chave_so_repete_para_o_mesmo_utilizador(self):
+        primeira = self.post(1)
+        User.objects.create_user(username='pdv2', password='teste123')
+        self.client.login(username='pdv2', password='teste123')
+        outra = self.post(1)
+        self.assertEqual(outra.status_code, 201)
+        self.assertNotEqual(outra.json()['venda_id'], primeira.json()['venda_id'])
+        self.assertEqual(Venda.objects.count(), 2)
+
+    def test_erros_de_stock_por_linha(self):
+        resposta = self.post(9)
+        self.assertEqual(resposta.status_code, 409)
+        erro, = resposta.json()['erros']
+        self.assertEqual((erro['produto_id'], erro['disponivel'], erro['pedido']), (self.produto.id, 5, 9))
+        self.assertFalse(Venda.objects.exists())
+
+
+class TestSincronizacaoOffline(TestCase):
+    def setUp(self):
+        import json
+        self.json = json
+        self.categoria = Categoria.objects.create(nome="Lábios")
+        self.produto = Produto.objects.create(
+            nome="Batom", marca="Marca B", categoria=self.categoria,
+            preco_venda=Decimal('1500.00'), stock_actual=3
+        )
+        User.objects.create_user(username='offline', password='teste123')
+        self.client.login(username='offline', password='teste123')
+
+    def sincronizar(self, *vendas):
+        return self.client.post('/api/vendas/sincronizar/', self.json.dumps({'vendas': [
+            {'chave': chave, 'metodo_pagamento': 'DIN', 'data': data,
+             'itens': [{'id': self.produto.id, 'quantidade': qtd}]}
+            for chave, qtd, data in vendas
+        ]}), content_type='application/json')
+
+    def test_conflito_nao_anula_as_outras_vendas(self):
+        resposta = self.sincronizar(('v1', 2, '2026-01-10T09:30:00'), ('v2', 2, None), ('v3', 1, None))
+        self.assertEqual(resposta.status_code, 200)
+        v1, v2, v3 = resposta.json()['resultados']
+        self.assertTrue(v1['ok'] and v3['ok'])
+        self.assertFalse(v2['ok'])
+        self.assertEqual(v2['erros'][0]['disponivel'], 1)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 0)
+        # A venda fica com a hora em que foi feita no PDV
+        self.assertEqual(Venda.objects.get(id=v1['venda_id']).data, datetime(2026, 1, 10, 9, 30))
+        from .models import ResumoDiario
+        self.assertEqual(ResumoDiario.objects.get(data=date(2026, 1, 10)).vendas, Decimal('3000.00'))
+
+    def test_reenvio_da_fila_e_idempotente(self):
+        self.sincronizar(('v1', 1, None))
+        resposta = self.sincronizar(('v1', 1, None), ('v2', 1, None))
+        v1, v2 = resposta.json()['resultados']
+        self.assertTrue(v1['repetida'])
+        self.assertFalse(v2['repetida'])
+        self.assertEqual(Venda.objects.count(), 2)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 1)
+
+    def test_data_impossivel_e_conflito_so_dessa_venda(self):
+        resposta = self.sincronizar(('v1', 1, '2026-02-30T10:00:00'), ('v2', 1, None))
+        self.assertEqual(resposta.status_code, 200)
+        v1, v2 = resposta.json()['resultados']
+        self.assertFalse(v1['ok'])
+        self.assertIn('Data inválida', v1['erros'][0]['mensagem'])
+        self.assertTrue(v2['ok'])
+        self.assertEqual(Venda.objects.count(), 1)
+
+    def test_corpo_que_nao_e_objecto_e_recusado(self):
+        resposta = self.client.post('/api/vendas/sincronizar/', '[1, 2]', content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        resposta = self.client.post('/api/vendas/sincronizar/', self.json.dumps(
+            {'vendas': [{'chave': 'a', 'metodo_pagamento': 'DIN', 'itens': [5]}]}), content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+
+
+class TestStockCondicional(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Promoções")
+        self.produto = Produto.objects.create(nome="Máscara", marca="Marca P", categoria=self.categoria, preco_venda=Decimal('800.00'))
+        compra = Compra.objects.create(fornecedor=Fornecedor.objects.create(nome="Fornecedor P"))
+        ItemCompra.objects.create(compra=compra, produto=self.produto, quantidade=4, preco_custo=Decimal('300.00'), validade=date(2027, 1, 1))
+        self.user = User.objects.create_user(username='promo', password='teste123')
+
+    def test_venda_sem_bloqueio_baixa_stock_e_lotes(self):
+        from . import vendas
+        vendas.finalizar_venda(self.user, 'DIN', [{'id': self.produto.id, 'quantidade': 3}], condicional=True)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 1)
+        self.assertEqual(LoteStock.objects.get(produto=self.produto).quantidade, 1)
+
+    def test_update_condicional_recusa_sem_stock(self):
+        from . import vendas
+        with self.assertRaises(vendas.StockInsuficiente) as ctx:
+            vendas.finalizar_venda(self.user, 'DIN', [{'id': self.produto.id, 'quantidade': 5}], condicional=True)
+        erro, = ctx.exception.erros
+        self.assertEqual((erro['disponivel'], erro['pedido']), (4, 5))
+        self.assertFalse(Venda.objects.exists())
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.stock_actual, 4)
+
+    def test_baixa_condicional_e_a_primeira_escrita(self):
+        from django.test.utils import CaptureQueriesContext
+        from . import vendas
+        with CaptureQueriesContext(connection) as ctx:
+            vendas.finalizar_venda(self.user, 'DIN', [{'id': self.produto.id, 'quantidade': 1}], condicional=True)
+        escritas = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        # Produto, depois lotes e tabelas globais: a ordem das compras e do admin
+        self.assertTrue(escritas[0].startswith('UPDATE "gestao_produto" SET "stock_actual"'))
+        tabelas = ['gestao_lotestock', 'gestao_estatisticaproduto', 'gestao_movimento', 'gestao_resumodiario']
+        primeira = [next(i for i, sql in enumerate(escritas) if t in sql) for t in tabelas]
+        self.assertEqual(primeira, sorted(primeira))
+
+
+@skipUnless(connection.vendor != 'sqlite', "precisa de escrita concorrente (MySQL/PostgreSQL)")
+class TestStockCondicionalConcorrente(TransactionTestCase):
+    def test_compradores_em_paralelo_nao_vendem_acima_do_stock(self):
+        import threading
+        from django.db import connections
+        from . import vendas
+        categoria = Categoria.objects.create(nome="Promoções")
+        produto = Produto.objects.create(nome="Máscara", marca="Marca P", categoria=categoria, preco_venda=Decimal('800.00'))
+        compra = Compra.objects.create(fornecedor=Fornecedor.objects.create(nome="Fornecedor P"))
+        ItemCompra.objects.create(compra=compra, produto=produto, quantidade=5, preco_custo=Decimal('300.00'), validade=date(2027, 1, 1))
+        user = User.objects.create_user(username='promo')
+        resultados = []
+
+        def comprar():
+            try:
+                vendas.finalizar_venda(user, 'DIN', [{'id': produto.id, 'quantidade': 1}], condicional=True)
+                resultados.append(True)
+            except vendas.StockInsuficiente:
+                resultados.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=comprar) for _ in range(12)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        produto.refresh_from_db()
+        self.assertEqual(resultados.count(True), 5)
+        self.assertEqual(produto.stock_actual, 0)
+        self.assertFalse(LoteStock.objects.filter(produto=produto).exists())
+
+
+class TestExtratoKeyset(TestCase):
+    def setUp(self):
+        from .models import Despesa, ReceitaExtra
+        self.user = User.objects.create_user(username='caixa', password='teste123')
+        for i in range(4):
+            dia = date(2026, 3, 1 + i)
+            Despesa.objects.create(descricao=f"Renda {i}", valor=Decimal('100.00'), data=dia)
+            ReceitaExtra.objects.create(descricao=f"Serviço {i}", valor=Decimal('50.00'), data=dia)
+            venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN', valor_total=Decimal('300.00'))
+            Venda.objects.filter(id=venda.id).update(data=datetime(2026, 3, 1 + i, 10, 0))
+        # Os signals do resumo e do diário usam a data de criação; repor a partir das tabelas
+        from . import resumos, diario
+        resumos.reconstruir()
+        diario.reconstruir()
+
+    def todas(self, **filtros):
+        from . import extrato
+        linhas, depois = [], None
+        while True:
+            pagina, _, depois = extrato.pagina(depois=depois, por_pagina=5, **filtros)
+            linhas += pagina
+            if depois is None:
+                return linhas
+
+    def test_paginas_seguem_a_ordem_do_extrato(self):
+        linhas = self.todas()
+        self.assertEqual(len(linhas), 12)
+        chaves = [(m['momento'], m['id']) for m in linhas]
+        self.assertEqual(chaves, sorted(chaves, reverse=True))
+        self.assertEqual(len(set(chaves)), 12)
+
+    def test_pagina_anterior_e_filtros(self):
+        from . import extrato
+        primeira, _, seguinte = extrato.pagina(por_pagina=5)
+        segunda, anterior, _ = extrato.pagina(depois=seguinte, por_pagina=5)
+        self.assertEqual(extrato.pagina(antes=anterior, por_pagina=5)[0], primeira)
+        saidas = self.todas(tipo='saida', inicio=date(2026, 3, 2), fim=date(2026, 3, 3))
+        self.assertEqual([m['descricao'] for m in saidas], ["Renda 2", "Renda 1"])
+        self.assertEqual(extrato.totais('saida', date(2026, 3, 2), date(2026, 3, 3)), (0, Decimal('200.00')))
+
+    def test_vista_com_cursor(self):
+        self.client.login(username='caixa', password='teste123')
+        resposta = self.client.get('/extrato/', {'tipo': 'entrada'})
+        self.assertEqual(len(resposta.context['movimentacoes']), 8)
+        self.assertEqual(resposta.context['total_entradas'], 1400.0)
+        self.assertIsNone(resposta.context['pagina_seguinte'])
+        # Saldo corrente do diário na linha mais recente: 4 x (300 + 50 - 100)
+        self.assertEqual(resposta.context['movimentacoes'][0]['saldo'], 1000.0)
+        resposta = self.client.get('/extrato/', {'data_inicio': '2026-03-02', 'data_fim': '2026-03-03'})
+        self.assertEqual(resposta.context['saldo_inicial'], 250.0)
+        self.assertEqual(resposta.context['saldo_final'], 750.0)
+
+    def test_saldo_de_cada_linha_com_filtro(self):
+        from . import diario
+        # Saldo depois de cada movimento, pela ordem do extrato, com todas as origens
+        corrente, esperado = Decimal('0'), {}
+        for linha in reversed(self.todas()):
+            corrente += linha['valor']
+            esperado[linha['id']] = corrente
+        self.assertEqual(corrente, diario.saldo_actual())
+        for m in self.todas(tipo='entrada'):
+            self.assertEqual(m['saldo'], esperado[m['id']])
+
+    def test_saldos_da_pagina_so_leem_os_dias_da_pagina(self):
+        from django.test.utils import CaptureQueriesContext
+        from . import extrato
+        # Página filtrada a meio do extrato: a página, os saldos dos seus dias
+        # e os movimentos desses dias, sem somas ao resto do diário
+        _, _, seguinte = extrato.pagina(tipo='saida', por_pagina=2)
+        with CaptureQueriesContext(connection) as ctx:
+            linhas, _, _ = extrato.pagina(tipo='saida', depois=seguinte, por_pagina=2)
+        self.assertEqual([m['saldo'] for m in linhas], [Decimal('150.00'), Decimal('-100.00')])
+        leituras = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(leituras), 3)
+        self.assertFalse([sql for sql in leituras if 'SUM(' in sql])
+
+
+class TestDiarioCaixa(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tesouraria', password='teste123')
+
+    def saldos(self):
+        from . import diario
+        from .models import Movimento
+        linhas = diario.com_saldos(list(Movimento.objects.order_by('-momento', '-id').values('id', 'momento', 'valor')))
+        return [(l['valor'], l['saldo']) for l in reversed(linhas)]
+
+    def test_lancamentos_e_saldo_corrente(self):
+        from . import diario
+        from .models import Despesa, ReceitaExtra
+        hoje = date.today()
+        ReceitaExtra.objects.create(descricao="Serviço", valor=Decimal('500.00'), data=hoje)
+        Despesa.objects.create(descricao="Luz", valor=Decimal('120.00'), data=hoje)
+        Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN', valor_total=Decimal('80.00'))
+        self.assertEqual(self.saldos(), [
+            (Decimal('500.00'), Decimal('500.00')),
+            (Decimal('-120.00'), Decimal('380.00')),
+            (Decimal('80.00'), Decimal('460.00')),
+        ])
+        self.assertEqual(diario.saldo_actual(), Decimal('460.00'))
+        self.assertEqual(diario.verificar(), [])
+
+    def test_correccao_e_anulacao(self):
+        from . import diario
+        from .models import Despesa, Movimento
+        despesa = Despesa.objects.create(descricao="Água", valor=Decimal('100.00'), data=date(2026, 3, 10))
+        despesa.valor = Decimal('150.00')
+        despesa.save()
+        despesa.data = date(2026, 3, 12)
+        despesa.save()
+        despesa.delete()
+        descricoes = list(Movimento.objects.order_by('id').values_list('descricao', 'valor'))
+        self.assertEqual(descricoes, [
+            ("Água", Decimal('-100.00')),
+            ("Correcção — Água", Decimal('-50.00')),
+            ("Anulação — Água", Decimal('150.00')),
+            ("Água", Decimal('-150.00')),
+            ("Anulação — Água", Decimal('150.00')),
+        ])
+        self.assertEqual(diario.saldo_actual(), Decimal('0'))
+        self.assertEqual(diario.verificar(), [])
+
+    def test_movimento_com_data_passada_nao_reescreve_linhas(self):
+        from django.test.utils import CaptureQueriesContext
+        from . import diario
+        from .models import Despesa, ReceitaExtra
+        ReceitaExtra.objects.create(descricao="Dia 5", valor=Decimal('200.00'), data=date(2026, 3, 5))
+        ReceitaExtra.objects.create(descricao="Dia 9", valor=Decimal('300.00'), data=date(2026, 3, 9))
+        with CaptureQueriesContext(connection) as ctx:
+            Despesa.objects.create(descricao="Dia 7", valor=Decimal('50.00'), data=date(2026, 3, 7))
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "gestao_movimento"')])
+        self.assertEqual([s for _, s in self.saldos()], [Decimal('200.00'), Decimal('150.00'), Decimal('450.00')])
+        self.assertEqual(diario.verificar(), [])
+        self.assertEqual(diario.reconstruir(), 3)
+        self.assertEqual([s for _, s in self.saldos()], [Decimal('200.00'), Decimal('150.00'), Decimal('450.00')])
+
+    def test_saldo_em_data(self):
+        from . import diario
+        from .models import Despesa, ReceitaExtra
+        ReceitaExtra.objects.create(descricao="Dia 5", valor=Decimal('200.00'), data=date(2026, 3, 5))
+        Despesa.objects.create(descricao="Dia 7", valor=Decimal('50.00'), data=date(2026, 3, 7))
+        # Só o ponto de controlo mais próximo, sem somar o diário
+        with self.assertNumQueries(1):
+            self.assertEqual(diario.saldo_em(date(2026, 3, 6)), Decimal('200.00'))
+        self.assertEqual(diario.saldo_em(date(2026, 3, 4)), Decimal('0'))
+        self.assertEqual(diario.saldo_em(date(2026, 3, 7)), Decimal('150.00'))
+        self.assertEqual(diario.saldo_em(date(2026, 12, 31)), diario.saldo_actual())
+
+    def test_movimento_com_data_passada_acerta_pontos_de_controlo_seguintes(self):
+        from . import diario
+        from .models import Despesa, ReceitaExtra, SaldoDiario
+        ReceitaExtra.objects.create(descricao="Dia 5", valor=Decimal('200.00'), data=date(2026, 3, 5))
+        ReceitaExtra.objects.create(descricao="Dia 9", valor=Decimal('300.00'), data=date(2026, 3, 9))
+        Despesa.objects.create(descricao="Dia 7", valor=Decimal('50.00'), data=date(2026, 3, 7))
+        self.assertEqual(list(SaldoDiario.objects.order_by('data').values_list('data', 'saldo')), [
+            (date(2026, 3, 5), Decimal('200.00')),
+            (date(2026, 3, 7), Decimal('150.00')),
+            (date(2026, 3, 9), Decimal('450.00')),
+        ])
+        SaldoDiario.objects.filter(data=date(2026, 3, 9)).update(saldo=0)
+        problemas = diario.verificar()
+        self.assertEqual(len(problemas), 1)
+        self.assertTrue(problemas[0].startswith("SaldoDiario 2026-03-09"))
+        diario.reconstruir()
+        self.assertEqual(diario.verificar(), [])
+
+    def test_venda_no_admin_lanca_uma_vez(self):
+        from .models import Movimento
+        categoria = Categoria.objects.create(nome="Cabelo")
+        produto = Produto.objects.create(nome="Champô", marca="Marca C", categoria=categoria, preco_venda=Decimal('700.00'), stock_actual=10)
+        outro = Produto.objects.create(nome="Condicionador", marca="Marca C", categoria=categoria, preco_venda=Decimal('900.00'), stock_actual=10)
+        admin = User.objects.create_superuser(username='admin_caixa', password='teste123')
+        self.client.login(username='admin_caixa', password='teste123')
+        resposta = self.client.post('/admin/gestao/venda/add/', {
+            'metodo_pagamento': 'DIN', 'utilizador': admin.id, 'valor_total': '0',
+            'itens-TOTAL_FORMS': '2', 'itens-INITIAL_FORMS': '0', 'itens-MIN_NUM_FORMS': '0', 'itens-MAX_NUM_FORMS': '1000',
+            'itens-0-produto': produto.id, 'itens-0-quantidade': '2', 'itens-0-preco_unitario': '700.00',
+            'itens-1-produto': outro.id, 'itens-1-quantidade': '1', 'itens-1-preco_unitario': '900.00',
+        })
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(list(Movimento.objects.filter(origem='V').values_list('valor', flat=True)), [Decimal('2300.00')])
+
+
+class TestCatalogoPDV(TestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nome="Fragrâncias")
+        # A versão do catálogo só é atribuída depois do commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a = Produto.objects.create(nome="Colónia", marca="Marca K", categoria=self.categoria, preco_venda=Decimal('900.00'), stock_actual=3)
+            self.b = Produto.objects.create(nome="Eau de Parfum", marca="Marca K", categoria=self.categoria, preco_venda=Decimal('9000.00'), stock_actual=2)
+        self.user = User.objects.create_user(username='catalogo', password='teste123')
+        self.client.login(username='catalogo', password='teste123')
+
+    def test_snapshot_com_etag(self):
+        resposta = self.client.get('/api/catalogo/')
+        dados = resposta.json()
+        self.assertEqual(len(dados['produtos']), 2)
+        self.assertEqual(dados['campos'], ['id', 'nome', 'marca', 'preco_venda', 'stock_actual'])
+        repetido = self.client.get('/api/catalogo/', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(repetido.status_code, 304)
+
+    def test_diferencas_desde_versao(self):
+        from . import vendas
+        versao = self.client.get('/api/catalogo/').json()['versao']
+        with self.captureOnCommitCallbacks(execute=True):
+            vendas.finalizar_venda(self.user, 'DIN', [{'id': self.a.id, 'quantidade': 1}])
+            removido_id = self.b.id
+            self.b.delete()
+        dados = self.client.get('/api/catalogo/', {'desde': versao}).json()
+        self.assertFalse(dados['completo'])
+        self.assertEqual(dados['produtos'], [[self.a.id, "Colónia", "Marca K", '900.00', 2]])
+        self.assertEqual(dados['removidos'], [removido_id])
+        self.assertGreater(dados['versao'], versao)
+
+    def test_versao_no_produto_sem_crescer_o_registo(self):
+        from . import vendas, catalogo
+        from .models import AlteracaoCatalogo
+        with self.captureOnCommitCallbacks(execute=True):
+            vendas.finalizar_venda(self.user, 'DIN', [{'id': self.a.id, 'quantidade': 1}])
+            vendas.finalizar_venda(self.user, 'DIN', [{'id': self.a.id, 'quantidade': 1}])
+        # Só as remoções ficam registadas; a versão do produto é a da última alteração
+        self.assertFalse(AlteracaoCatalogo.objects.exists())
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.versao, catalogo.versao_actual())
+        self.assertEqual([l[0] for l in catalogo.diferencas(self.a.versao - 1)['produtos']], [self.a.id])
+        self.assertEqual(catalogo.diferencas(self.a.versao)['produtos'], [])
+
+    def test_versao_atribuida_depois_do_commit(self):
+        from django.test.utils import CaptureQueriesContext
+        from . import vendas, catalogo
+        antes = catalogo.versao_actual()
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks() as callbacks:
+                vendas.finalizar_venda(self.user, 'DIN', [{'id': self.a.id, 'quantidade': 1}])
+        # O checkout não toca na linha da versão; fica para depois do commit
+        self.assertFalse([q for q in ctx.captured_queries if 'gestao_versaocatalogo' in q['sql']])
+        self.assertEqual(catalogo.versao_actual(), antes)
+        for callback in callbacks:
+            callback()
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.versao, catalogo.versao_actual())
+        self.assertGreater(self.a.versao, antes)
+
+
+class TestRelatoriosPorSeparador(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='gerente', password='teste123')
+        self.client.login(username='gerente', password='teste123')
+        categoria = Categoria.objects.create(nome="Unhas")
+        self.produto = Produto.objects.create(nome="Verniz", marca="Marca R", categoria=categoria, preco_venda=Decimal('800.00'), stock_actual=0, stock_minimo=2)
+
+    def test_resultado_em_cache_ate_os_dados_mudarem(self):
+        from . import relatorios
+        from .models import Despesa
+        Despesa.objects.create(descricao="Renda", valor=Decimal('100.00'), data=date.today())
+        self.assertEqual(relatorios.contexto('financeiro', {})['total_custos'], 100.0)
+        # Em cache: só as leituras da versão dos dados
+        with self.assertNumQueries(3):
+            self.assertEqual(relatorios.contexto('financeiro', {})['total_custos'], 100.0)
+        Despesa.objects.create(descricao="Luz", valor=Decimal('50.00'), data=date.today())
+        self.assertEqual(relatorios.contexto('financeiro', {})['total_custos'], 150.0)
+        # Alteração de stock (sem movimento de caixa) também invalida o inventário
+        self.assertEqual(len(relatorios.contexto('inventario', {})['stock_critico']), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.stock_actual = 5
+            self.produto.save()
+        self.assertEqual(relatorios.contexto('inventario', {})['stock_critico'], [])
+
+    def test_fragmento_so_do_separador_pedido(self):
+        resposta = self.client.get('/relatorios/', {'tab': 'inventario', 'fragmento': 1})
+        nomes = [t.name for t in resposta.templates]
+        self.assertIn('relatorios/inventario.html', nomes)
+        self.assertNotIn('relatorios.html', nomes)
+        self.assertNotIn('relatorios/vendas.html', nomes)
+        self.assertNotIn('total_vendas_filtrado', resposta.context)
+        pagina = self.client.get('/relatorios/', {'tab': 'vendas'})
+        self.assertContains(pagina, 'id="relatorio-conteudo"')
+        self.assertEqual(pagina.context['exportar'], 'exportar_vendas')
+
+
+class TestResultadoMensal(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .models import Despesa, ReceitaExtra
+        from . import resumos
+        cache.clear()
+        self.user = User.objects.create_user(username='contabilista', password='teste123')
+        self.client.login(username='contabilista', password='teste123')
+        for ano in range(2021, 2026):
+            for mes in range(1, 13):
+                ReceitaExtra.objects.create(descricao="Serviço", valor=Decimal('200.00'), data=date(ano, mes, 5))
+                Despesa.objects.create(descricao="Renda", valor=Decimal('50.00'), data=date(ano, mes, 6))
+        resumos.reconstruir()
+
+    def test_serie_mensal_num_numero_fixo_de_queries(self):
+        from . import relatorios
+        # Cinco anos: versão dos dados (3), fechos (2) e um GROUP BY, sem queries por mês
+        with self.assertNumQueries(6):
+            meses = relatorios.mensal()
+        self.assertEqual(len(meses), 60)
+        self.assertEqual(meses[0]['mes'], date(2025, 12, 1))
+        self.assertEqual((meses[0]['vendas'], meses[0]['saidas'], meses[0]['lucro'], meses[0]['margem']), (200.0, 50.0, 150.0, 75.0))
+        self.assertEqual(len(relatorios.mensal('2023')), 12)
+        with self.assertNumQueries(3):
+            relatorios.mensal()
+
+    def test_exportacoes_usam_a_mesma_serie(self):
+        resposta = self.client.get('/relatorios/exportar/')
+        linhas = resposta.content.decode('utf-8-sig').strip().splitlines()
+        self.assertEqual(len(linhas), 61)
+        self.assertEqual(linhas[1].split(',')[1:], ['200.0', '50.0', '150.0', '75.0'])
+        # PDF e Word passam pela fila: o worker gera-os a partir da mesma série
+        from . import exportacoes
+        for formato in ('pdf', 'word'):
+            tarefa = exportacoes.pedir('relatorio', formato)
+            self.assertTrue(exportacoes.executar(exportacoes.reservar()))
+            tarefa.refresh_from_db()
+            self.assertEqual((tarefa.estado, tarefa.progresso), ('C', 100))
+
+
+class TestFechoMes(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .models import Despesa, ReceitaExtra
+        from . import resumos
+        cache.clear()
+        self.user = User.objects.create_user(username='dono', password='teste123', is_superuser=True)
+        self.client.login(username='dono', password='teste123')
+        self.receita = ReceitaExtra.objects.create(descricao="Serviço", valor=Decimal('500.00'), data=date(2025, 1, 10))
+        self.despesa = Despesa.objects.create(descricao="Renda", valor=Decimal('200.00'), data=date(2025, 1, 15))
+        ReceitaExtra.objects.create(descricao="Serviço", valor=Decimal('300.00'), data=date(2025, 2, 10))
+        resumos.reconstruir()
+
+    def test_fechar_por_ordem_e_fotografia(self):
+        from django.core.exceptions import ValidationError
+        from . import fechos
+        with self.assertRaises(ValidationError):
+            fechos.fechar_mes(date(2025, 2, 1))
+        fecho = fechos.fechar_mes(date(2025, 1, 20), self.user)
+        self.assertEqual((fecho.mes, fecho.receitas, fecho.custos, fecho.lucro), (date(2025, 1, 1), Decimal('500.00'), Decimal('200.00'), Decimal('300.00')))
+        self.assertEqual(fechos.proximo_a_fechar(), date(2025, 2, 1))
+        with self.assertRaises(ValidationError):
+            fechos.fechar_mes(date(2025, 1, 1))
+
+    def test_mes_fechado_nao_pode_ser_alterado(self):
+        from .models import Despesa
+        from . import fechos
+        fechos.fechar_mes(date(2025, 1, 1))
+        self.despesa.valor = Decimal('1.00')
+        with self.assertRaises(fechos.PeriodoFechado):
+            self.despesa.save()
+        # delete() corre num atomic sem savepoint: dar-lhe um para o teste continuar
+        with self.assertRaises(fechos.PeriodoFechado), transaction.atomic():
+            self.receita.delete()
+        # Mudar para um mês fechado também é bloqueado
+        fevereiro = Despesa.objects.create(descricao="Luz", valor=Decimal('10.00'), data=date(2025, 2, 3))
+        fevereiro.data = date(2025, 1, 30)
+        with self.assertRaises(fechos.PeriodoFechado):
+            fevereiro.save()
+        resposta = self.client.post('/despesas/nova/', {'descricao': "Atrasada", 'valor': '5', 'data': '2025-01-31'}, follow=True)
+        self.assertContains(resposta, "está fechado")
+        self.assertFalse(Despesa.objects.filter(descricao="Atrasada").exists())
+
+    def test_admin_mostra_mes_fechado_no_formulario(self):
+        from .models import Despesa
+        from . import fechos
+        fechos.fechar_mes(date(2025, 1, 1))
+        self.user.is_staff = True
+        self.user.save()
+        resposta = self.client.post(f'/admin/gestao/despesa/{self.despesa.id}/change/',
+                                    {'descricao': "Renda", 'valor': '1.00', 'data': '2025-01-15'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertContains(resposta, "está fechado")
+        self.assertEqual(Despesa.objects.get(id=self.despesa.id).valor, Decimal('200.00'))
+        resposta = self.client.post(f'/admin/gestao/despesa/{self.despesa.id}/delete/', {'post': 'yes'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertContains(resposta, "01/2025 fechado")
+        self.assertTrue(Despesa.objects.filter(id=self.despesa.id).exists())
+
+    def test_admin_recusa_remocao_em_cascata_de_mes_fechado(self):
+        from . import fechos
+        categoria = Categoria.objects.create(nome="Corpo")
+        produto = Produto.objects.create(nome="Loção", marca="Marca L", categoria=categoria, preco_venda=Decimal('400.00'), stock_actual=5)
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=produto, quantidade=1, preco_unitario=Decimal('400.00'))
+        Venda.objects.filter(id=venda.id).update(data=datetime(2025, 1, 20, 10, 0))
+        fechos.fechar_mes(date(2025, 1, 1))
+        self.user.is_staff = True
+        self.user.save()
+        resposta = self.client.post(f'/admin/gestao/categoria/{categoria.id}/delete/', {'post': 'yes'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertContains(resposta, f"Venda #{venda.id}")
+        self.assertTrue(Produto.objects.filter(id=produto.id).exists())
+
+    def test_fotografia_com_mais_vendidos_no_separador_financeiro(self):
+        from . import fechos
+        categoria = Categoria.objects.create(nome="Rosto")
+        produto = Produto.objects.create(nome="Sérum", marca="Marca S", categoria=categoria, preco_venda=Decimal('2500.00'), stock_actual=5)
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=produto, quantidade=2, preco_unitario=Decimal('2500.00'))
+        Venda.objects.filter(id=venda.id).update(data=datetime(2025, 1, 20, 10, 0))
+        fecho = fechos.fechar_mes(date(2025, 1, 1))
+        self.assertEqual(fecho.top_produtos, [{'nome': "Sérum", 'marca': "Marca S", 'quantidade': 2, 'receita': '5000.00'}])
+        resposta = self.client.get('/relatorios/', {'tab': 'financeiro'})
+        self.assertContains(resposta, "Mais vendidos:")
+        self.assertContains(resposta, "Sérum (2 un.)")
+
+    def test_relatorio_le_meses_fechados_da_fotografia(self):
+        from .models import FechoMes
+        from . import relatorios
+        resposta = self.client.post('/relatorios/fechar-mes/', {'mes': '2025-01-01'})
+        self.assertEqual(resposta.status_code, 302)
+        # A fotografia é a fonte dos meses fechados
+        FechoMes.objects.filter(mes=date(2025, 1, 1)).update(despesas=Decimal('250.00'))
+        meses = relatorios.mensal()
+        self.assertEqual([(m['mes'], m['saidas'], m['fechado']) for m in meses],
+                         [(date(2025, 2, 1), 0.0, False), (date(2025, 1, 1), 250.0, True)])
+        # O stock gravado é o do momento do fecho e aparece só nos meses fechados
+        self.assertEqual(meses[1]['inventario_no_fecho'], 0.0)
+        self.assertNotIn('inventario_no_fecho', meses[0])
+
+
+class TestPeriodoComIndices(TestCase):
+    def test_periodo_como_intervalo_semiaberto(self):
+        from .models import Despesa
+        from .utils import periodo
+        self.assertEqual(periodo(Venda, '2026-03-01', '2026-03-31'),
+                         {'data__gte': datetime(2026, 3, 1), 'data__lt': datetime(2026, 4, 1)})
+        self.assertEqual(periodo(Despesa, ano='2025', mes='12'),
+                         {'data__gte': date(2025, 12, 1), 'data__lt': date(2026, 1, 1)})
+        self.assertEqual(periodo(Despesa, ano=2025), {'data__gte': date(2025, 1, 1), 'data__lt': date(2026, 1, 1)})
+        self.assertEqual(periodo(Despesa, 'ontem', '', ano='x'), {})
+        # Anos que date() não aceita são ignorados, também com mês
+        self.assertEqual(periodo(Despesa, ano=9999, mes=12), {'data__month': 12})
+        self.assertEqual(periodo(Despesa, ano=-3, mes=5), {'data__month': 5})
+
+    def test_planos_usam_os_indices_das_datas(self):
+        from .models import Despesa, LoteStock
+        from .utils import periodo
+        from . import relatorios
+        consultas = {
+            'venda_data': Venda.objects.filter(**periodo(Venda, '2026-01-01', '2026-01-31')),
+            'compra_data': Compra.objects.filter(**periodo(Compra, ano=2026, mes=1)),
+            'despesa_data': Despesa.objects.filter(**periodo(Despesa, ano=2026)).order_by('-data'),
+            'lotestock_validade': LoteStock.objects.filter(validade__lte=date(2026, 1, 1)).order_by('validade'),
+        }
+        for indice, qs in consultas.items():
+            with self.subTest(indice=indice):
+                self.assertIn(indice, qs.explain())
+        self.assertNotIn('django_datetime_cast_date', str(consultas['venda_data'].query))
+        self.assertNotIn('EXTRACT', str(Despesa.objects.filter(**periodo(Despesa, ano=2026)).query).upper())
+        self.assertEqual(relatorios.vendas(v_data_inicio='2026-01-01')['num_vendas'], 0)
+
+
+class TestClassificacaoABC(TestCase):
+    def test_pareto_e_regularidade(self):
+        from . import classificacao
+        # 700 + 200 = 90% da receita: o segundo atravessa os 80% e ainda é A
+        self.assertEqual(list(classificacao.classes_abc([200, 700, 60, 40, 0])), ['A', 'A', 'B', 'C', 'C'])
+        self.assertEqual(list(classificacao.classes_abc([0, 0])), ['C', 'C'])
+        self.assertEqual(list(classificacao.classes_xyz([[5, 5, 5, 5], [0, 10, 0, 2], [0, 0, 0, 0]])), ['X', 'Z', 'Z'])
+
+    def test_classificar_guarda_classe_e_sugestoes_filtram_em_sql(self):
+        from django.contrib.auth.models import User
+        from . import classificacao
+        user = User.objects.create_superuser(username='gestor', password='teste123')
+        fornecedor = Fornecedor.objects.create(nome="F")
+        categoria = Categoria.objects.create(nome="Geral")
+        caro = Produto.objects.create(nome="Perfume", marca="M", categoria=categoria, preco_venda=Decimal('90000'), stock_minimo=50)
+        barato = Produto.objects.create(nome="Sabonete", marca="M", categoria=categoria, preco_venda=Decimal('2500'), stock_minimo=50)
+        parado = Produto.objects.create(nome="Verniz", marca="M", categoria=categoria, preco_venda=Decimal('2000'), stock_minimo=50)
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        for p in (caro, barato, parado):
+            ItemCompra.objects.create(compra=compra, produto=p, quantidade=20, preco_custo=Decimal('100'), validade='2030-01-01')
+        venda = Venda.objects.create(utilizador=user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=caro, quantidade=2, preco_unitario=Decimal('90000'))
+        ItemVenda.objects.create(venda=venda, produto=barato, quantidade=10, preco_unitario=Decimal('2500'))
+
+        self.assertEqual(classificacao.classificar(), {'A': 1, 'B': 1, 'C': 1})
+        self.assertEqual([p.classe_abc() for p in Produto.objects.order_by('nome')], ['A', 'B', 'C'])
+        self.client.login(username='gestor', password='teste123')
+        resposta = self.client.get('/')
+        self.assertEqual(resposta.context['abc_counts'], [1, 1, 1])
+        self.assertEqual({p.nome for p in resposta.context['sugestao_compra']}, {'Perfume', 'Sabonete'})
+
+
+class TestPrevisaoProcura(TestCase):
+    def test_procura_e_ponto_de_encomenda_vectorizados(self):
+        import numpy as np
+        from . import previsao
+        vendas = [[2, 2, 2, 2], [0, 0, 0, 8], [0, 0, 0, 0]]
+        self.assertEqual(list(previsao.procura(vendas, 'media')), [2, 2, 0])
+        exponencial = previsao.procura(vendas)
+        # Constante fica constante; a venda recente pesa mais do que na média
+        self.assertAlmostEqual(exponencial[0], 2)
+        self.assertGreater(exponencial[1], 2)
+        seguranca, ponto, sugerida = previsao.pontos_encomenda(
+            np.array([2.0, 0.0]), np.array([1.0, 0.0]), np.array([4.0, 7.0]), np.array([5, 10]), np.array([3, 5]),
+        )
+        # seguranca = ceil(1.65·1·2) = 4; ponto = 2·4 + 4 = 12; alvo = 2·34 + 4 = 72
+        self.assertEqual((list(seguranca), list(ponto), list(sugerida)), ([4, 0], [12, 5], [67, 0]))
+
+    def test_planeamento_le_sugestoes_por_fornecedor(self):
+        from django.contrib.auth.models import User
+        from . import previsao
+        from .models import PrevisaoProduto
+        user = User.objects.create_superuser(username='gestor', password='teste123')
+        categoria = Categoria.objects.create(nome="Geral")
+        rapido = Fornecedor.objects.create(nome="Rápido", prazo_entrega=2)
+        lento = Fornecedor.objects.create(nome="Lento", prazo_entrega=20)
+        creme = Produto.objects.create(nome="Creme", marca="M", categoria=categoria, preco_venda=Decimal('1000'), stock_minimo=0)
+        serum = Produto.objects.create(nome="Sérum", marca="M", categoria=categoria, preco_venda=Decimal('1000'), stock_minimo=0)
+        for fornecedor, produto in ((rapido, creme), (lento, serum)):
+            compra = Compra.objects.create(fornecedor=fornecedor)
+            ItemCompra.objects.create(compra=compra, produto=produto, quantidade=30, preco_custo=Decimal('100'), validade='2030-01-01')
+        venda = Venda.objects.create(utilizador=user, metodo_pagamento='DIN')
+        for produto in (creme, serum):
+            ItemVenda.objects.create(venda=venda, produto=produto, quantidade=14, preco_unitario=Decimal('1000'))
+
+        # A mesma procura: só o prazo longo do fornecedor lento pede encomenda
+        self.assertEqual(previsao.prever(metodo='media'), 1)
+        self.assertEqual(PrevisaoProduto.objects.get(produto=serum).fornecedor, lento)
+        self.assertEqual(PrevisaoProduto.objects.get(produto=creme).quantidade_sugerida, 0)
+        self.client.login(username='gestor', password='teste123')
+        # Sessão, utilizador, sugestões e a tabela de produtos: não cresce com o catálogo
+        with self.assertNumQueries(4):
+            resposta = self.client.get('/planeamento/')
+        sugestoes = list(resposta.context['sugestoes'])
+        self.assertEqual([(s.fornecedor.nome, s.produto.nome) for s in sugestoes], [('Lento', 'Sérum')])
+        self.assertContains(resposta, 'Lento')
+
+
+class TestAlertasValidade(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_superuser(username='gestor', password='teste123')
+        self.hoje = date.today()
+        categoria = Categoria.objects.create(nome="Geral")
+        fornecedor = Fornecedor.objects.create(nome="F")
+        compra = Compra.objects.create(fornecedor=fornecedor)
+        self.produtos = {}
+        for nome, dias in (("Vencido", -1), ("Trinta", 10), ("Sessenta", 45), ("Longe", 200)):
+            produto = Produto.objects.create(nome=nome, marca="M", categoria=categoria, preco_venda=Decimal('1000'))
+            ItemCompra.objects.create(compra=compra, produto=produto, quantidade=3, preco_custo=Decimal('100'),
+                                      validade=self.hoje + timedelta(days=dias), lote=f"L-{nome}")
+            self.produtos[nome] = produto
+
+    def test_varredura_classifica_lotes_e_esgotados_saem(self):
+        from . import lotes
+        from .models import AlertaValidade
+        self.assertEqual(lotes.varrer_validades(), {'V': 1, '30': 1, '60': 1})
+        self.assertEqual(dict(AlertaValidade.objects.values_list('produto__nome', 'faixa')),
+                         {'Vencido': 'V', 'Trinta': '30', 'Sessenta': '60'})
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=self.produtos['Trinta'], quantidade=3, preco_unitario=Decimal('1000'))
+        # O lote esgotou e o alerta saiu com ele, sem esperar pela próxima varredura
+        self.assertFalse(AlertaValidade.objects.filter(produto__nome='Trinta').exists())
+
+    def test_painel_relatorios_e_admin_leem_a_lista(self):
+        from . import lotes, relatorios
+        lotes.varrer_validades()
+        self.client.login(username='gestor', password='teste123')
+        painel = self.client.get('/')
+        self.assertEqual([a.produto.nome for a in painel.context['alertas_validade']], ['Vencido', 'Trinta'])
+        self.assertEqual([(a['produto__nome'], a['quantidade']) for a in relatorios.inventario()['alertas_validade']],
+                         [('Vencido', 3), ('Trinta', 3), ('Sessenta', 3)])
+        # A validade de todas as linhas vem na mesma query: não há uma query por produto
+        with self.assertNumQueries(5):
+            admin = self.client.get('/admin/gestao/produto/')
+        self.assertContains(admin, 'VENCIDO')
+        self.assertContains(admin, 'FEFO')
+        self.assertContains(admin, (self.hoje + timedelta(days=45)).strftime('%d/%m/%y'))
+        # Fora da lista de alertas (mais de 60 dias) continua a mostrar a data
+        self.assertContains(admin, (self.hoje + timedelta(days=200)).strftime('%d/%m/%y'))
+
+
+class TestExportacoesCSVStreaming(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_superuser(username='gestor', password='teste123')
+        categoria = Categoria.objects.create(nome="Geral")
+        fornecedor = Fornecedor.objects.create(nome="Fornecedor Lda")
+        self.produtos = [
+            Produto.objects.create(nome=f"Produto {n}", marca="M", categoria=categoria, preco_venda=Decimal('1000'))
+            for n in range(3)
+        ]
+        for produto in self.produtos:
+            compra = Compra.objects.create(fornecedor=fornecedor)
+            ItemCompra.objects.create(compra=compra, produto=produto, quantidade=10, preco_custo=Decimal('100'),
+                                      validade='2030-01-01', lote='L1')
+        for produto in self.produtos:
+            venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='TPA')
+            ItemVenda.objects.create(venda=venda, produto=produto, quantidade=2, preco_unitario=Decimal('1500'))
+        self.client.login(username='gestor', password='teste123')
+
+    def test_vendas_e_compras_em_streaming_numa_query(self):
+        for url, linha in (
+            ('/vendas/exportar/', ['Produto 2', '2', '1500.00', '3000.00', 'TPA', '3000.00']),
+            ('/compras/exportar/', ['Produto 2', '10', '100.00', '01/01/2030', 'L1', '1000.00']),
+        ):
+            with self.subTest(url=url):
+                # Sessão, utilizador e uma só query, seja qual for o número de linhas
+                with self.assertNumQueries(3):
+                    resposta = self.client.get(url)
+                    self.assertTrue(resposta.streaming)
+                    texto = b''.join(resposta.streaming_content).decode('utf-8')
+                linhas = list(csv.reader(texto.lstrip('\ufeff').splitlines()))
+                self.assertEqual(len(linhas), 4)
+                self.assertEqual(linhas[1][3:], linha)
+
+    def test_leitura_por_chave_em_blocos(self):
+        from .utils import em_lotes
+        # Pela chave da própria tabela (índice da FK), sem ordenar pela data juntada
+        ordem = ['-venda_id', '-id']
+        esperado = list(ItemVenda.objects.order_by(*ordem).values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            lidos = [i['id'] for i in em_lotes(ItemVenda.objects.all(), ordem, ['quantidade'], 2)]
+        self.assertEqual(lidos, esperado)
+
+
+class TestFilaExportacoes(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_superuser(username='gestor', password='teste123')
+        categoria = Categoria.objects.create(nome="Geral")
+        produto = Produto.objects.create(nome="Creme", marca="M", categoria=categoria, preco_venda=Decimal('1000'))
+        compra = Compra.objects.create(fornecedor=Fornecedor.objects.create(nome="F"))
+        ItemCompra.objects.create(compra=compra, produto=produto, quantidade=5, preco_custo=Decimal('100'), validade='2030-01-01')
+        venda = Venda.objects.create(utilizador=self.user, metodo_pagamento='DIN')
+        ItemVenda.objects.create(venda=venda, produto=produto, quantidade=1, preco_unitario=Decimal('1000'))
+        self.client.login(username='gestor', password='teste123')
+
+    def test_pedidos_iguais_pendentes_juntam_se(self):
+        from . import exportacoes
+        from .models import TarefaExportacao
+        primeira = self.client.get('/vendas/exportar/pdf/')
+        segunda = self.client.get('/vendas/exportar/pdf/')
+        tarefa = TarefaExportacao.objects.get()
+        self.assertRedirects(primeira, f'/exportacoes/{tarefa.id}/')
+        self.assertEqual(segunda['Location'], primeira['Location'])
+        self.assertEqual(self.client.get(f'/exportacoes/{tarefa.id}/?formato=json').json()['na_fila'], 1)
+        # Outro formato é outra tarefa; depois de o worker pegar na tarefa, um pedido igual também
+        self.assertNotEqual(exportacoes.pedir('vendas', 'word').id, tarefa.id)
+        self.assertEqual(exportacoes.reservar().id, tarefa.id)
+        self.assertNotEqual(exportacoes.pedir('vendas', 'pdf').id, tarefa.id)
+        # Tarefa presa num worker que parou é dada como falhada
+        TarefaExportacao.objects.filter(id=tarefa.id).update(iniciado_em=datetime(2026, 1, 1))
+        exportacoes.reservar()
+        self.assertEqual(TarefaExportacao.objects.get(id=tarefa.id).estado, 'F')
+
+    def test_worker_gera_os_ficheiros_para_descarregar_depois(self):
+        from django.core.management import call_command
+        from .models import TarefaExportacao
+        urls = ['/vendas/exportar/pdf/', '/compras/exportar/word/', '/extrato/exportar/pdf/', '/relatorios/exportar/word/']
+        tarefas = [int(self.client.get(url)['Location'].rstrip('/').rsplit('/', 1)[1]) for url in urls]
+        self.assertEqual(self.client.get(f'/exportacoes/{tarefas[0]}/ficheiro/').status_code, 404)
+        call_command('processar_exportacoes', uma_vez=True, stdout=io.StringIO())
+
+        self.assertEqual(set(TarefaExportacao.objects.values_list('estado', 'progresso')), {('C', 100)})
+        estado = self.client.get(f'/exportacoes/{tarefas[0]}/?formato=json').json()
+        self.assertEqual(estado['descarregar'], f'/exportacoes/{tarefas[0]}/ficheiro/')
+        for tarefa_id, inicio, nome in zip(tarefas, (b'%PDF', b'PK', b'%PDF', b'PK'),
+                                           ('historico_vendas.pdf', 'historico_compras.docx', 'extrato_caixa.pdf', 'relatorios_mensais.docx')):
+            resposta = self.client.get(f'/exportacoes/{tarefa_id}/ficheiro/')
+            self.assertTrue(resposta.content.startswith(inicio))
+            self.assertIn(nome, resposta['Content-Disposition'])
+        self.assertContains(self.client.get(f'/exportacoes/{tarefas[0]}/'), 'Descarregar historico_vendas.pdf')
@@ -8,10 +8,15 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     
     path('venda/', views.registrar_venda, name='registrar_venda'),
+    path('api/vendas/', views.api_registar_venda, name='api_registar_venda'),
+    path('api/vendas/sincronizar/', views.api_sincronizar_vendas, name='api_sincronizar_vendas'),
+    path('api/catalogo/', views.api_catalogo, name='api_catalogo'),
     path('vendas/', views.lista_vendas, name='lista_vendas'),
     path('venda/<int:venda_id>/fatura/', views.ver_fatura, name='ver_fatura'),
     path('relatorios/', views.relatorios, name='relatorios'),
+    path('relatorios/fechar-mes/', views.fechar_mes, name='fechar_mes'),
     path('extrato/', views.extrato_caixa, name='extrato_caixa'),
+    path('rastreabilidade/', views.rastreabilidade, name='rastreabilidade'),
 
     path('produtos/', views.lista_produtos, name='lista_produtos'),
     path('planeamento/', views.planeamento_compras, name='planeamento_compras'),
@@ -20,20 +25,24 @@ urlpatterns = [
     path('despesas/nova/', views.add_despesa, name='add_despesa'),
     path('receitas/nova/', views.add_receita, name='add_receita'),
     path('produtos/novo/', views.add_produto, name='add_produto'),
+    path('produtos/importar/', views.importar_produtos, name='importar_produtos'),
     path('produtos/<int:produto_id>/editar/', views.editar_produto, name='editar_produto'),
     path('compras/nova/', views.add_compra, name='add_compra'),
+    path('compras/importar/', views.importar_compra, name='importar_compra'),
     path('planeamento/ajuste/', views.ajuste_stock, name='ajuste_stock'),
     path('compras/', views.lista_compras, name='lista_compras'),
     path('compras/exportar/', views.exportar_compras_csv, name='exportar_compras_csv'),
     path('vendas/exportar/', views.exportar_vendas_csv, name='exportar_vendas_csv'),
     path('extrato/exportar/', views.exportar_extrato_csv, name='exportar_extrato_csv'), 
     path('relatorios/exportar/', views.exportar_relatorio_csv, name='exportar_relatorio_csv'),
-    path('vendas/exportar/pdf/', views.exportar_vendas_pdf, name='exportar_vendas_pdf'),
-    path('compras/exportar/pdf/', views.exportar_compras_pdf, name='exportar_compras_pdf'),
-    path('extrato/exportar/pdf/', views.exportar_extrato_pdf, name='exportar_extrato_pdf'),
-    path('relatorios/exportar/pdf/', views.exportar_relatorio_pdf, name='exportar_relatorio_pdf'),
-    path('vendas/exportar/word/', views.exportar_vendas_word, name='exportar_vendas_word'),
-    path('compras/exportar/word/', views.exportar_compras_word, name='exportar_compras_word'),
-    path('extrato/exportar/word/', views.exportar_extrato_word, name='exportar_extrato_word'),
-    path('relatorios/exportar/word/', views.exportar_relatorio_word, name='exportar_relatorio_word'),
+    path('vendas/exportar/pdf/', views.pedir_exportacao, {'documento': 'vendas', 'formato': 'pdf'}, name='exportar_vendas_pdf'),
+    path('compras/exportar/pdf/', views.pedir_exportacao, {'documento': 'compras', 'formato': 'pdf'}, name='exportar_compras_pdf'),
+    path('extrato/exportar/pdf/', views.pedir_exportacao, {'documento': 'extrato', 'formato': 'pdf'}, name='exportar_extrato_pdf'),
+    path('relatorios/exportar/pdf/', views.pedir_exportacao, {'documento': 'relatorio', 'formato': 'pdf'}, name='exportar_relatorio_pdf'),
+    path('vendas/exportar/word/', views.pedir_exportacao, {'documento': 'vendas', 'formato': 'word'}, name='exportar_vendas_word'),
+    path('compras/exportar/word/', views.pedir_exportacao, {'documento': 'compras', 'formato': 'word'}, name='exportar_compras_word'),
+    path('extrato/exportar/word/', views.pedir_exportacao, {'documento': 'extrato', 'formato': 'word'}, name='exportar_extrato_word'),
+    path('relatorios/exportar/word/', views.pedir_exportacao, {'documento': 'relatorio', 'formato': 'word'}, name='exportar_relatorio_word'),
+    path('exportacoes/<int:tarefa_id>/', views.exportacao, name='exportacao'),
+    path('exportacoes/<int:tarefa_id>/ficheiro/', views.descarregar_exportacao, name='descarregar_exportacao'),
     ]
\ No newline at end of file
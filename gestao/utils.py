@@ -1,24 +1,29 @@
-from django.db.models import Sum, F
-from .models import Produto, Venda, Compra, Despesa, ReceitaExtra
-from datetime import datetime
+from django.conf import settings
+from functools import reduce
+from operator import or_
+from django.db.models import Sum, F, Q, DecimalField, DateTimeField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import Produto
+from . import resumos
+from datetime import datetime, date, time, timedelta
 
 def obter_resumo_financeiro_mensal():
     mes_atual = datetime.now().month
     ano_atual = datetime.now().year
 
     # 1. Valor Total do Inventário (Património em Stock)
-    produtos = Produto.objects.all()
-    valor_inventario = sum(p.valor_total_stock() for p in produtos)
+    valor_inventario = Produto.objects.aggregate(
+        total=Sum(F('stock_actual') * F('preco_custo'), output_field=DecimalField())
+    )['total'] or 0
 
-    # 2. Receitas do Mês (Vendas + Extras)
-    total_vendas = Venda.objects.filter(data__month=mes_atual, data__year=ano_atual).aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    total_extras = ReceitaExtra.objects.filter(data__month=mes_atual, data__year=ano_atual).aggregate(Sum('valor'))['valor__sum'] or 0
-    receita_total = total_vendas + total_extras
-
-    # 3. Custos do Mês (Compras de Stock + Despesas Operacionais)
-    total_compras = Compra.objects.filter(data__month=mes_atual, data__year=ano_atual).aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    total_despesas = Despesa.objects.filter(data__month=mes_atual, data__year=ano_atual).aggregate(Sum('valor'))['valor__sum'] or 0
-    custo_total = total_compras + total_despesas
+    # 2 e 3. Receitas e Custos do Mês, lidos do ResumoDiario
+    inicio_mes = date(ano_atual, mes_atual, 1)
+    fim_mes = date(ano_atual + mes_atual // 12, mes_atual % 12 + 1, 1)
+    mes = resumos.totais(data__gte=inicio_mes, data__lt=fim_mes)
+    receita_total = mes['entradas']
+    custo_total = mes['saidas']
 
     # 4. Resultado (Lucro Líquido)
     lucro_liquido = receita_total - custo_total
@@ -29,4 +34,120 @@ def obter_resumo_financeiro_mensal():
         'custo_total': custo_total,
         'lucro_liquido': lucro_liquido,
         'margem_geral': (lucro_liquido / receita_total * 100) if receita_total > 0 else 0
-    } 
\ No newline at end of file
+    } 
+
+def valor_por_id(valores, output_field, campo='id', omissao=None):
+    """CASE campo WHEN id THEN valor ... para actualizar várias linhas num só UPDATE.
+
+    `valores` é um dict {id: valor}. Usado pelos serviços que escrevem em lote.
+    """
+    from django.db.models import Case, Value, When
+    return Case(
+        *[When(**{campo: chave}, then=Value(valor, output_field=output_field)) for chave, valor in valores.items()],
+        default=omissao if omissao is not None else Value(None, output_field=output_field),
+        output_field=output_field,
+    )
+
+
+def _depois_da_linha(ordem, linha):
+    # (a, b, c) depois de (x, y, z): a > x, ou a = x e b > y, ou ... (< nos campos com '-')
+    condicoes, iguais = [], Q()
+    for campo in ordem:
+        nome = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        condicoes.append(iguais & Q(**{f'{nome}__{operador}': linha[nome]}))
+        iguais &= Q(**{nome: linha[nome]})
+    return reduce(or_, condicoes)
+
+
+def em_lotes(qs, ordem, campos, tamanho):
+    """Percorre qs.values(*campos) pela `ordem` em páginas de `tamanho` linhas.
+
+    Cada página é uma query com LIMIT que continua a seguir à última linha
+    da anterior (paginação por chave): a memória fica limitada a uma página
+    em qualquer base de dados. Com .iterator() o mysqlclient lê o resultado
+    inteiro para o cliente. `ordem` tem de acabar numa chave única (o id).
+    Os dicts trazem também os campos da ordem.
+    """
+    valores = list(dict.fromkeys([*campos, *(campo.lstrip('-') for campo in ordem)]))
+    qs = qs.order_by(*ordem).values(*valores)
+    ultima = None
+    while True:
+        pagina = list((qs.filter(_depois_da_linha(ordem, ultima)) if ultima else qs)[:tamanho])
+        yield from pagina
+        if len(pagina) < tamanho:
+            return
+        ultima = pagina[-1]
+
+
+class ComoDecimal(Cast):
+    """CAST AS DECIMAL de uma expressão, para a divisão seguinte ser decimal.
+
+    O SQLite não tem DECIMAL: guarda NUMERIC com valor inteiro como INTEGER
+    e dividiria à inteira. Lá o valor passa a REAL, a única representação
+    não inteira que tem; o resultado volta a DecimalField pelo output_field.
+    """
+    def __init__(self, expressao, output_field):
+        super().__init__(expressao, output_field)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f'CAST({sql} AS REAL)', params
+
+
+def _dia(valor):
+    if isinstance(valor, date):
+        return resumos.dia_de(valor)
+    try:
+        return parse_date(str(valor or ''))
+    except ValueError:
+        return None
+
+
+def _inteiro(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def periodo(modelo, inicio=None, fim=None, ano=None, mes=None, campo='data'):
+    """Filtro de um período como intervalo semiaberto: {campo__gte, campo__lt}.
+
+    Substitui data__date, data__month e data__year, que envolvem a coluna numa
+    função e impedem a base de dados de usar o índice. `inicio` e `fim` são
+    dias incluídos; `ano` dá o ano todo e `ano` com `mes` só esse mês. Aceita
+    datas ou o texto dos filtros GET; valores inválidos são ignorados.
+    Uso: Venda.objects.filter(**periodo(Venda, inicio='2026-01-01')).
+    """
+    ano, mes = _inteiro(ano), _inteiro(mes)
+    inicio, fim = _dia(inicio), _dia(fim)
+    limites = []
+    if inicio:
+        limites.append(('gte', inicio))
+    if fim:
+        limites.append(('lt', fim + timedelta(days=1)))
+    if ano is not None and not 1 <= ano <= 9998:
+        # Fora do que date() aceita (o limite do ano seguinte também tem de caber)
+        ano = None
+    if ano and mes and 1 <= mes <= 12:
+        limites += [('gte', date(ano, mes, 1)), ('lt', date(ano + mes // 12, mes % 12 + 1, 1))]
+    elif ano:
+        limites += [('gte', date(ano, 1, 1)), ('lt', date(ano + 1, 1, 1))]
+
+    com_hora = isinstance(modelo._meta.get_field(campo), DateTimeField)
+    filtro = {}
+    for operador, dia in limites:
+        if com_hora:
+            dia = datetime.combine(dia, time.min)
+            if settings.USE_TZ:
+                dia = timezone.make_aware(dia)
+        chave = f'{campo}__{operador}'
+        # Vários limites do mesmo lado: fica o mais apertado
+        if chave in filtro:
+            dia = max(dia, filtro[chave]) if operador == 'gte' else min(dia, filtro[chave])
+        filtro[chave] = dia
+    if mes and not ano and 1 <= mes <= 12:
+        # Um mês de todos os anos não é um intervalo contínuo
+        filtro[f'{campo}__month'] = mes
+    return filtro
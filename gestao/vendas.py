@@ -0,0 +1,242 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from .models import Produto, Venda, ItemVenda, AlocacaoLote
+from .utils import valor_por_id
+from . import estatisticas, lotes, catalogo, diario, fechos
+
+
+class StockInsuficiente(Exception):
+    """Uma ou mais linhas do carrinho não podem ser satisfeitas.
+
+    `erros` é uma lista de dicts com pelo menos 'mensagem'; os erros de stock
+    trazem também 'produto_id', 'disponivel' e 'pedido'.
+    """
+    def __init__(self, erros):
+        super().__init__("; ".join(e['mensagem'] for e in erros))
+        self.erros = erros
+
+
+class StockConcorrente(Exception):
+    """O UPDATE condicional de stock não abrangeu todos os produtos (outro caixa
+    vendeu entretanto, ou o produto deixou de existir)."""
+
+
+def _quantidades_por_produto(linhas):
+    pedidos = {}
+    for produto_id, quantidade in linhas:
+        pedidos[produto_id] = pedidos.get(produto_id, 0) + quantidade
+    return pedidos
+
+
+def _distribuir_alocacoes(itens, alocacoes):
+    """Reparte as alocações FEFO de cada produto pelas linhas de venda desse produto."""
+    linhas_por_produto = {}
+    for item in itens:
+        linhas_por_produto.setdefault(item.produto_id, []).append([item.id, item.quantidade])
+    registos = []
+    for item_compra_id, produto_id, quantidade in alocacoes:
+        fila = linhas_por_produto[produto_id]
+        while quantidade > 0 and fila:
+            item_venda_id, falta = fila[0]
+            parte = min(falta, quantidade)
+            registos.append(AlocacaoLote(item_venda_id=item_venda_id, item_compra_id=item_compra_id, quantidade=parte))
+            quantidade -= parte
+            fila[0][1] -= parte
+            if fila[0][1] == 0:
+                fila.pop(0)
+    return registos
+
+
+def baixar_stock_condicional(pedidos):
+    """Baixa {produto_id: quantidade} num só UPDATE ... WHERE stock_actual >= n,
+    sem SELECT ... FOR UPDATE prévio.
+
+    Se o número de linhas afectadas não for o número de produtos, algum não
+    tinha stock: lança StockConcorrente (a transacção tem de ser desfeita).
+    No checkout é a primeira escrita, antes dos lotes e das tabelas globais
+    (estatísticas, diário e resumo): a mesma ordem das compras e
+    das vendas pelo admin, por isso não há deadlocks entre elas.
+    """
+    quantidades = valor_por_id(pedidos, models.IntegerField())
+    afectados = Produto.objects.filter(id__in=pedidos, stock_actual__gte=quantidades).update(
+        stock_actual=F('stock_actual') - quantidades
+    )
+    if afectados != len(pedidos):
+        raise StockConcorrente()
+
+
+def aplicar_saidas(itens, data, baixar_stock=True):
+    """Baixa lotes e stock de várias linhas de venda (ItemVenda já gravados) de uma vez,
+    e regista de que lotes saiu cada linha. Com `baixar_stock=False` o stock
+    dos produtos já foi baixado por quem chama (baixar_stock_condicional).
+
+    Os produtos são escritos primeiro, depois os lotes (FEFO) e as restantes
+    tabelas: a mesma ordem de compras.aplicar_entradas.
+    """
+    linhas = [(item.produto_id, item.quantidade) for item in itens]
+    pedidos = _quantidades_por_produto(linhas)
+    if not pedidos:
+        return
+    if baixar_stock:
+        Produto.objects.filter(id__in=pedidos).update(
+            stock_actual=F('stock_actual') - valor_por_id(pedidos, models.IntegerField())
+        )
+    alocacoes = lotes.alocar_fefo(pedidos)
+    AlocacaoLote.objects.bulk_create(_distribuir_alocacoes(itens, alocacoes))
+    estatisticas.registar_vendas(linhas, data)
+    # UPDATE em conjunto não dispara o post_save de Produto
+    catalogo.registar_alteracoes(pedidos)
+
+
+def finalizar_venda(utilizador, metodo_pagamento, itens, chave=None, data=None, condicional=None):
+    """Regista uma venda a partir do carrinho do PDV ([{'id', 'quantidade'}, ...]).
+
+    Bloqueia todos os produtos numa só query (por ordem de id, para evitar
+    deadlocks entre caixas), insere as linhas em lote, aplica o FEFO e o stock
+    com UPDATEs em conjunto e grava o total da venda uma vez.
+    Lança StockInsuficiente com a lista de erros se alguma linha falhar.
+
+    Com `chave` (idempotência), um pedido repetido do mesmo utilizador devolve
+    a venda já criada com `venda.repetida = True` em vez de vender outra vez. `data` permite
+    gravar a hora real de uma venda feita offline e sincronizada mais tarde.
+
+    Com `condicional` (por omissão settings.PDV_STOCK_CONDICIONAL) os produtos
+    não são bloqueados: o stock é validado e baixado por um UPDATE condicional,
+    o que evita a fila de espera nos produtos mais vendidos.
+    """
+    if condicional is None:
+        condicional = getattr(settings, 'PDV_STOCK_CONDICIONAL', False)
+    if chave:
+        existente = Venda.objects.filter(utilizador=utilizador, chave_idempotencia=chave).first()
+        if existente:
+            existente.repetida = True
+            return existente
+
+    linhas = []
+    erros = []
+    for i in itens:
+        try:
+            linhas.append((int(i['id']), int(i['quantidade'])))
+        except (KeyError, TypeError, ValueError):
+            erros.append({'mensagem': "Linha do carrinho inválida."})
+    if not erros and any(qtd < 1 for _, qtd in linhas):
+        erros.append({'mensagem': "A quantidade tem de ser pelo menos 1."})
+    if erros:
+        raise StockInsuficiente(erros)
+
+    try:
+        venda = _gravar_venda(utilizador, metodo_pagamento, linhas, chave, data, condicional)
+    except IntegrityError:
+        # Dois pedidos com a mesma chave em simultâneo: o segundo perde no UNIQUE
+        existente = Venda.objects.filter(utilizador=utilizador, chave_idempotencia=chave).first() if chave else None
+        if existente is None:
+            raise
+        existente.repetida = True
+        return existente
+    venda.repetida = False
+    return venda
+
+
+def _erros_de_stock(pedidos, produtos):
+    erros = []
+    for produto_id, qtd_pedida in pedidos.items():
+        prod = produtos.get(produto_id)
+        if prod is None:
+            erros.append({'produto_id': produto_id, 'mensagem': f"Produto #{produto_id} não existe."})
+        elif prod.stock_actual < qtd_pedida:
+            erros.append({
+                'produto_id': produto_id, 'disponivel': prod.stock_actual, 'pedido': qtd_pedida,
+                'mensagem': f"{prod.nome} — stock disponível: {prod.stock_actual} un. (pedido: {qtd_pedida} un.)",
+            })
+    return erros
+
+
+def _gravar_venda(utilizador, metodo_pagamento, linhas, chave, data=None, condicional=False):
+    pedidos = _quantidades_por_produto(linhas)
+    if data is not None:
+        fechos.verificar_aberto(data)
+    try:
+        with transaction.atomic():
+            if condicional:
+                # Leitura sem bloqueio, só para preços e nomes: o stock é
+                # validado pelo próprio UPDATE condicional, a primeira escrita
+                produtos = Produto.objects.filter(id__in=pedidos).in_bulk()
+                erros = [e for e in _erros_de_stock(pedidos, produtos) if 'disponivel' not in e]
+                if erros:
+                    raise StockInsuficiente(erros)
+                baixar_stock_condicional(pedidos)
+            else:
+                produtos = Produto.objects.select_for_update().filter(id__in=pedidos).order_by('id').in_bulk()
+                # ── VALIDAÇÃO DE STOCK ANTES DE CRIAR A VENDA ──
+                erros = _erros_de_stock(pedidos, produtos)
+                if erros:
+                    raise StockInsuficiente(erros)
+
+            venda = Venda.objects.create(utilizador=utilizador, metodo_pagamento=metodo_pagamento, chave_idempotencia=chave or None)
+            if data is not None:
+                # auto_now_add ignora o valor no create
+                Venda.objects.filter(id=venda.id).update(data=data)
+                venda.data = data
+            # bulk_create não dispara o post_save de ItemVenda: o trabalho do
+            # signal (FEFO, stock, estatísticas e total) é feito aqui em conjunto
+            itens_venda = ItemVenda.objects.bulk_create([
+                ItemVenda(venda=venda, produto_id=produto_id, quantidade=qtd, preco_unitario=produtos[produto_id].preco_venda)
+                for produto_id, qtd in linhas
+            ])
+            if any(item.pk is None for item in itens_venda):
+                # MySQL não devolve os ids de um INSERT em lote
+                itens_venda = list(ItemVenda.objects.filter(venda=venda).order_by('id'))
+            aplicar_saidas(itens_venda, venda.data, baixar_stock=not condicional)
+
+            total = sum((produtos[produto_id].preco_venda * qtd for produto_id, qtd in linhas), Decimal('0'))
+            Venda.objects.filter(id=venda.id).update(valor_total=total)
+            venda.valor_total = total
+            diario.registar(Venda, venda.id)
+    except StockConcorrente:
+        # A transacção já foi desfeita; relê o stock para dizer o que faltou
+        erros = _erros_de_stock(pedidos, Produto.objects.filter(id__in=pedidos).in_bulk())
+        raise StockInsuficiente(erros or [{'mensagem': "O stock mudou durante a venda. Tenta novamente."}])
+    return venda
+
+
+def sincronizar_vendas(utilizador, pendentes):
+    """Aplica um lote de vendas feitas offline pelo PDV, numa só transacção.
+
+    Cada venda corre num savepoint próprio com as mesmas regras de stock e
+    FEFO do checkout normal: uma venda sem stock é devolvida como conflito
+    sem anular as outras. Sem stock condicional, os produtos de todo o lote
+    são bloqueados de início, por ordem de id. Devolve um resultado por venda, pela ordem recebida.
+    """
+    resultados = []
+    with transaction.atomic():
+        if not getattr(settings, 'PDV_STOCK_CONDICIONAL', False):
+            ids = set()
+            for pendente in pendentes:
+                for i in pendente.get('itens') or []:
+                    if isinstance(i, dict) and str(i.get('id', '')).isdigit():
+                        ids.add(int(i['id']))
+            list(Produto.objects.select_for_update().filter(id__in=ids).order_by('id').values_list('id', flat=True))
+
+        for pendente in pendentes:
+            chave = pendente.get('chave')
+            if pendente.get('erros'):
+                # Recusada na validação do pedido (ex.: data impossível)
+                resultados.append({'chave': chave, 'ok': False, 'erros': pendente['erros']})
+                continue
+            try:
+                venda = finalizar_venda(
+                    utilizador, pendente.get('metodo_pagamento'), pendente.get('itens') or [],
+                    chave=chave, data=pendente.get('data'),
+                )
+            except StockInsuficiente as e:
+                resultados.append({'chave': chave, 'ok': False, 'erros': e.erros})
+            except fechos.PeriodoFechado as e:
+                resultados.append({'chave': chave, 'ok': False, 'erros': [{'mensagem': m} for m in e.messages]})
+            else:
+                resultados.append({
+                    'chave': chave, 'ok': True, 'venda_id': venda.id,
+                    'valor_total': str(venda.valor_total), 'repetida': venda.repetida,
+                })
+    return resultados
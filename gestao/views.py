@@ -4,13 +4,21 @@ from decimal import Decimal
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Produto, Venda, ItemVenda, ItemCompra, Compra, Fornecedor, Despesa, ReceitaExtra, Categoria
-from django.db.models import Sum, F, Q
+from .models import Produto, Venda, ItemVenda, ItemCompra, Compra, Fornecedor, Despesa, ReceitaExtra, Categoria, ResumoDiario, AlocacaoLote, PrevisaoProduto, AlertaValidade, TarefaExportacao
+from . import resumos, estatisticas, vendas, compras, lotes, catalogo, importacao, extrato, diario, fechos, exportacoes
+from . import relatorios as relatorios_servico
+from .utils import em_lotes, periodo
+from django.db.models import Count, Sum, F, Q, DecimalField
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from urllib.parse import urlencode
 from datetime import timedelta
 from django.db import transaction
-from django.http import HttpResponse
-from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from functools import wraps
 
 
 @login_required
@@ -20,42 +28,42 @@ def dashboard(request):
     produtos = Produto.objects.all()
 
     # --- 1. KPIs DO MÊS ATUAL (DESEMPENHO) ---
-    v_mes = float(Venda.objects.filter(data__gte=inicio_mes).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-    e_mes = float(ReceitaExtra.objects.filter(data__gte=inicio_mes).aggregate(Sum('valor'))['valor__sum'] or 0)
-    c_mes = float(Compra.objects.filter(data__gte=inicio_mes).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-    d_mes = float(Despesa.objects.filter(data__gte=inicio_mes).aggregate(Sum('valor'))['valor__sum'] or 0)
-    
-    entradas_mes, saidas_mes = (v_mes + e_mes), (c_mes + d_mes)
+    # Lidos do ResumoDiario (uma linha por dia) em vez das tabelas de movimentos
+    mes = resumos.totais(data__gte=inicio_mes)
+    entradas_mes, saidas_mes = float(mes['entradas']), float(mes['saidas'])
     lucro_mes = entradas_mes - saidas_mes
 
     # --- 2. SALDO HISTÓRICO ACUMULADO ---
-    total_vendas_geral = float(Venda.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-    total_extras_geral = float(ReceitaExtra.objects.aggregate(Sum('valor'))['valor__sum'] or 0)
-    total_compras_geral = float(Compra.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-    total_despesas_geral = float(Despesa.objects.aggregate(Sum('valor'))['valor__sum'] or 0)
-    
-    saldo_caixa_real = (total_vendas_geral + total_extras_geral) - (total_compras_geral + total_despesas_geral)
+    # Saldo corrente mantido pelo diário de caixa (uma linha)
+    saldo_caixa_real = float(diario.saldo_actual())
 
     # --- 3. PATRIMÓNIO ATUAL ---
-    valor_stock = sum(float(p.valor_total_stock()) for p in produtos)
+    valor_stock = float(produtos.aggregate(
+        total=Sum(F('stock_actual') * F('preco_custo'), output_field=DecimalField())
+    )['total'] or 0)
     capital_giro_consolidado = saldo_caixa_real + valor_stock
 
     # --- 4. INTELIGÊNCIA E GRÁFICOS ---
-    capital_estagnado = sum(float(p.valor_total_stock()) for p in produtos if p.status_giro() == "Estagnado ⚠️")
+    capital_estagnado = float(estatisticas.capital_estagnado())
     
-    count_a = len([p for p in produtos if p.classe_abc() == 'A' and p.stock_actual > 0])
-    count_b = len([p for p in produtos if p.classe_abc() == 'B' and p.stock_actual > 0])
-    count_c = len([p for p in produtos if p.classe_abc() == 'C' and p.stock_actual > 0])
+    # Classe ABC guardada na EstatisticaProduto (comando classificar_abc): contagem em SQL
+    por_classe = dict(
+        produtos.filter(stock_actual__gt=0).values_list('estatistica__classe_abc')
+        .annotate(n=Count('id')).order_by()
+    )
+    count_a, count_b = por_classe.get('A', 0), por_classe.get('B', 0)
+    # Sem classificação ainda conta como C
+    count_c = por_classe.get('C', 0) + por_classe.get(None, 0)
 
-    sugestao = [p for p in produtos if p.classe_abc() in ['A', 'B'] and p.stock_actual <= p.stock_minimo]
+    sugestao = produtos.filter(estatistica__classe_abc__in=['A', 'B'], stock_actual__lte=F('stock_minimo'))
 
+    vendas_por_dia = dict(ResumoDiario.objects.filter(data__gte=hoje - timedelta(days=6)).values_list('data', 'vendas'))
     vendas_diarias = []
     dias_semana = []
     for i in range(6, -1, -1):
         dia = hoje - timedelta(days=i)
         dias_semana.append(dia.strftime('%d/%m'))
-        v = Venda.objects.filter(data__date=dia).aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-        vendas_diarias.append(float(v))
+        vendas_diarias.append(float(vendas_por_dia.get(dia, 0)))
 
     context = {
         'entradas': entradas_mes, 'saidas': saidas_mes, 'lucro': lucro_mes,
@@ -66,7 +74,7 @@ def dashboard(request):
         'abc_counts': [count_a, count_b, count_c],
         'vendas_diarias': vendas_diarias, 'dias_semana': dias_semana,
         'alertas_stock': Produto.objects.filter(stock_actual__lte=F('stock_minimo'))[:4],
-        'alertas_validade': ItemCompra.objects.filter(validade__lte=hoje + timedelta(days=30), quantidade__gt=0).order_by('validade')[:4],
+        'alertas_validade': AlertaValidade.objects.filter(faixa__in=['V', '30']).select_related('produto', 'lote').order_by('validade')[:4],
         'status_cor': 'text-success' if lucro_mes >= 0 else 'text-danger'
     }
     return render(request, 'dashboard.html', context)
@@ -93,51 +101,161 @@ def registrar_venda(request):
             return redirect('registrar_venda')
 
         try:
-            with transaction.atomic():
-                # ── VALIDAÇÃO DE STOCK ANTES DE CRIAR A VENDA ──
-                erros_stock = []
-                produtos_venda = []
-
-                for i in itens:
-                    # select_for_update bloqueia o registo durante a transação
-                    # evita que duas vendas simultâneas esgotem o mesmo stock
-                    prod = Produto.objects.select_for_update().get(id=i['id'])
-                    qtd_pedida = int(i['quantidade'])
-
-                    if prod.stock_actual < qtd_pedida:
-                        erros_stock.append(
-                            f"{prod.nome} — stock disponível: {prod.stock_actual} un. (pedido: {qtd_pedida} un.)"
-                        )
-                    else:
-                        produtos_venda.append((prod, qtd_pedida))
-
-                # Se houver qualquer erro de stock, cancela tudo e avisa
-                if erros_stock:
-                    for erro in erros_stock:
-                        messages.error(request, f"Stock insuficiente: {erro}")
-                    return redirect('registrar_venda')
-
-                # Tudo ok — criar a venda
-                venda = Venda.objects.create(
-                    utilizador=request.user,
-                    metodo_pagamento=request.POST.get('metodo_pagamento')
-                )
-                for prod, qtd in produtos_venda:
-                    ItemVenda.objects.create(
-                        venda=venda,
-                        produto=prod,
-                        quantidade=qtd,
-                        preco_unitario=prod.preco_venda
-                    )
-
-            messages.success(request, f"Venda #{venda.id} registada com sucesso!")
-            return redirect('ver_fatura', venda_id=venda.id)
-
-        except Exception as e:
+            venda = vendas.finalizar_venda(request.user, request.POST.get('metodo_pagamento'), itens)
+        except vendas.StockInsuficiente as e:
+            # Se houver qualquer erro de stock, cancela tudo e avisa
+            for erro in e.erros:
+                messages.error(request, f"Stock insuficiente: {erro['mensagem']}")
+            return redirect('registrar_venda')
+        except Exception:
             messages.error(request, f"Erro ao registar a venda. Tenta novamente.")
             return redirect('registrar_venda')
 
-    return render(request, 'venda.html', {'produtos': Produto.objects.filter(stock_actual__gt=0)})
+        messages.success(request, f"Venda #{venda.id} registada com sucesso!")
+        return redirect('ver_fatura', venda_id=venda.id)
+
+    # Os produtos chegam ao PDV pela api_catalogo (em cache no navegador)
+    return render(request, 'venda.html')
+
+
+def api_login_required(view):
+    # Como o login_required, mas responde 401 em JSON em vez de redireccionar
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'ok': False, 'erro': "Sessão expirada. Inicia sessão novamente."}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def venda_json(venda):
+    itens = venda.itens.select_related('produto').order_by('id')
+    return {
+        'ok': True,
+        'venda_id': venda.id,
+        'repetida': venda.repetida,
+        'data': venda.data.isoformat(),
+        'metodo_pagamento': venda.metodo_pagamento,
+        'valor_total': str(venda.valor_total),
+        'itens': [{
+            'produto_id': i.produto_id, 'nome': i.produto.nome, 'quantidade': i.quantidade,
+            'preco_unitario': str(i.preco_unitario), 'subtotal': str(i.total_item()),
+        } for i in itens],
+        'fatura_url': reverse('ver_fatura', args=[venda.id]),
+    }
+
+
+@api_login_required
+@require_POST
+def api_registar_venda(request):
+    """Checkout em JSON para o PDV: {chave, metodo_pagamento, itens: [{id, quantidade}]}.
+
+    A chave de idempotência (no corpo ou no cabeçalho Idempotency-Key) faz com
+    que um pedido repetido devolva a mesma venda em vez de criar outra.
+    """
+    try:
+        dados = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'ok': False, 'erro': "JSON inválido."}, status=400)
+    if not isinstance(dados, dict):
+        return JsonResponse({'ok': False, 'erro': "O pedido tem de ser um objecto JSON."}, status=400)
+
+    chave = str(dados.get('chave') or request.headers.get('Idempotency-Key') or '')[:64] or None
+    metodo = dados.get('metodo_pagamento')
+    itens = dados.get('itens') or []
+    if metodo not in dict(Venda.METODOS_PAGAMENTO):
+        return JsonResponse({'ok': False, 'erro': "Método de pagamento inválido."}, status=400)
+    if not isinstance(itens, list) or not itens:
+        return JsonResponse({'ok': False, 'erro': "O carrinho está vazio."}, status=400)
+
+    try:
+        venda = vendas.finalizar_venda(request.user, metodo, itens, chave=chave)
+    except vendas.StockInsuficiente as e:
+        return JsonResponse({'ok': False, 'erros': e.erros}, status=409)
+    return JsonResponse(venda_json(venda), status=200 if venda.repetida else 201)
+
+
+# Limite de vendas por pedido de sincronização do PDV
+MAX_VENDAS_SINCRONIZAR = 200
+
+
+def _data_offline(valor):
+    """Hora da venda enviada pelo PDV (ISO 8601) e erro.
+
+    Sem data, em formato desconhecido ou no futuro conta a hora de chegada
+    (None); uma data impossível (ex.: 30 de Fevereiro) devolve o erro, para
+    essa venda voltar como conflito sem travar o lote.
+    """
+    try:
+        data = parse_datetime(str(valor or ''))
+    except ValueError:
+        return None, f"Data inválida: {valor}."
+    if data is None:
+        return None, None
+    if timezone.is_aware(data):
+        data = timezone.make_naive(data)
+    return (data if data <= timezone.now() else None), None
+
+
+@api_login_required
+@require_POST
+def api_sincronizar_vendas(request):
+    """Recebe a fila de vendas feitas offline: {vendas: [{chave, metodo_pagamento, itens, data}]}.
+
+    Aplica todas numa só transacção (ver vendas.sincronizar_vendas) e responde
+    com um resultado por venda; as que não têm stock vêm como conflito.
+    """
+    try:
+        dados = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'ok': False, 'erro': "JSON inválido."}, status=400)
+    if not isinstance(dados, dict):
+        return JsonResponse({'ok': False, 'erro': "O pedido tem de ser um objecto JSON."}, status=400)
+
+    lote = dados.get('vendas')
+    if not isinstance(lote, list) or not lote:
+        return JsonResponse({'ok': False, 'erro': "Não há vendas para sincronizar."}, status=400)
+    if len(lote) > MAX_VENDAS_SINCRONIZAR:
+        return JsonResponse({'ok': False, 'erro': f"No máximo {MAX_VENDAS_SINCRONIZAR} vendas por pedido."}, status=400)
+
+    pendentes = []
+    for v in lote:
+        chave = str(v.get('chave') or '')[:64] if isinstance(v, dict) else ''
+        if not chave:
+            return JsonResponse({'ok': False, 'erro': "Cada venda precisa de uma chave."}, status=400)
+        if v.get('metodo_pagamento') not in dict(Venda.METODOS_PAGAMENTO):
+            return JsonResponse({'ok': False, 'erro': f"Método de pagamento inválido ({chave})."}, status=400)
+        if not isinstance(v.get('itens'), list) or not v['itens']:
+            return JsonResponse({'ok': False, 'erro': f"Venda sem itens ({chave})."}, status=400)
+        if not all(isinstance(i, dict) for i in v['itens']):
+            return JsonResponse({'ok': False, 'erro': f"Linha do carrinho inválida ({chave})."}, status=400)
+        data, erro_data = _data_offline(v.get('data'))
+        pendentes.append({
+            'chave': chave, 'metodo_pagamento': v['metodo_pagamento'],
+            'itens': v['itens'], 'data': data,
+            'erros': [{'mensagem': erro_data}] if erro_data else [],
+        })
+
+    resultados = vendas.sincronizar_vendas(request.user, pendentes)
+    return JsonResponse({'ok': True, 'resultados': resultados})
+
+
+@api_login_required
+def api_catalogo(request):
+    """Catálogo do PDV com versão. ?desde=N devolve só o que mudou depois da versão N."""
+    desde = request.GET.get('desde', '')
+    versao = catalogo.versao_actual()
+    if desde.isdigit() and 0 < int(desde) <= versao:
+        return JsonResponse(catalogo.diferencas(int(desde)))
+
+    etag = f'"catalogo-{versao}"'
+    if request.headers.get('If-None-Match') == etag:
+        resposta = HttpResponse(status=304)
+    else:
+        resposta = JsonResponse(catalogo.snapshot())
+    resposta['ETag'] = etag
+    resposta['Cache-Control'] = 'private, no-cache'
+    return resposta
 
 
 @login_required
@@ -145,60 +263,40 @@ def extrato_caixa(request):
     tipo_filtro = request.GET.get('tipo', '')
     data_inicio = request.GET.get('data_inicio', '')
     data_fim = request.GET.get('data_fim', '')
+    if tipo_filtro not in ('', 'entrada', 'saida'):
+        tipo_filtro = ''
+
+    # Diário de caixa lido pelo índice (momento, id), paginado por cursor
+    inicio = parse_date(data_inicio) if data_inicio else None
+    fim = parse_date(data_fim) if data_fim else None
+    linhas, anterior, seguinte = extrato.pagina(
+        tipo_filtro, inicio, fim,
+        depois=extrato.Cursor.de_texto(request.GET.get('depois')),
+        antes=extrato.Cursor.de_texto(request.GET.get('antes')),
+    )
+    movimentacoes = [{
+        'id': f"{m['origem']}-{m['origem_id']}", 'data': m['momento'], 'raw_id': m['origem_id'],
+        'desc': m['descricao'], 'tipo': 'Entrada' if m['origem'] in diario.ENTRADAS else 'Saída',
+        'sinal': '+' if m['valor'] > 0 else '-', 'valor': abs(float(m['valor'])), 'saldo': float(m['saldo']),
+        'cor': 'text-success' if m['valor'] > 0 else 'text-danger',
+    } for m in linhas]
 
-    # Filtros aplicados directamente na BD em vez de em memória
-    filtro_data = {}
-    if data_inicio:
-        filtro_data['data_inicio'] = data_inicio
-    if data_fim:
-        filtro_data['data_fim'] = data_fim
-
-    movs = []
-
-    if not tipo_filtro or tipo_filtro == 'entrada':
-        vendas_qs = Venda.objects.all()
-        extras_qs = ReceitaExtra.objects.all()
-        if data_inicio:
-            vendas_qs = vendas_qs.filter(data__date__gte=data_inicio)
-            extras_qs = extras_qs.filter(data__gte=data_inicio)
-        if data_fim:
-            vendas_qs = vendas_qs.filter(data__date__lte=data_fim)
-            extras_qs = extras_qs.filter(data__lte=data_fim)
-        for v in vendas_qs:
-            movs.append({'id': f"V-{v.id}", 'data': v.data.date(), 'raw_id': v.id,
-                'desc': "Venda", 'tipo': 'Entrada', 'valor': float(v.valor_total), 'cor': 'text-success'})
-        for e in extras_qs:
-            movs.append({'id': f"R-{e.id}", 'data': e.data, 'raw_id': e.id,
-                'desc': e.descricao, 'tipo': 'Entrada', 'valor': float(e.valor), 'cor': 'text-success'})
-
-    if not tipo_filtro or tipo_filtro == 'saida':
-        despesas_qs = Despesa.objects.all()
-        compras_qs = Compra.objects.all()
-        if data_inicio:
-            despesas_qs = despesas_qs.filter(data__gte=data_inicio)
-            compras_qs = compras_qs.filter(data__date__gte=data_inicio)
-        if data_fim:
-            despesas_qs = despesas_qs.filter(data__lte=data_fim)
-            compras_qs = compras_qs.filter(data__date__lte=data_fim)
-        for d in despesas_qs:
-            movs.append({'id': f"D-{d.id}", 'data': d.data, 'raw_id': d.id,
-                'desc': d.descricao, 'tipo': 'Saída', 'valor': float(d.valor), 'cor': 'text-danger'})
-        for c in compras_qs:
-            movs.append({'id': f"C-{c.id}", 'data': c.data.date(), 'raw_id': c.id,
-                'desc': "Compra", 'tipo': 'Saída', 'valor': float(c.valor_total), 'cor': 'text-danger'})
-
-    movimentacoes = sorted(movs, key=lambda x: (x['data'], x['raw_id']), reverse=True)
-    t_e = sum(m['valor'] for m in movimentacoes if m['tipo'] == 'Entrada')
-    t_s = sum(m['valor'] for m in movimentacoes if m['tipo'] == 'Saída')
-
-    paginator = Paginator(movimentacoes, 25)
-    page = paginator.get_page(request.GET.get('page'))
+    # Totais do período a partir do ResumoDiario (uma linha por dia)
+    t_e, t_s = extrato.totais(tipo_filtro, inicio, fim)
+    filtros = {k: v for k, v in (('tipo', tipo_filtro), ('data_inicio', data_inicio), ('data_fim', data_fim)) if v}
+
+    # Saldos de abertura e fecho do período lidos do saldo corrente do diário
+    saldo_inicial = diario.saldo_em(inicio - timedelta(days=1)) if inicio else Decimal('0')
+    saldo_final = diario.saldo_em(fim) if fim else diario.saldo_actual()
 
     return render(request, 'extrato.html', {
-        'movimentacoes': page,
-        'saldo_final': t_e - t_s,
-        'total_entradas': t_e,
-        'total_saidas': t_s,
+        'movimentacoes': movimentacoes,
+        'saldo_inicial': float(saldo_inicial),
+        'saldo_final': float(saldo_final),
+        'total_entradas': float(t_e),
+        'total_saidas': float(t_s),
+        'pagina_anterior': urlencode({**filtros, 'antes': anterior}) if anterior else None,
+        'pagina_seguinte': urlencode({**filtros, 'depois': seguinte}) if seguinte else None,
     })
 
 @login_required
@@ -210,160 +308,85 @@ def lista_produtos(request):
 
 @login_required
 def planeamento_compras(request):
-    produtos = Produto.objects.all().order_by('nome')
-    sugestoes = [p for p in produtos if p.stock_actual <= p.stock_minimo or p.classe_abc() == 'A']
+    produtos = Produto.objects.select_related('estatistica', 'previsao').order_by('nome')
+    # Encomendas sugeridas pelo último cálculo da previsão (comando prever_procura), por fornecedor
+    sugestoes = (
+        PrevisaoProduto.objects.filter(quantidade_sugerida__gt=0)
+        .select_related('produto', 'fornecedor')
+        .annotate(valor_estimado=F('quantidade_sugerida') * F('produto__preco_custo'))
+        .order_by('fornecedor__nome', 'produto__nome')
+    )
     erro = request.GET.get('erro')
     return render(request, 'planeamento.html', {'produtos': produtos, 'sugestoes': sugestoes, 'erro': erro})
 
 
 @login_required
 def relatorios(request):
-    from collections import defaultdict
-    from datetime import date as date_type
-
     tab = request.GET.get('tab', 'financeiro')
+    if tab not in relatorios_servico.SEPARADORES:
+        tab = 'financeiro'
+
+    # Só o separador pedido é calculado (e fica em cache até os dados mudarem)
+    contexto = relatorios_servico.contexto(tab, request.GET)
+    fragmento = f'relatorios/{tab}.html'
+    if request.GET.get('fragmento'):
+        return render(request, fragmento, contexto)
+
+    rotulos = {'financeiro': "💰 Financeiro", 'vendas': "🛍️ Vendas", 'compras': "📦 Compras", 'inventario': "🗃️ Inventário"}
+    separadores = [
+        {'nome': nome, 'rotulo': rotulos[nome], 'exportar': f'exportar_{exportar}'}
+        for nome, (_, _, exportar) in relatorios_servico.SEPARADORES.items()
+    ]
+    return render(request, 'relatorios.html', {
+        **contexto,
+        'tab': tab,
+        'fragmento': fragmento,
+        'separadores': separadores,
+        'exportar': f'exportar_{relatorios_servico.SEPARADORES[tab][2]}',
+    })
 
-    # ─── DADOS COMUNS ─────────────────────────────────────────
-    anos_disponiveis = sorted(set(
-        list(Venda.objects.dates('data', 'year').values_list('data__year', flat=True)) +
-        list(Compra.objects.dates('data', 'year').values_list('data__year', flat=True))
-    ), reverse=True)
-    fornecedores = Fornecedor.objects.all().order_by('nome')
-
-    # ─── TAB 1: RESUMO FINANCEIRO ─────────────────────────────
-    ano_selecionado = request.GET.get('ano')
-    filtro_ano = {'data__year': ano_selecionado} if ano_selecionado else {}
-
-    def agrupar_por_mes(qs, campo_data, campo_valor):
-        resultado = defaultdict(Decimal)
-        for item in qs.values(campo_data + '__year', campo_data + '__month').annotate(total=Sum(campo_valor)):
-            chave = (item[campo_data + '__year'], item[campo_data + '__month'])
-            resultado[chave] += item['total'] or Decimal('0')
-        return resultado
-
-    vendas_map = agrupar_por_mes(Venda.objects.filter(**filtro_ano), 'data', 'valor_total')
-    extras_map = agrupar_por_mes(ReceitaExtra.objects.filter(**filtro_ano), 'data', 'valor')
-    despesas_map = agrupar_por_mes(Despesa.objects.filter(**filtro_ano), 'data', 'valor')
-    compras_map = agrupar_por_mes(Compra.objects.filter(**filtro_ano), 'data', 'valor_total')
-    todos_meses = sorted(set(vendas_map) | set(extras_map) | set(despesas_map) | set(compras_map), reverse=True)
-
-    relatorio_final = []
-    for ano, mes in todos_meses:
-        chave = (ano, mes)
-        receitas = float(vendas_map[chave] + extras_map[chave])
-        custos = float(despesas_map[chave] + compras_map[chave])
-        lucro = receitas - custos
-        margem = (lucro / receitas * 100) if receitas > 0 else 0
-        relatorio_final.append({'mes': date_type(ano, mes, 1), 'vendas': receitas, 'saidas': custos, 'lucro': lucro, 'margem': margem})
-
-    total_receitas = sum(r['vendas'] for r in relatorio_final)
-    total_custos = sum(r['saidas'] for r in relatorio_final)
-    total_lucro = total_receitas - total_custos
-    margem_media = (total_lucro / total_receitas * 100) if total_receitas > 0 else 0
-
-    # ─── TAB 2: VENDAS ────────────────────────────────────────
-    v_data_inicio = request.GET.get('v_data_inicio', '')
-    v_data_fim = request.GET.get('v_data_fim', '')
-    v_metodo = request.GET.get('v_metodo', '')
-
-    vendas_qs = Venda.objects.all()
-    if v_data_inicio:
-        vendas_qs = vendas_qs.filter(data__date__gte=v_data_inicio)
-    if v_data_fim:
-        vendas_qs = vendas_qs.filter(data__date__lte=v_data_fim)
-    if v_metodo:
-        vendas_qs = vendas_qs.filter(metodo_pagamento=v_metodo)
-
-    total_vendas_filtrado = vendas_qs.aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    num_vendas = vendas_qs.count()
-    ticket_medio = float(total_vendas_filtrado) / num_vendas if num_vendas > 0 else 0
-
-    top_produtos = (
-        ItemVenda.objects.filter(venda__in=vendas_qs)
-        .values('produto__nome', 'produto__marca')
-        .annotate(total_vendido=Sum('quantidade'), receita=Sum(F('quantidade') * F('preco_unitario')))
-        .order_by('-receita')[:10]
-    )
-
-    por_metodo = (
-        vendas_qs.values('metodo_pagamento')
-        .annotate(total=Sum('valor_total'), count=Sum('valor_total') / Sum('valor_total'))
-        .order_by('-total')
-    )
-
-    # ─── TAB 3: COMPRAS ───────────────────────────────────────
-    c_data_inicio = request.GET.get('c_data_inicio', '')
-    c_data_fim = request.GET.get('c_data_fim', '')
-    c_fornecedor = request.GET.get('c_fornecedor', '')
-
-    compras_qs = Compra.objects.all()
-    if c_data_inicio:
-        compras_qs = compras_qs.filter(data__date__gte=c_data_inicio)
-    if c_data_fim:
-        compras_qs = compras_qs.filter(data__date__lte=c_data_fim)
-    if c_fornecedor:
-        compras_qs = compras_qs.filter(fornecedor__id=c_fornecedor)
-
-    total_compras_filtrado = compras_qs.aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    num_compras = compras_qs.count()
-
-    top_fornecedores = (
-        compras_qs.values('fornecedor__nome')
-        .annotate(total_gasto=Sum('valor_total'), num_compras=Sum('valor_total') / Sum('valor_total'))
-        .order_by('-total_gasto')[:10]
-    )
-
-    produtos_comprados = (
-        ItemCompra.objects.filter(compra__in=compras_qs)
-        .values('produto__nome', 'produto__marca')
-        .annotate(total_qty=Sum('quantidade'), total_custo=Sum(F('quantidade') * F('preco_custo')))
-        .order_by('-total_custo')[:10]
-    )
-
-    # ─── TAB 4: INVENTÁRIO ────────────────────────────────────
-    hoje = timezone.now().date()
-    todos_produtos = Produto.objects.all().order_by('nome')
-    valor_total_stock = sum(float(p.valor_total_stock()) for p in todos_produtos)
-
-    ids_vendidos = ItemVenda.objects.values_list('produto_id', flat=True).distinct()
-    produtos_estagnados = Produto.objects.exclude(id__in=ids_vendidos).filter(stock_actual__gt=0)
-    valor_estagnado = sum(float(p.valor_total_stock()) for p in produtos_estagnados)
-
-    alertas_validade = ItemCompra.objects.filter(
-        validade__lte=hoje + timedelta(days=60), quantidade__gt=0
-    ).order_by('validade').select_related('produto')
+@login_required
+@require_POST
+def fechar_mes(request):
+    if not request.user.is_superuser:
+        return redirect('relatorios')
+    mes = parse_date(request.POST.get('mes', ''))
+    if mes is None:
+        messages.error(request, "Mês inválido.")
+        return redirect('relatorios')
+    try:
+        fecho = fechos.fechar_mes(mes, request.user)
+    except ValidationError as e:
+        messages.error(request, " ".join(e.messages))
+    else:
+        messages.success(request, f"Mês {fecho.mes:%m/%Y} fechado.")
+    return redirect('relatorios')
 
-    stock_critico = Produto.objects.filter(stock_actual__lte=F('stock_minimo')).order_by('stock_actual')
 
-    return render(request, 'relatorios.html', {
-        'tab': tab,
-        # Financeiro
-        'relatorio_final': relatorio_final,
-        'total_receitas': total_receitas, 'total_custos': total_custos,
-        'total_lucro': total_lucro, 'margem_media': margem_media,
-        'anos_disponiveis': anos_disponiveis, 'ano_selecionado': ano_selecionado,
-        # Vendas
-        'vendas_lista': vendas_qs.order_by('-data')[:50],
-        'total_vendas_filtrado': total_vendas_filtrado,
-        'num_vendas': num_vendas, 'ticket_medio': ticket_medio,
-        'top_produtos': top_produtos, 'por_metodo': por_metodo,
-        'v_data_inicio': v_data_inicio, 'v_data_fim': v_data_fim, 'v_metodo': v_metodo,
-        # Compras
-        'compras_lista': compras_qs.order_by('-data')[:50],
-        'total_compras_filtrado': total_compras_filtrado,
-        'num_compras': num_compras,
-        'top_fornecedores': top_fornecedores,
-        'produtos_comprados': produtos_comprados,
-        'fornecedores': fornecedores,
-        'c_data_inicio': c_data_inicio, 'c_data_fim': c_data_fim, 'c_fornecedor': c_fornecedor,
-        # Inventário
-        'todos_produtos': todos_produtos,
-        'valor_total_stock': valor_total_stock,
-        'produtos_estagnados': produtos_estagnados,
-        'valor_estagnado': valor_estagnado,
-        'alertas_validade': alertas_validade,
-        'stock_critico': stock_critico,
-        'hoje': hoje,
+@login_required
+def rastreabilidade(request):
+    # Recolha de um lote (lote → vendas) e origem de uma venda (venda → lotes),
+    # cada uma numa query sobre a AlocacaoLote pelos seus índices
+    lote = request.GET.get('lote', '').strip()
+    venda_id = request.GET.get('venda', '').strip()
+    vendas_do_lote = lotes_da_venda = []
+    if lote:
+        vendas_do_lote = (
+            AlocacaoLote.objects.filter(item_compra__lote=lote)
+            .select_related('item_venda__venda__utilizador', 'item_compra__produto')
+            .order_by('-item_venda__venda__data')
+        )
+    if venda_id.isdigit():
+        lotes_da_venda = (
+            AlocacaoLote.objects.filter(item_venda__venda_id=venda_id)
+            .select_related('item_compra__produto')
+            .order_by('item_venda_id', 'item_compra__validade')
+        )
+    return render(request, 'rastreabilidade.html', {
+        'lote': lote,
+        'venda_id': venda_id if venda_id.isdigit() else '',
+        'vendas_do_lote': vendas_do_lote,
+        'lotes_da_venda': lotes_da_venda,
     })
 
 @login_required
@@ -385,21 +408,23 @@ def add_fornecedor(request):
 @login_required
 def add_despesa(request):
     if request.method == "POST":
-        Despesa.objects.create(
-            descricao=request.POST.get('descricao'),
-            valor=request.POST.get('valor'),
-            data=request.POST.get('data') or timezone.now().date()
-        )
-        messages.success(request, "Despesa registada com sucesso!")
+        try:
+            Despesa.objects.create(
+                descricao=request.POST.get('descricao'),
+                valor=request.POST.get('valor'),
+                data=request.POST.get('data') or timezone.now().date()
+            )
+        except fechos.PeriodoFechado as e:
+            messages.error(request, " ".join(e.messages))
+        else:
+            messages.success(request, "Despesa registada com sucesso!")
         return redirect('add_despesa')
     
     despesas = Despesa.objects.all().order_by('-data')
     mes = request.GET.get('mes')
     ano = request.GET.get('ano')
-    if mes:
-        despesas = despesas.filter(data__month=mes)
-    if ano:
-        despesas = despesas.filter(data__year=ano)
+    # Intervalo de datas sobre a coluna (usa o índice), não MONTH()/YEAR()
+    despesas = despesas.filter(**periodo(Despesa, ano=ano, mes=mes))
     
     total = despesas.aggregate(Sum('valor'))['valor__sum'] or 0
     return render(request, 'despesas.html', {
@@ -413,21 +438,23 @@ def add_despesa(request):
 @login_required
 def add_receita(request):
     if request.method == "POST":
-        ReceitaExtra.objects.create(
-            descricao=request.POST.get('descricao'),
-            valor=request.POST.get('valor'),
-            data=request.POST.get('data') or timezone.now().date()
-        )
-        messages.success(request, "Receita registada com sucesso!")
+        try:
+            ReceitaExtra.objects.create(
+                descricao=request.POST.get('descricao'),
+                valor=request.POST.get('valor'),
+                data=request.POST.get('data') or timezone.now().date()
+            )
+        except fechos.PeriodoFechado as e:
+            messages.error(request, " ".join(e.messages))
+        else:
+            messages.success(request, "Receita registada com sucesso!")
         return redirect('add_receita')
     
     receitas = ReceitaExtra.objects.all().order_by('-data')
     mes = request.GET.get('mes')
     ano = request.GET.get('ano')
-    if mes:
-        receitas = receitas.filter(data__month=mes)
-    if ano:
-        receitas = receitas.filter(data__year=ano)
+    # Intervalo de datas sobre a coluna (usa o índice), não MONTH()/YEAR()
+    receitas = receitas.filter(**periodo(ReceitaExtra, ano=ano, mes=mes))
     
     total = receitas.aggregate(Sum('valor'))['valor__sum'] or 0
     return render(request, 'receitas.html', {
@@ -489,6 +516,34 @@ def add_produto(request):
     })
 
 
+@login_required
+def importar_produtos(request):
+    """Cria/actualiza produtos em lote a partir de uma tabela de preços (CSV ou XLSX)."""
+    if not request.user.is_superuser:
+        return redirect('lista_produtos')
+
+    erro, resultado = None, None
+    if request.method == "POST":
+        ficheiro = request.FILES.get('ficheiro')
+        if not ficheiro:
+            erro = "Escolhe o ficheiro com os produtos."
+        elif not ficheiro.name.lower().endswith(('.csv', '.xlsx')):
+            erro = "O ficheiro tem de ser CSV ou XLSX."
+        else:
+            try:
+                resultado = importacao.importar_produtos(ficheiro)
+                resultado['erros_omitidos'] = resultado['total_erros'] - len(resultado['erros'])
+                if not resultado['total_erros']:
+                    messages.success(request, f"{resultado['criados']} produtos criados e {resultado['actualizados']} actualizados.")
+                    return redirect('lista_produtos')
+            except importacao.ImportacaoInvalida as e:
+                erro = "; ".join(x['mensagem'] for x in e.erros)
+            except Exception as e:
+                erro = f"Erro ao importar produtos: {str(e)}"
+
+    return render(request, 'importar_produtos.html', {'erro': erro, 'resultado': resultado})
+
+
 @login_required
 def editar_produto(request, produto_id):
     if not request.user.is_superuser:
@@ -559,10 +614,7 @@ def lista_compras(request):
 
     if fornecedor_id:
         compras = compras.filter(fornecedor__id=fornecedor_id)
-    if data_inicio:
-        compras = compras.filter(data__date__gte=data_inicio)
-    if data_fim:
-        compras = compras.filter(data__date__lte=data_fim)
+    compras = compras.filter(**periodo(Compra, data_inicio, data_fim))
 
     total_gasto = sum(c.valor_total for c in compras)
 
@@ -596,21 +648,15 @@ def add_compra(request):
             erro = "Adiciona pelo menos um produto à compra."
         else:
             try:
-                with transaction.atomic():
-                    fornecedor = Fornecedor.objects.get(id=fornecedor_id)
-                    compra = Compra.objects.create(fornecedor=fornecedor)
-                    for i in itens:
-                        produto = Produto.objects.get(id=i['id'])
-                        ItemCompra.objects.create(
-                            compra=compra,
-                            produto=produto,
-                            quantidade=int(i['quantidade']),
-                            preco_custo=i['preco_custo'],
-                            validade=i['validade'],
-                            lote=i.get('lote', '') or '',
-                        )
+                fornecedor = Fornecedor.objects.get(id=fornecedor_id)
+                # Todas as linhas de uma vez: uma query de produtos, INSERT em
+                # lote e o total da compra escrito uma só vez
+                compras.registar_compra(fornecedor, itens)
                 messages.success(request, "Compra registada com sucesso!")
                 return redirect('lista_produtos')
+            except compras.CompraInvalida as e:
+                erro = "Erro ao registar compra: " + "; ".join(
+                    f"linha {x['linha']}: {x['mensagem']}" for x in e.erros)
             except Exception as e:
                 erro = f"Erro ao registar compra: {str(e)}"
 
@@ -621,6 +667,44 @@ def add_compra(request):
     })
 
 
+@login_required
+def importar_compra(request):
+    """Importa uma factura de fornecedor (CSV ou XLSX) para uma nova compra."""
+    if not request.user.is_superuser:
+        return redirect('dashboard')
+
+    fornecedores = Fornecedor.objects.all().order_by('nome')
+    erro, erros, total_erros = None, [], 0
+
+    if request.method == "POST":
+        fornecedor_id = request.POST.get('fornecedor')
+        ficheiro = request.FILES.get('ficheiro')
+        if not fornecedor_id:
+            erro = "Selecciona um fornecedor."
+        elif not ficheiro:
+            erro = "Escolhe o ficheiro da factura."
+        elif not ficheiro.name.lower().endswith(('.csv', '.xlsx')):
+            erro = "O ficheiro tem de ser CSV ou XLSX."
+        else:
+            try:
+                fornecedor = Fornecedor.objects.get(id=fornecedor_id)
+                compra = importacao.importar_compra(fornecedor, ficheiro)
+                messages.success(request, f"Compra #{compra.id} importada: {compra.num_linhas} linhas, {compra.valor_total} Kz.")
+                return redirect('lista_compras')
+            except importacao.ImportacaoInvalida as e:
+                erro = f"O ficheiro tem {e.total_erros} linha(s) com erro. Nada foi gravado."
+                erros, total_erros = e.erros, e.total_erros
+            except Exception as e:
+                erro = f"Erro ao importar compra: {str(e)}"
+
+    return render(request, 'importar_compra.html', {
+        'fornecedores': fornecedores,
+        'erro': erro,
+        'erros': erros,
+        'erros_omitidos': total_erros - len(erros),
+    })
+
+
 @login_required
 def ajuste_stock(request):
     if not request.user.is_superuser:
@@ -636,19 +720,8 @@ def ajuste_stock(request):
                     if quantidade > produto.stock_actual:
                         messages.error(request, f"Quantidade superior ao stock actual ({produto.stock_actual} un.).")
                         return redirect('planeamento_compras')
-                    # Actualizar também os lotes FEFO
-                    quantidade_a_baixar = quantidade
-                    lotes = ItemCompra.objects.filter(produto=produto, quantidade__gt=0).order_by('validade')
-                    for lote in lotes:
-                        if quantidade_a_baixar <= 0:
-                            break
-                        if lote.quantidade >= quantidade_a_baixar:
-                            lote.quantidade -= quantidade_a_baixar
-                            quantidade_a_baixar = 0
-                        else:
-                            quantidade_a_baixar -= lote.quantidade
-                            lote.quantidade = 0
-                        lote.save()
+                    # Actualizar também os lotes FEFO (mesmo motor das vendas)
+                    lotes.alocar_fefo({produto.id: quantidade})
                     produto.stock_actual -= quantidade
                 else:
                     produto.stock_actual += quantidade
@@ -658,77 +731,93 @@ def ajuste_stock(request):
             messages.error(request, "Erro ao ajustar stock. Tenta novamente.")
     return redirect('planeamento_compras')
 
-@login_required
-def exportar_compras_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="historico_compras.csv"'
-    response.write('\ufeff')  # BOM para Excel abrir corretamente
+# Linhas lidas da base de dados de cada vez nas exportações em streaming
+LOTE_EXPORTACAO = 2000
 
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Data', 'Fornecedor', 'Produto', 'Quantidade', 'Custo Unit.', 'Validade', 'Lote', 'Total Compra'])
 
-    compras = Compra.objects.all().order_by('-data')
-    for c in compras:
-        for item in c.itens.all():
-            writer.writerow([
-                f'#{c.id}',
-                c.data.strftime('%d/%m/%Y %H:%M'),
-                c.fornecedor.nome if c.fornecedor else '—',
-                item.produto.nome,
-                item.quantidade,
-                item.preco_custo,
-                item.validade.strftime('%d/%m/%Y'),
-                item.lote or '—',
-                c.valor_total,
-            ])
+class _Eco:
+    """Ficheiro de mentira para o csv.writer: devolve a linha em vez de a guardar."""
+    def write(self, valor):
+        return valor
 
+
+def _csv_em_streaming(nome_ficheiro, cabecalho, linhas):
+    """Resposta CSV gerada linha a linha: a memória não cresce com o histórico
+    e o primeiro byte sai antes de a query terminar."""
+    writer = csv.writer(_Eco())
+
+    def conteudo():
+        yield '\ufeff'  # BOM para Excel abrir corretamente
+        yield writer.writerow(cabecalho)
+        for linha in linhas:
+            yield writer.writerow(linha)
+
+    response = StreamingHttpResponse(conteudo(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{nome_ficheiro}"'
     return response
 
+
+def _linhas_compras():
+    # Uma query por bloco, com os JOINs a compra, fornecedor e produto. A chave
+    # é a da própria tabela (índice da FK compra_id): ordenar pela data da compra
+    # juntada obrigava a ordenar a tabela inteira em cada bloco
+    itens = em_lotes(
+        ItemCompra.objects.all(), ['-compra_id', '-id'],
+        ['compra__data', 'compra__fornecedor__nome', 'produto__nome', 'quantidade', 'preco_custo', 'validade', 'lote', 'compra__valor_total'],
+        LOTE_EXPORTACAO,
+    )
+    for i in itens:
+        yield [f"#{i['compra_id']}", i['compra__data'].strftime('%d/%m/%Y %H:%M'), i['compra__fornecedor__nome'] or '—',
+               i['produto__nome'], i['quantidade'], i['preco_custo'], i['validade'].strftime('%d/%m/%Y'), i['lote'] or '—',
+               i['compra__valor_total']]
+
+
+def _linhas_vendas():
+    metodos = dict(Venda.METODOS_PAGAMENTO)
+    itens = em_lotes(
+        ItemVenda.objects.all(), ['-venda_id', '-id'],
+        ['venda__data', 'venda__utilizador__username', 'produto__nome', 'quantidade', 'preco_unitario', 'venda__metodo_pagamento', 'venda__valor_total'],
+        LOTE_EXPORTACAO,
+    )
+    for i in itens:
+        metodo = i['venda__metodo_pagamento']
+        yield [f"#{i['venda_id']}", i['venda__data'].strftime('%d/%m/%Y %H:%M'), i['venda__utilizador__username'],
+               i['produto__nome'], i['quantidade'], i['preco_unitario'], i['quantidade'] * i['preco_unitario'],
+               metodos.get(metodo, metodo), i['venda__valor_total']]
+
+
+@login_required
+def exportar_compras_csv(request):
+    return _csv_em_streaming(
+        'historico_compras.csv',
+        ['ID', 'Data', 'Fornecedor', 'Produto', 'Quantidade', 'Custo Unit.', 'Validade', 'Lote', 'Total Compra'],
+        _linhas_compras(),
+    )
+
 @login_required
 def exportar_vendas_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="historico_vendas.csv"'
-    response.write('\ufeff')
+    return _csv_em_streaming(
+        'historico_vendas.csv',
+        ['ID', 'Data', 'Utilizador', 'Produto', 'Quantidade', 'Preço Unit.', 'Subtotal', 'Método Pagamento', 'Total Venda'],
+        _linhas_vendas(),
+    )
 
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Data', 'Utilizador', 'Produto', 'Quantidade', 'Preço Unit.', 'Subtotal', 'Método Pagamento', 'Total Venda'])
-
-    for v in Venda.objects.all().order_by('-data'):
-        for item in v.itens.all():
-            writer.writerow([
-                f'#{v.id}',
-                v.data.strftime('%d/%m/%Y %H:%M'),
-                v.utilizador.username,
-                item.produto.nome,
-                item.quantidade,
-                item.preco_unitario,
-                item.total_item(),
-                v.get_metodo_pagamento_display(),
-                v.valor_total,
-            ])
 
-    return response
+def _movimentos_extrato():
+    # Diário de caixa pelo índice (momento, id), mais recente primeiro, aos blocos
+    movimentos = em_lotes(extrato.movimentos(), ['-momento', '-id'], extrato.CAMPOS, LOTE_EXPORTACAO)
+    for m in diario.em_sequencia_com_saldo(movimentos):
+        m['tipo'] = 'Entrada' if m['origem'] in diario.ENTRADAS else 'Saída'
+        yield m
 
 
 @login_required  
 def exportar_extrato_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="extrato_caixa.csv"'
-    response.write('\ufeff')
-
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Data', 'Descrição', 'Tipo', 'Valor (Kz)'])
-
-    for v in Venda.objects.all():
-        writer.writerow([f'V-{v.id}', v.data.strftime('%d/%m/%Y'), 'Venda', 'Entrada', v.valor_total])
-    for e in ReceitaExtra.objects.all():
-        writer.writerow([f'R-{e.id}', e.data.strftime('%d/%m/%Y'), e.descricao, 'Entrada', e.valor])
-    for d in Despesa.objects.all():
-        writer.writerow([f'D-{d.id}', d.data.strftime('%d/%m/%Y'), d.descricao, 'Saída', d.valor])
-    for c in Compra.objects.all():
-        writer.writerow([f'C-{c.id}', c.data.strftime('%d/%m/%Y'), 'Compra de stock', 'Saída', c.valor_total])
-
-    return response
+    linhas = (
+        [f"{m['origem']}-{m['origem_id']}", m['momento'].strftime('%d/%m/%Y'), m['descricao'], m['tipo'], m['valor'], m['saldo']]
+        for m in _movimentos_extrato()
+    )
+    return _csv_em_streaming('extrato_caixa.csv', ['ID', 'Data', 'Descrição', 'Tipo', 'Valor (Kz)', 'Saldo (Kz)'], linhas)
 
 # views.py
 @login_required
@@ -740,342 +829,41 @@ def exportar_relatorio_csv(request):
     writer = csv.writer(response)
     writer.writerow(['Mês/Ano', 'Receitas (Kz)', 'Custos (Kz)', 'Resultado (Kz)', 'Margem (%)'])
 
-    meses_vendas = set(Venda.objects.dates('data', 'month'))
-    meses_despesas = set(Despesa.objects.dates('data', 'month'))
-    meses_compras = set(Compra.objects.dates('data', 'month'))
-    meses_extras = set(ReceitaExtra.objects.dates('data', 'month'))
-    todos_meses = sorted(meses_vendas | meses_despesas | meses_compras | meses_extras, reverse=True)
-
-    for d_mes in todos_meses:
-        v = float(Venda.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        e = float(ReceitaExtra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        d = float(Despesa.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        c = float(Compra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        receitas = v + e
-        custos = d + c
-        lucro = receitas - custos
-        margem = (lucro / receitas * 100) if receitas > 0 else 0
+    # Série mensal partilhada com o separador financeiro (uma query, em cache)
+    for m in relatorios_servico.mensal():
+        d_mes, receitas, custos, lucro, margem = m['mes'], m['vendas'], m['saidas'], m['lucro'], m['margem']
         writer.writerow([d_mes.strftime('%B %Y'), receitas, custos, lucro, f"{margem:.1f}"])
 
     return response
 
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from docx import Document
-from docx.shared import Pt, RGBColor
-import io
-
-# ─── HELPERS ──────────────────────────────────────────────────────────────
-
-def pdf_response(filename):
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
-
-def word_response(filename):
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
-
-def estilo_tabela_pdf():
-    return TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#4b0082')),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,0), 9),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.white, colors.HexColor('#faf5ff')]),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#e0d0f0')),
-        ('FONTSIZE', (0,1), (-1,-1), 8),
-        ('TOPPADDING', (0,0), (-1,-1), 6),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-    ])
-
-def cabecalho_word(doc, titulo):
-    from docx.shared import Pt, RGBColor
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    p = doc.add_heading(titulo, 0)
-    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = p.runs[0]
-    run.font.color.rgb = RGBColor(0x4b, 0x00, 0x82)
-    doc.add_paragraph(f"Universo de Beleza — Exportado em {timezone.now().strftime('%d/%m/%Y %H:%M')}")
-    doc.add_paragraph()
-
-# ─── VENDAS PDF ───────────────────────────────────────────────────────────
-
-@login_required
-def exportar_vendas_pdf(request):
-    response = pdf_response('historico_vendas.pdf')
-    doc = SimpleDocTemplate(response, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elementos = []
-
-    elementos.append(Paragraph('Histórico de Vendas', styles['Title']))
-    elementos.append(Paragraph(f'Universo de Beleza — {timezone.now().strftime("%d/%m/%Y %H:%M")}', styles['Normal']))
-    elementos.append(Spacer(1, 0.5*cm))
-
-    dados = [['ID', 'Data', 'Utilizador', 'Método', 'Total (Kz)']]
-    for v in Venda.objects.all().order_by('-data'):
-        dados.append([
-            f'#{v.id}',
-            v.data.strftime('%d/%m/%Y %H:%M'),
-            v.utilizador.username,
-            v.get_metodo_pagamento_display(),
-            f'{v.valor_total:,.2f}',
-        ])
-
-    tabela = Table(dados, colWidths=[2*cm, 4*cm, 3*cm, 3*cm, 4*cm])
-    tabela.setStyle(estilo_tabela_pdf())
-    elementos.append(tabela)
-    doc.build(elementos)
-    return response
-
-# ─── VENDAS WORD ──────────────────────────────────────────────────────────
+# ─── EXPORTAÇÕES PDF / WORD (fila + worker) ──────────────────────────────
 
 @login_required
-def exportar_vendas_word(request):
-    doc = Document()
-    cabecalho_word(doc, 'Histórico de Vendas')
-    tabela = doc.add_table(rows=1, cols=5)
-    tabela.style = 'Table Grid'
-    cabecalhos = ['ID', 'Data', 'Utilizador', 'Método', 'Total (Kz)']
-    for i, h in enumerate(cabecalhos):
-        cell = tabela.rows[0].cells[i]
-        cell.text = h
-        cell.paragraphs[0].runs[0].bold = True
-
-    for v in Venda.objects.all().order_by('-data'):
-        row = tabela.add_row().cells
-        row[0].text = f'#{v.id}'
-        row[1].text = v.data.strftime('%d/%m/%Y %H:%M')
-        row[2].text = v.utilizador.username
-        row[3].text = v.get_metodo_pagamento_display()
-        row[4].text = f'{v.valor_total:,.2f} Kz'
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    response = word_response('historico_vendas.docx')
-    response.write(buffer.read())
-    return response
+def pedir_exportacao(request, documento, formato):
+    # O ficheiro é gerado pelo worker (processar_exportacoes), fora do pedido
+    tarefa = exportacoes.pedir(documento, formato, request.user)
+    return redirect('exportacao', tarefa_id=tarefa.id)
 
-# ─── COMPRAS PDF ──────────────────────────────────────────────────────────
 
 @login_required
-def exportar_compras_pdf(request):
-    response = pdf_response('historico_compras.pdf')
-    doc = SimpleDocTemplate(response, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elementos = []
-
-    elementos.append(Paragraph('Histórico de Compras', styles['Title']))
-    elementos.append(Paragraph(f'Universo de Beleza — {timezone.now().strftime("%d/%m/%Y %H:%M")}', styles['Normal']))
-    elementos.append(Spacer(1, 0.5*cm))
-
-    dados = [['ID', 'Data', 'Fornecedor', 'Produto', 'Qtd', 'Custo Unit.', 'Validade']]
-    for c in Compra.objects.all().order_by('-data'):
-        for item in c.itens.all():
-            dados.append([
-                f'#{c.id}',
-                c.data.strftime('%d/%m/%Y'),
-                c.fornecedor.nome if c.fornecedor else '—',
-                item.produto.nome,
-                str(item.quantidade),
-                f'{item.preco_custo:,.2f}',
-                item.validade.strftime('%d/%m/%Y'),
-            ])
-
-    tabela = Table(dados, colWidths=[1.5*cm, 2.5*cm, 3*cm, 3.5*cm, 1.5*cm, 2.5*cm, 2.5*cm])
-    tabela.setStyle(estilo_tabela_pdf())
-    elementos.append(tabela)
-    doc.build(elementos)
-    return response
-
-# ─── COMPRAS WORD ─────────────────────────────────────────────────────────
-
-@login_required
-def exportar_compras_word(request):
-    doc = Document()
-    cabecalho_word(doc, 'Histórico de Compras')
-    tabela = doc.add_table(rows=1, cols=7)
-    tabela.style = 'Table Grid'
-    cabecalhos = ['ID', 'Data', 'Fornecedor', 'Produto', 'Qtd', 'Custo Unit.', 'Validade']
-    for i, h in enumerate(cabecalhos):
-        cell = tabela.rows[0].cells[i]
-        cell.text = h
-        cell.paragraphs[0].runs[0].bold = True
-
-    for c in Compra.objects.all().order_by('-data'):
-        for item in c.itens.all():
-            row = tabela.add_row().cells
-            row[0].text = f'#{c.id}'
-            row[1].text = c.data.strftime('%d/%m/%Y')
-            row[2].text = c.fornecedor.nome if c.fornecedor else '—'
-            row[3].text = item.produto.nome
-            row[4].text = str(item.quantidade)
-            row[5].text = f'{item.preco_custo:,.2f} Kz'
-            row[6].text = item.validade.strftime('%d/%m/%Y')
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    response = word_response('historico_compras.docx')
-    response.write(buffer.read())
-    return response
-
-# ─── EXTRATO PDF ──────────────────────────────────────────────────────────
-
-@login_required
-def exportar_extrato_pdf(request):
-    response = pdf_response('extrato_caixa.pdf')
-    doc = SimpleDocTemplate(response, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elementos = []
-
-    elementos.append(Paragraph('Extrato de Caixa', styles['Title']))
-    elementos.append(Paragraph(f'Universo de Beleza — {timezone.now().strftime("%d/%m/%Y %H:%M")}', styles['Normal']))
-    elementos.append(Spacer(1, 0.5*cm))
-
-    movs = []
-    for v in Venda.objects.all(): movs.append({'data': v.data.date(), 'desc': 'Venda', 'tipo': 'Entrada', 'valor': float(v.valor_total)})
-    for e in ReceitaExtra.objects.all(): movs.append({'data': e.data, 'desc': e.descricao, 'tipo': 'Entrada', 'valor': float(e.valor)})
-    for d in Despesa.objects.all(): movs.append({'data': d.data, 'desc': d.descricao, 'tipo': 'Saída', 'valor': float(d.valor)})
-    for c in Compra.objects.all(): movs.append({'data': c.data.date(), 'desc': 'Compra', 'tipo': 'Saída', 'valor': float(c.valor_total)})
-    movs = sorted(movs, key=lambda x: x['data'], reverse=True)
-
-    dados = [['Data', 'Descrição', 'Tipo', 'Valor (Kz)']]
-    for m in movs:
-        dados.append([
-            m['data'].strftime('%d/%m/%Y'),
-            m['desc'],
-            m['tipo'],
-            f'{m["valor"]:,.2f}',
-        ])
-
-    tabela = Table(dados, colWidths=[3*cm, 7*cm, 3*cm, 4*cm])
-    tabela.setStyle(estilo_tabela_pdf())
-    elementos.append(tabela)
-    doc.build(elementos)
-    return response
-
-# ─── EXTRATO WORD ─────────────────────────────────────────────────────────
-
-@login_required
-def exportar_extrato_word(request):
-    doc = Document()
-    cabecalho_word(doc, 'Extrato de Caixa')
-    tabela = doc.add_table(rows=1, cols=4)
-    tabela.style = 'Table Grid'
-    for i, h in enumerate(['Data', 'Descrição', 'Tipo', 'Valor (Kz)']):
-        cell = tabela.rows[0].cells[i]
-        cell.text = h
-        cell.paragraphs[0].runs[0].bold = True
-
-    movs = []
-    for v in Venda.objects.all(): movs.append({'data': v.data.date(), 'desc': 'Venda', 'tipo': 'Entrada', 'valor': float(v.valor_total)})
-    for e in ReceitaExtra.objects.all(): movs.append({'data': e.data, 'desc': e.descricao, 'tipo': 'Entrada', 'valor': float(e.valor)})
-    for d in Despesa.objects.all(): movs.append({'data': d.data, 'desc': d.descricao, 'tipo': 'Saída', 'valor': float(d.valor)})
-    for c in Compra.objects.all(): movs.append({'data': c.data.date(), 'desc': 'Compra', 'tipo': 'Saída', 'valor': float(c.valor_total)})
-    movs = sorted(movs, key=lambda x: x['data'], reverse=True)
-
-    for m in movs:
-        row = tabela.add_row().cells
-        row[0].text = m['data'].strftime('%d/%m/%Y')
-        row[1].text = m['desc']
-        row[2].text = m['tipo']
-        row[3].text = f'{m["valor"]:,.2f} Kz'
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    response = word_response('extrato_caixa.docx')
-    response.write(buffer.read())
-    return response
-
-# ─── RELATÓRIOS PDF ───────────────────────────────────────────────────────
-
-@login_required
-def exportar_relatorio_pdf(request):
-    response = pdf_response('relatorios_mensais.pdf')
-    doc = SimpleDocTemplate(response, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elementos = []
-
-    elementos.append(Paragraph('Relatórios Mensais', styles['Title']))
-    elementos.append(Paragraph(f'Universo de Beleza — {timezone.now().strftime("%d/%m/%Y %H:%M")}', styles['Normal']))
-    elementos.append(Spacer(1, 0.5*cm))
-
-    meses_vendas = set(Venda.objects.dates('data', 'month'))
-    meses_despesas = set(Despesa.objects.dates('data', 'month'))
-    meses_compras = set(Compra.objects.dates('data', 'month'))
-    meses_extras = set(ReceitaExtra.objects.dates('data', 'month'))
-    todos_meses = sorted(meses_vendas | meses_despesas | meses_compras | meses_extras, reverse=True)
-
-    dados = [['Mês / Ano', 'Receitas (Kz)', 'Custos (Kz)', 'Resultado (Kz)', 'Margem %']]
-    for d_mes in todos_meses:
-        v = float(Venda.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        e = float(ReceitaExtra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        d = float(Despesa.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        c = float(Compra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        receitas = v + e
-        custos = d + c
-        lucro = receitas - custos
-        margem = (lucro / receitas * 100) if receitas > 0 else 0
-        dados.append([
-            d_mes.strftime('%B %Y').upper(),
-            f'{receitas:,.2f}',
-            f'{custos:,.2f}',
-            f'{lucro:,.2f}',
-            f'{margem:.1f}%',
-        ])
-
-    tabela = Table(dados, colWidths=[4*cm, 3.5*cm, 3.5*cm, 3.5*cm, 2.5*cm])
-    tabela.setStyle(estilo_tabela_pdf())
-    elementos.append(tabela)
-    doc.build(elementos)
-    return response
+def exportacao(request, tarefa_id):
+    tarefa = get_object_or_404(TarefaExportacao.objects.defer('conteudo'), id=tarefa_id)
+    # Lugar na fila enquanto espera pelo worker
+    na_fila = TarefaExportacao.objects.filter(estado='P', id__lt=tarefa.id).count() + 1 if tarefa.estado == 'P' else 0
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'estado': tarefa.estado, 'estado_nome': tarefa.get_estado_display(), 'progresso': tarefa.progresso,
+            'na_fila': na_fila, 'erro': tarefa.erro,
+            'descarregar': reverse('descarregar_exportacao', args=[tarefa.id]) if tarefa.estado == 'C' else None,
+        })
+    recentes = TarefaExportacao.objects.defer('conteudo').select_related('pedido_por').order_by('-id')[:10]
+    return render(request, 'exportacao.html', {'tarefa': tarefa, 'na_fila': na_fila, 'recentes': recentes})
 
-# ─── RELATÓRIOS WORD ──────────────────────────────────────────────────────
 
 @login_required
-def exportar_relatorio_word(request):
-    doc = Document()
-    cabecalho_word(doc, 'Relatórios Mensais')
-    tabela = doc.add_table(rows=1, cols=5)
-    tabela.style = 'Table Grid'
-    for i, h in enumerate(['Mês / Ano', 'Receitas (Kz)', 'Custos (Kz)', 'Resultado (Kz)', 'Margem %']):
-        cell = tabela.rows[0].cells[i]
-        cell.text = h
-        cell.paragraphs[0].runs[0].bold = True
-
-    meses_vendas = set(Venda.objects.dates('data', 'month'))
-    meses_despesas = set(Despesa.objects.dates('data', 'month'))
-    meses_compras = set(Compra.objects.dates('data', 'month'))
-    meses_extras = set(ReceitaExtra.objects.dates('data', 'month'))
-    todos_meses = sorted(meses_vendas | meses_despesas | meses_compras | meses_extras, reverse=True)
-
-    for d_mes in todos_meses:
-        v = float(Venda.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        e = float(ReceitaExtra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        d = float(Despesa.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor'))['valor__sum'] or 0)
-        c = float(Compra.objects.filter(data__month=d_mes.month, data__year=d_mes.year).aggregate(Sum('valor_total'))['valor_total__sum'] or 0)
-        receitas = v + e
-        custos = d + c
-        lucro = receitas - custos
-        margem = (lucro / receitas * 100) if receitas > 0 else 0
-        row = tabela.add_row().cells
-        row[0].text = d_mes.strftime('%B %Y').upper()
-        row[1].text = f'{receitas:,.2f} Kz'
-        row[2].text = f'{custos:,.2f} Kz'
-        row[3].text = f'{lucro:,.2f} Kz'
-        row[4].text = f'{margem:.1f}%'
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    response = word_response('relatorios_mensais.docx')
-    response.write(buffer.read())
+def descarregar_exportacao(request, tarefa_id):
+    tarefa = get_object_or_404(TarefaExportacao, id=tarefa_id, estado='C')
+    tipo, _ = exportacoes.TIPOS[tarefa.formato]
+    response = HttpResponse(bytes(tarefa.conteudo), content_type=tipo)
+    response['Content-Disposition'] = f'attachment; filename="{tarefa.nome_ficheiro}"'
     return response
\ No newline at end of file